@@ -0,0 +1,155 @@
+"""背景提示：在獨立的工作行程中搜尋建議的下一步，遊戲主循環只收發訊息，不會被搜尋卡住
+
+遊戲每次狀態改變就送出新的要求（帶遞增的編號），工作行程每展開一個節點都會檢查
+是否有更新的要求，有就立刻放棄目前的搜尋。解答資料庫認得目前狀態時直接查表；
+否則先送出朝終點走的粗略建議，再以 solver 搜尋，找到最佳解後才送出最終結果（搜尋途中
+不會送出其他建議）。處理要求時發生錯誤會送出「無建議」的最終結果並印出錯誤，工作行程
+意外結束時 Advisor.alive 變為 False。
+"""
+import multiprocessing
+import traceback
+
+import solver
+import tablebase
+from engine import DIRECTIONS, Engine, cell_of, neighbor_offsets
+
+
+class Hint:
+    """一則建議：action 為 solver 格式的動作，turns 為通關前還要結束的回合數（未知為 None）
+
+    final 為 True 表示這是此狀態最終的結果（action 為 None 表示無法在回合限制內通關）。
+    """
+    __slots__ = ("action", "turns", "final")
+
+    def __init__(self, action, turns, final):
+        self.action = action
+        self.turns = turns
+        self.final = final
+
+    def __eq__(self, other):
+        return isinstance(other, Hint) and (self.action, self.turns, self.final) == (
+            other.action, other.turns, other.final)
+
+
+def search_key(engine):
+    """決定建議的欄位（與 solver.initial_state 讀取的相同）
+
+    選取中的技能、靜止範圍預覽與行動記錄不影響搜尋，滑鼠移動預覽時不會重新開始搜尋。
+    """
+    start_enemies = engine.turn_start_enemies
+    return (tuple(engine.player_pos), engine.player_moves_left, engine.turn, engine.is_first_turn,
+            engine.enemies.pack(), engine.door_mask, engine.yellow_plate_active,
+            engine.skill1_uses, engine.skill1_used_this_turn, engine.skill2_uses, engine.skill2_used_this_turn,
+            tuple(engine.turn_start_player_pos), start_enemies.pack() if start_enemies is not None else None)
+
+
+def rough_action(engine):
+    """粗略的建議：所有門都打開時離終點更近的一步，沒有這樣的一步就結束回合"""
+    size = engine.size
+    goal = cell_of(engine.goal_pos, size)
+    cell = cell_of(engine.player_pos, size)
+    distances = engine.distances.distances_to((1 << len(engine.door_names)) - 1, goal)
+    occupied = {state >> 2 for state in engine.enemies.states}
+    if engine.player_moves_left > 0 and distances[cell] is not None:
+        for d, (direction, offset) in enumerate(zip(DIRECTIONS, neighbor_offsets(size))):
+            target = cell + offset
+            if (engine.can_step(engine.door_mask, cell, d) and target not in occupied
+                    and distances[target] is not None and distances[target] < distances[cell]):
+                return ("move_player",) + direction.value
+    return ("end_turn",)
+
+
+def _worker(conn, level, tablebase_path):
+    """工作行程：永遠只處理最新的要求"""
+    engine = Engine(level)
+    table = tablebase.open_for(level, tablebase_path) if tablebase_path else None
+    request = conn.recv()
+    while request is not None:
+        while conn.poll():
+            request = conn.recv()
+            if request is None:
+                return
+        generation, state = request
+        try:
+            _answer(conn, generation, engine, state, table)
+        except Exception:
+            traceback.print_exc()
+            conn.send((generation, Hint(None, None, True)))
+        request = conn.recv()
+
+
+def _answer(conn, generation, engine, state, table):
+    """處理一個要求：查表，或先送出粗略建議再搜尋最佳解（有更新的要求時放棄）"""
+    engine.set_state(state)
+    best = table.best_action(engine) if table is not None else None
+    if best is not None:
+        conn.send((generation, Hint(*best, True)))
+        return
+    conn.send((generation, Hint(rough_action(engine), None, False)))
+    result = solver.solve(engine, stop=conn.poll)
+    if not result.stats.get("stopped"):
+        conn.send((generation, Hint(result.actions[0], result.turns - engine.turn, True)
+                   if result.solved else Hint(None, None, True)))
+
+
+class Advisor:
+    """遊戲端的介面：update() 送出新狀態、poll() 收取結果，兩者都不會阻塞"""
+
+    def __init__(self, level, tablebase_path=None):
+        self.conn, child_conn = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=_worker, args=(child_conn, level, tablebase_path),
+                                               daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.generation = 0
+        self.key = None
+        self.hint = None  # 目前狀態的最新建議，尚未收到時為 None
+        self.alive = True  # 工作行程意外結束後為 False，不再送出要求
+
+    @property
+    def searching(self):
+        """目前狀態的最終結果是否還沒收到（工作行程已結束時為 False）"""
+        return self.alive and self.key is not None and (self.hint is None or not self.hint.final)
+
+    def update(self, engine):
+        """狀態改變時送出新的要求（舊的搜尋會被放棄）；不是玩家回合或遊戲結束時清除建議"""
+        if not engine.player_turn or engine.game_won or engine.game_lost:
+            key = None
+        else:
+            key = search_key(engine)
+        if key == self.key:
+            return
+        self.key = key
+        self.hint = None
+        if key is not None and self.alive:
+            self.generation += 1
+            state = engine.get_state()._replace(selected_skill=None, stun_area=None, action_log=())
+            try:
+                self.conn.send((self.generation, state))
+            except OSError:
+                pass  # 工作行程已結束，由 poll() 發現並回報
+
+    def poll(self):
+        """收取工作行程送回的結果，只保留目前狀態的建議；建議改變或工作行程結束時回傳 True"""
+        alive = self.alive
+        changed = False
+        try:
+            while self.conn.poll():
+                generation, hint = self.conn.recv()
+                if generation == self.generation and self.key is not None and hint != self.hint:
+                    self.hint = hint
+                    changed = True
+        except (EOFError, OSError):
+            self.alive = False
+        if self.alive and not self.process.is_alive():
+            self.alive = False
+        return changed or alive != self.alive
+
+    def close(self):
+        try:
+            self.conn.send(None)
+        except OSError:
+            pass
+        self.process.join(1)
+        if self.process.is_alive():
+            self.process.terminate()
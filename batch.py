@@ -0,0 +1,279 @@
+"""NumPy 批次模擬器：同時推進 N 局遊戲，規則與 Engine 相同
+
+用法：
+    python batch.py [局數] [步數]
+
+每局狀態以陣列保存（格子索引 = (x-1) + (y-1) * 棋盤大小，敵人狀態 = 格子 * 4 + 方向索引），
+step() 一次對所有局面套用一個動作向量。執行時會先與 Engine 逐局比對，再量測每秒狀態數。
+"""
+import sys
+import time
+
+import numpy as np
+
+from engine import Engine, DIRECTIONS, LazyPassable, cell_of, neighbor_offsets, pos_of
+
+# 動作代碼：0~3 為往 DIRECTIONS 方向移動
+MOVE_UP, MOVE_DOWN, MOVE_LEFT, MOVE_RIGHT = range(4)
+END_TURN = 4
+SKILL1_PLAYER = 5
+SKILL1_ENEMY = 6  # 參數為敵人索引
+SKILL2 = 7  # 參數為靜止範圍中心的格子索引
+NOOP = -1
+
+
+class BatchEngine:
+    """以 NumPy 陣列保存 N 局遊戲的動態狀態"""
+
+    def __init__(self, n, engine=None):
+        engine = engine or Engine()
+        kernel = engine.kernel
+        self.size = engine.size
+        self.player_moves = engine.player_moves
+        cells = self.size * self.size
+        masks = 1 << len(engine.door_names)
+        if isinstance(engine.passable, LazyPassable):
+            raise ValueError(f"門太多（{len(engine.door_names)} 個），批次模擬需要完整的通行表")
+        # 移動方向對應的格子索引位移
+        self.offsets = np.array(neighbor_offsets(self.size))
+        # 靜態關卡資料
+        self.passable = np.frombuffer(bytes(engine.passable), dtype=np.uint8).reshape(masks, cells, 4).astype(bool)
+        # 大棋盤的轉移表是查詢時才計算的，這裡需要完整的表
+        self.turn_tables = np.array([[kernel.walk(mask, state) for state in range(cells * 4)] if kernel.lazy
+                                     else kernel.turn_table(mask) for mask in range(masks)], dtype=np.int32)
+        self.yellow_bits = kernel.yellow_bits
+        self.plate_bits = np.array([bit for bit, _, _ in kernel.plate_groups])
+        self.plate_needs = np.array([need for _, _, need in kernel.plate_groups])
+        self.on_plate = np.zeros((len(kernel.plate_groups), cells), dtype=bool)
+        for g, (_, plates, _) in enumerate(kernel.plate_groups):
+            self.on_plate[g, list(plates)] = True
+        self.yellow_plate = cell_of(engine.yellow_plate, self.size)
+        self.goal = cell_of(engine.goal_pos, self.size)
+        self.max_turns = engine.max_turns
+        self.n = n
+        self.load(engine.get_state())
+
+    def load(self, state):
+        """所有局面都設為同一個 GameState"""
+        n = self.n
+        full = lambda value, dtype: np.full(n, value, dtype=dtype)
+        size = self.size
+        enemies = np.array([cell_of((x, y), size) * 4 + d for x, y, d, _ in state.enemies], dtype=np.int32)
+        self.player = full(cell_of(state.player, size), np.int32)
+        self.moves_left = full(state.moves_left, np.int8)
+        self.enemies = np.tile(enemies, (n, 1))
+        self.stunned = np.tile(np.array([e[3] for e in state.enemies], dtype=np.int8), (n, 1))
+        self.turn = full(state.turn, np.int16)
+        self.is_first_turn = full(state.is_first_turn, bool)
+        self.turn_start_player = full(cell_of(state.turn_start_player, size), np.int32)
+        self.has_turn_start_enemies = full(state.turn_start_enemies is not None, bool)
+        if state.turn_start_enemies is not None:
+            start = np.array([cell_of((x, y), size) * 4 + d for x, y, d, _ in state.turn_start_enemies],
+                             dtype=np.int32)
+            self.turn_start_enemies = np.tile(start, (n, 1))
+        else:
+            self.turn_start_enemies = self.enemies.copy()
+        self.skill1_uses = full(state.skill1_uses, np.int8)
+        self.skill2_uses = full(state.skill2_uses, np.int8)
+        self.skill1_used = full(state.skill1_used_this_turn, bool)
+        self.skill2_used = full(state.skill2_used_this_turn, bool)
+        self.yellow = full(state.yellow_plate_active, bool)
+        self.door_mask = full(state.door_mask, np.int32)
+        self.won = full(state.game_won, bool)
+        self.lost = full(state.game_lost, bool)
+
+    def update_doors(self, rows):
+        """對 rows 中的局面重新計算門遮罩（與 Engine.update_doors 相同）"""
+        counts = self.on_plate[:, self.enemies[rows] >> 2].sum(axis=2)  # (顏色, 局面)
+        opened = counts == self.plate_needs[:, None]
+        mask = (opened * self.plate_bits[:, None]).sum(axis=0)
+        self.door_mask[rows] = np.where(self.yellow[rows], mask | self.yellow_bits, mask)
+
+    def step(self, actions, args=None):
+        """每局套用一個動作（NOOP 表示不動作），回傳每局動作是否成功"""
+        actions = np.asarray(actions)
+        args = np.zeros(self.n, dtype=np.int64) if args is None else np.asarray(args)
+        ok = np.zeros(self.n, dtype=bool)
+        rows = np.nonzero(actions < END_TURN)[0]
+        rows = rows[actions[rows] >= 0]
+        if len(rows):
+            ok[rows] = self._move_player(rows, actions[rows])
+        rows = np.nonzero(actions == END_TURN)[0]
+        if len(rows):
+            self._end_turn(rows)
+            ok[rows] = True
+        rows = np.nonzero(actions == SKILL1_PLAYER)[0]
+        if len(rows):
+            ok[rows] = self._skill1_player(rows)
+        rows = np.nonzero(actions == SKILL1_ENEMY)[0]
+        if len(rows):
+            ok[rows] = self._skill1_enemy(rows, args[rows])
+        rows = np.nonzero(actions == SKILL2)[0]
+        if len(rows):
+            ok[rows] = self._skill2(rows, args[rows])
+        return ok
+
+    def _move_player(self, rows, dirs):
+        player = self.player[rows]
+        can = (self.moves_left[rows] > 0) & self.passable[self.door_mask[rows], player, dirs]
+        rows, player, dirs = rows[can], player[can], dirs[can]
+        player = player + self.offsets[dirs]
+        self.player[rows] = player
+        self.moves_left[rows] -= 1
+        # 踩到黃色壓版會切換黃色門
+        toggled = rows[player == self.yellow_plate]
+        if len(toggled):
+            self.yellow[toggled] = ~self.yellow[toggled]
+            self.update_doors(toggled)
+        self.won[rows[player == self.goal]] = True
+        return can
+
+    def _end_turn(self, rows):
+        first = self.is_first_turn[rows]
+        self.is_first_turn[rows] = False
+        self.turn[rows] += 1
+        lost = ~first & (self.turn[rows] > self.max_turns)
+        self.lost[rows[lost]] = True
+        rows = rows[~lost]
+        self.moves_left[rows] = self.player_moves
+        self.skill1_used[rows] = False
+        self.skill2_used[rows] = False
+        self.turn_start_enemies[rows] = self.enemies[rows]
+        self.has_turn_start_enemies[rows] = True
+        # 敵人移動：整個敵人階段使用移動前的門狀態，被靜止的敵人原地不動
+        stunned = self.stunned[rows] > 0
+        moved = self.turn_tables[self.door_mask[rows][:, None], self.enemies[rows]]
+        self.enemies[rows] = np.where(stunned, self.enemies[rows], moved)
+        self.stunned[rows] -= stunned.astype(np.int8)
+        self.update_doors(rows)
+        self.turn_start_player[rows] = self.player[rows]
+
+    def _skill1_player(self, rows):
+        can = ~self.skill1_used[rows] & (self.skill1_uses[rows] > 0)
+        rows = rows[can]
+        self.player[rows] = self.turn_start_player[rows]
+        self.skill1_uses[rows] -= 1
+        self.skill1_used[rows] = True
+        return can
+
+    def _skill1_enemy(self, rows, which):
+        can = ~self.skill1_used[rows] & (self.skill1_uses[rows] > 0) & self.has_turn_start_enemies[rows]
+        rows, which = rows[can], which[can]
+        self.enemies[rows, which] = self.turn_start_enemies[rows, which]
+        self.skill1_uses[rows] -= 1
+        self.skill1_used[rows] = True
+        self.update_doors(rows)
+        return can
+
+    def _skill2(self, rows, centers):
+        can = ~self.skill2_used[rows] & (self.skill2_uses[rows] > 0)
+        rows, centers = rows[can], centers[can]
+        cells = self.enemies[rows] >> 2
+        size = self.size
+        hit = ((np.abs(cells % size - (centers % size)[:, None]) <= 1)
+               & (np.abs(cells // size - (centers // size)[:, None]) <= 1))
+        self.stunned[rows] = np.where(hit, 1, self.stunned[rows])
+        any_hit = hit.any(axis=1)
+        rows = rows[any_hit]
+        self.skill2_uses[rows] -= 1
+        self.skill2_used[rows] = True
+        can[can] = any_hit
+        return can
+
+    def snapshot(self, i):
+        """第 i 局的狀態摘要，可與 engine_snapshot() 比較"""
+        return (int(self.player[i]), int(self.moves_left[i]),
+                tuple(map(int, self.enemies[i])), tuple(map(int, self.stunned[i])),
+                int(self.turn[i]), bool(self.is_first_turn[i]), int(self.turn_start_player[i]),
+                tuple(map(int, self.turn_start_enemies[i])) if self.has_turn_start_enemies[i] else None,
+                int(self.skill1_uses[i]), int(self.skill2_uses[i]),
+                bool(self.skill1_used[i]), bool(self.skill2_used[i]),
+                bool(self.yellow[i]), int(self.door_mask[i]), bool(self.won[i]), bool(self.lost[i]))
+
+
+def engine_snapshot(engine):
+    """Engine 狀態摘要，格式與 BatchEngine.snapshot() 相同"""
+    state = engine.get_state()
+    size = engine.size
+    pack = lambda enemies: tuple(cell_of((x, y), size) * 4 + d for x, y, d, _ in enemies)
+    return (cell_of(state.player, size), state.moves_left,
+            pack(state.enemies), tuple(e[3] for e in state.enemies),
+            state.turn, state.is_first_turn, cell_of(state.turn_start_player, size),
+            pack(state.turn_start_enemies) if state.turn_start_enemies is not None else None,
+            state.skill1_uses, state.skill2_uses,
+            state.skill1_used_this_turn, state.skill2_used_this_turn,
+            state.yellow_plate_active, state.door_mask, state.game_won, state.game_lost)
+
+
+def apply_scalar(engine, action, arg):
+    """對 Engine 套用與 BatchEngine.step 相同編碼的動作"""
+    if 0 <= action < END_TURN:
+        dx, dy = DIRECTIONS[action].value
+        return engine.move_player(dx, dy, log_action=False)
+    if action == END_TURN:
+        engine.end_turn()
+        return True
+    if action == SKILL1_PLAYER:
+        return engine.use_skill1_on_player()
+    if action == SKILL1_ENEMY:
+        return engine.use_skill1_on_enemy(arg)
+    if action == SKILL2:
+        return engine.use_skill2(*pos_of(arg, engine.size))
+    return False
+
+
+def random_actions(rng, n, enemies, cells):
+    """隨機動作向量：大多是移動，偶爾結束回合或使用技能"""
+    actions = rng.choice([0, 1, 2, 3, 0, 1, 2, 3, END_TURN, END_TURN, SKILL1_PLAYER, SKILL1_ENEMY, SKILL2, NOOP], size=n)
+    args = np.where(actions == SKILL1_ENEMY, rng.integers(0, enemies, size=n), rng.integers(0, cells, size=n))
+    return actions, args
+
+
+def validate(games=200, steps=200, seed=0):
+    """以隨機動作同時推進 BatchEngine 與逐局的 Engine，回傳不一致的 (步數, 局) 清單"""
+    rng = np.random.default_rng(seed)
+    batch = BatchEngine(games)
+    engines = [Engine() for _ in range(games)]
+    mismatches = []
+    for step in range(steps):
+        actions, args = random_actions(rng, games, len(engines[0].enemies), batch.size * batch.size)
+        ok = batch.step(actions, args)
+        for i, engine in enumerate(engines):
+            if apply_scalar(engine, int(actions[i]), int(args[i])) != bool(ok[i]) or \
+                    engine_snapshot(engine) != batch.snapshot(i):
+                mismatches.append((step, i))
+    return mismatches
+
+
+def benchmark(games=10000, steps=200, seed=0):
+    """回傳 (批次每秒狀態數, Engine 每秒狀態數)"""
+    rng = np.random.default_rng(seed)
+    batch = BatchEngine(games)
+    plan = [random_actions(rng, games, batch.enemies.shape[1], batch.size * batch.size) for _ in range(steps)]
+    start = time.perf_counter()
+    for actions, args in plan:
+        batch.step(actions, args)
+    batch_rate = games * steps / (time.perf_counter() - start)
+
+    sample = min(games, 200)
+    engines = [Engine() for _ in range(sample)]
+    start = time.perf_counter()
+    for actions, args in plan:
+        for i, engine in enumerate(engines):
+            apply_scalar(engine, int(actions[i]), int(args[i]))
+    scalar_rate = sample * steps / (time.perf_counter() - start)
+    return batch_rate, scalar_rate
+
+
+def main():
+    games = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    steps = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    mismatches = validate()
+    print("與 Engine 比對：" + ("一致" if not mismatches else f"{len(mismatches)} 處不一致，首次在 {mismatches[0]}"))
+    batch_rate, scalar_rate = benchmark(games, steps)
+    print(f"批次模擬 {games} 局 × {steps} 步：{batch_rate:,.0f} 狀態/秒")
+    print(f"逐局 Engine：{scalar_rate:,.0f} 狀態/秒（{batch_rate / scalar_rate:.0f}x）")
+
+
+if __name__ == "__main__":
+    main()
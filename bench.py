@@ -0,0 +1,288 @@
+"""效能基準測試：引擎與繪製熱點的固定情境，以及敵人模擬方式的比較
+
+用法：
+    python bench.py [--quick] [--json 輸出.json] [--compare 基準.json]
+
+--json 把結果寫成 JSON，之後可用 --compare 與另一個 commit 的結果比較。
+繪製情境在離屏（SDL dummy 驅動）下執行，沒有安裝 pygame 時略過。
+"""
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+
+from engine import Engine, Direction, GRID_SIZE, OPPOSITE
+from level import Level, border_walls
+
+SCRIPT_SEED = 20
+SCRIPT_TURNS = 20
+# 大地圖情境：棋盤邊長與敵人數
+LARGE_SIZE = 256
+LARGE_ENEMIES = 300
+
+
+def step_enemies(engine):
+    """逐步呼叫 can_move 的敵人移動（轉移表之前的寫法，作為比較基準）"""
+    for i, enemy in enumerate(engine.enemies):
+        if enemy.stunned > 0:
+            enemy.stunned -= 1
+            continue
+        pos, direction = enemy.pos, enemy.dir
+        for _ in range(engine.enemy_steps):
+            dx, dy = direction.value
+            new_pos = [pos[0] + dx, pos[1] + dy]
+            if engine.can_move(pos, new_pos):
+                pos = new_pos
+            else:
+                direction = OPPOSITE[direction]
+                dx, dy = direction.value
+                new_pos = [pos[0] + dx, pos[1] + dy]
+                if engine.can_move(pos, new_pos):
+                    pos = new_pos
+        engine._move_enemy(i, engine.kernel.encode(pos, direction))
+    engine.update_doors()
+
+
+def simulate_enemies(engine, turns, move=None):
+    """讓敵人連續移動 turns 回合，回傳耗時秒數"""
+    move = move or engine.move_enemies
+    start = time.perf_counter()
+    for _ in range(turns):
+        move()
+    return time.perf_counter() - start
+
+
+def bench_enemy_simulation(turns=20000):
+    """回傳 {方式: 秒數}，三種方式必須得到相同的結果"""
+    scan = Engine()
+    scan.can_move = scan._scan_move
+    table = Engine()
+    kernel = Engine()
+    results = {
+        "逐一掃描": simulate_enemies(scan, turns, lambda: step_enemies(scan)),
+        "通行表": simulate_enemies(table, turns, lambda: step_enemies(table)),
+        "轉移表": simulate_enemies(kernel, turns),
+    }
+    assert scan.get_state() == table.get_state() == kernel.get_state()
+    return results
+
+
+def bench_jump(turns=10 ** 6):
+    """比較逐回合前進與倍增跳躍表查詢「K 回合後的位置」，回傳 (逐回合秒數, 跳躍秒數)"""
+    engine = Engine()
+    kernel = engine.kernel
+    state = engine.enemies[0].state
+    mask = engine.door_mask
+    start = time.perf_counter()
+    walked = state
+    table = kernel.turn_table(mask)
+    for _ in range(turns):
+        walked = table[walked]
+    walk_time = time.perf_counter() - start
+    start = time.perf_counter()
+    jumped = kernel.advance(mask, state, turns)
+    jump_time = time.perf_counter() - start
+    assert walked == jumped
+    return walk_time, jump_time
+
+
+def measure(fn, number, repeat=5):
+    """執行 fn number 次為一輪、共 repeat 輪，回傳每次呼叫的 (最佳, 平均) 秒數"""
+    rounds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        rounds.append((time.perf_counter() - start) / number)
+    return min(rounds), sum(rounds) / len(rounds)
+
+
+def scripted_actions(seed=SCRIPT_SEED, turns=SCRIPT_TURNS):
+    """固定亂數種子產生的 turns 回合腳本：每回合最多六次移動，偶爾使用技能，最後結束回合"""
+    rng = random.Random(seed)
+    moves = [(0, 1), (0, -1), (-1, 0), (1, 0)]
+    actions = []
+    for turn in range(turns):
+        for _ in range(6):
+            actions.append(("move_player",) + rng.choice(moves))
+        if turn % 5 == 3:
+            actions.append(("use_skill2", rng.randint(1, GRID_SIZE), rng.randint(1, GRID_SIZE)))
+        if turn % 7 == 5:
+            actions.append(("use_skill1_on_player",))
+        actions.append(("end_turn",))
+    return actions
+
+
+def play_script(engine, initial, actions):
+    """從 initial 狀態開始執行腳本"""
+    engine.set_state(initial)
+    engine.history.clear()
+    for name, *args in actions:
+        getattr(engine, name)(*args)
+    return engine
+
+
+def engine_scenarios():
+    """引擎情境：[(代號, 說明, 每次呼叫的操作數, 函式, 呼叫次數)]"""
+    engine = Engine()
+    initial = engine.get_state()
+    moves = [((x, y), (x + dx, y + dy)) for x in range(1, engine.size + 1) for y in range(1, engine.size + 1)
+             for dx, dy in [(0, 1), (0, -1), (-1, 0), (1, 0)]]
+    can_move = engine.can_move
+
+    def sweep():
+        for a, b in moves:
+            can_move(a, b)
+
+    def predict():
+        for enemy in engine.enemies:
+            engine.predict_enemy_next_pos(enemy)
+
+    mover = Engine(engine.level)
+    actions = scripted_actions()
+    script = Engine(engine.level)
+    played = play_script(Engine(engine.level), initial, actions)
+    final = played.get_state()
+
+    def undo_redo():
+        played.undo()
+        played.redo()
+
+    return [
+        ("can_move", f"can_move（全盤 {len(moves)} 次）", len(moves), sweep, 200),
+        ("find_path_bfs", "find_path_bfs", 1, lambda: engine.find_path_bfs([1, 1], [8, 4]), 2000),
+        ("predict_enemy_next_pos", "predict_enemy_next_pos（全部敵人）", len(engine.enemies), predict, 5000),
+        ("move_enemies", "move_enemies", 1, mover.move_enemies, 5000),
+        ("update_doors", "update_doors", 1, engine.update_doors, 10000),
+        ("get_state", "get_state", 1, engine.get_state, 10000),
+        ("set_state", "set_state", 1, lambda: engine.set_state(final), 10000),
+        ("undo_redo", "undo + redo", 2, undo_redo, 5000),
+        ("scripted_game", f"{SCRIPT_TURNS} 回合腳本對局（{len(actions)} 個動作）", len(actions),
+         lambda: play_script(script, initial, actions), 50),
+    ]
+
+
+def large_level(size=LARGE_SIZE, enemies=LARGE_ENEMIES, seed=SCRIPT_SEED):
+    """隨機產生的大地圖：約八分之一的格子有牆、兩種顏色各三個壓版，以及四個門"""
+    rng = random.Random(seed)
+    cell = lambda: [rng.randint(2, size - 1), rng.randint(2, size - 1)]
+    walls = border_walls(size)
+    for _ in range(size * size // 8):
+        walls.add((rng.randint(2, size), rng.randint(2, size), rng.choice("HV")))
+    plates = {"green": [cell() for _ in range(3)], "blue": [cell() for _ in range(3)]}
+    doors = {}
+    for i, color in enumerate(["yellow", "green", "blue", "green"]):
+        x, y = cell()
+        doors[f"door{i}"] = {"between": [[x, y], [x + 1, y]], "plate": color}
+    limits = {"max_turns": 1000, "player_moves": 6, "enemy_steps": 4, "skill1_uses": 3, "skill2_uses": 3}
+    directions = list(Direction)
+    return Level(f"large{size}", size, limits, [1, 1], [size, size],
+                 [(*cell(), rng.choice(directions)) for _ in range(enemies)],
+                 walls, set(), [1, 2], plates, doors)
+
+
+def large_scenarios():
+    """大地圖情境：敵人移動與門判斷應與敵人數成正比，不受棋盤大小影響"""
+    level = large_level()
+    engine = Engine(level)
+    size = level.size
+    rng = random.Random(SCRIPT_SEED)
+    cells = [(rng.randint(1, size), rng.randint(1, size)) for _ in range(1000)]
+
+    def enemy_lookup():
+        for x, y in cells:
+            engine.enemy_at(x, y)
+
+    label = f"{size}x{size}，{len(level.enemies)} 個敵人"
+    return [
+        ("large_compile", f"compile_passability（{label}）", 1, engine.compile_passability, 3),
+        ("large_move_enemies", f"move_enemies（{label}）", len(level.enemies), engine.move_enemies, 200),
+        ("large_update_doors", f"update_doors（{label}）", 1, engine.update_doors, 10000),
+        ("large_enemy_at", f"enemy_at（{label}，1000 次）", len(cells), enemy_lookup, 200),
+        ("large_stun", f"use_skill2 範圍查詢（{label}）", 1, lambda: engine.enemies.in_square(size // 2, size // 2, 1), 10000),
+    ]
+
+
+def render_scenarios():
+    """繪製情境（離屏）：沒有 pygame 時回傳空清單"""
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    try:
+        from game import Game
+    except ImportError:
+        return []
+    game = Game()
+    engine = game.engine
+    play_script(engine, engine.get_state(), scripted_actions(turns=3))
+    engine.stun_area = (4, 4)
+
+    def board_uncached():
+        game.board_key = None
+        game.draw_grid()
+
+    def sidebar_uncached():
+        game.sidebar_key = None
+        game.draw_sidebar()
+
+    return [
+        ("draw_grid", "draw_grid（靜態盤面已快取）", 1, game.draw_grid, 300),
+        ("draw_grid_uncached", "draw_grid（重繪靜態盤面）", 1, board_uncached, 100),
+        ("draw_sidebar", "draw_sidebar（已快取）", 1, game.draw_sidebar, 2000),
+        ("draw_sidebar_uncached", "draw_sidebar（重繪）", 1, sidebar_uncached, 300),
+    ]
+
+
+def run_suite(quick=False):
+    """執行所有情境，回傳 {代號: 結果}；quick 只跑十分之一次數"""
+    results = {}
+    for key, label, ops, fn, number in engine_scenarios() + large_scenarios() + render_scenarios():
+        number = max(1, number // 10) if quick else number
+        best, mean = measure(fn, number)
+        results[key] = {"label": label, "ops_per_call": ops, "calls": number,
+                        "best_us": best * 1e6, "mean_us": mean * 1e6}
+    turns = 2000 if quick else 20000
+    for name, seconds in bench_enemy_simulation(turns).items():
+        results[f"enemy_simulation/{name}"] = {"label": f"敵人模擬 {turns} 回合：{name}", "ops_per_call": turns,
+                                               "calls": 1, "best_us": seconds * 1e6, "mean_us": seconds * 1e6}
+    return results
+
+
+def environment():
+    """結果附帶的執行環境，方便跨 commit 比較"""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {"commit": commit, "python": platform.python_version(), "platform": platform.platform(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S")}
+
+
+def main():
+    args = sys.argv[1:]
+    quick = "--quick" in args
+    output = args[args.index("--json") + 1] if "--json" in args else None
+    baseline = args[args.index("--compare") + 1] if "--compare" in args else None
+    results = run_suite(quick)
+    previous = {}
+    if baseline:
+        with open(baseline, encoding="utf-8") as f:
+            previous = json.load(f)["results"]
+    for key, result in results.items():
+        line = f"  {result['label']}：{result['best_us']:,.1f}µs"
+        if key in previous:
+            line += f"（基準 {previous[key]['best_us']:,.1f}µs，{previous[key]['best_us'] / result['best_us']:.2f}x）"
+        print(line)
+    walk_time, jump_time = bench_jump()
+    print(f"單一敵人 10^6 回合後的位置：逐回合 {walk_time:.3f}s，跳躍表 {jump_time * 1000:.3f}ms")
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            json.dump({"environment": environment(), "quick": quick, "results": results}, f,
+                      ensure_ascii=False, indent=2)
+        print(f"結果已寫入 {output}")
+
+
+if __name__ == "__main__":
+    main()
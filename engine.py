@@ -0,0 +1,1139 @@
+"""銀與血 - 詭秘航路 - 軍械號 II - 四重奏：遊戲規則引擎（不依賴 pygame）"""
+import bisect
+from array import array
+from enum import Enum
+from collections import OrderedDict, deque
+from typing import NamedTuple
+
+from history import History
+
+# 常數定義
+GRID_SIZE = 8
+PLAYER_MOVES_PER_TURN = 6
+ENEMY_STEPS_PER_TURN = 4
+
+
+class Direction(Enum):
+    UP = (0, 1)
+    DOWN = (0, -1)
+    LEFT = (-1, 0)
+    RIGHT = (1, 0)
+
+
+# 方向索引順序與宣告順序一致：UP, DOWN, LEFT, RIGHT，反方向為 d ^ 1
+DIRECTIONS = list(Direction)
+DIR_INDEX = {d: i for i, d in enumerate(DIRECTIONS)}
+DELTA_INDEX = {d.value: i for i, d in enumerate(DIRECTIONS)}
+
+
+def cell_of(pos, size):
+    """(x, y) → 格子索引：由左下角 (1, 1) 開始逐列編號"""
+    return (pos[0] - 1) + (pos[1] - 1) * size
+
+
+def pos_of(cell, size):
+    """格子索引 → [x, y]"""
+    return [cell % size + 1, cell // size + 1]
+
+
+def neighbor_offsets(size):
+    """方向索引 → 格子索引位移（與 DIRECTIONS 順序相同）"""
+    return [d.value[0] + d.value[1] * size for d in DIRECTIONS]
+
+# 反彈後的方向
+OPPOSITE = {
+    Direction.RIGHT: Direction.LEFT,
+    Direction.LEFT: Direction.RIGHT,
+    Direction.UP: Direction.DOWN,
+    Direction.DOWN: Direction.UP,
+}
+
+
+class GameState(NamedTuple):
+    """不可變、可雜湊的動態遊戲狀態；牆壁、壓版、終點等靜態關卡資料留在 Engine 上"""
+    player: tuple  # (x, y)
+    moves_left: int
+    enemies: tuple  # ((x, y, 方向索引, 靜止回合), ...)
+    turn: int
+    is_first_turn: bool
+    player_turn: bool
+    turn_start_player: tuple
+    turn_start_enemies: tuple  # 第一回合敵人還沒移動時為 None
+    skill1_uses: int
+    skill2_uses: int
+    skill1_used_this_turn: bool
+    skill2_used_this_turn: bool
+    selected_skill: str  # 'skill1'、'skill2' 或 None
+    stun_area: tuple
+    yellow_plate_active: bool
+    door_mask: int  # 第 i 個位元對應 Engine.doors 的第 i 個門
+    game_won: bool
+    game_lost: bool
+    action_log: tuple
+
+
+class Enemy:
+    """EnemyStore 中第 index 個敵人的檢視，屬性直接讀寫 store 的陣列"""
+    __slots__ = ("store", "index")
+
+    def __init__(self, store, index):
+        self.store = store
+        self.index = index
+
+    @property
+    def state(self):
+        """格子 * 4 + 方向索引"""
+        return self.store.states[self.index]
+
+    @property
+    def pos(self):
+        cell = self.store.states[self.index] >> 2
+        return [cell % self.store.width + 1, cell // self.store.width + 1]
+
+    @property
+    def dir(self):
+        return DIRECTIONS[self.store.states[self.index] & 3]
+
+    @property
+    def stunned(self):
+        return self.store.stuns[self.index]
+
+    @stunned.setter
+    def stunned(self, value):
+        self.store.stuns[self.index] = value
+
+
+class EnemyStore:
+    """所有敵人的資料：狀態（格子 * 4 + 方向索引）與靜止回合各存成一個陣列
+
+    另外維護格子 → 敵人索引（遞增）的佔用表，只記錄有敵人的格子，依格子或範圍找敵人
+    不需要掃過所有敵人。移動敵人必須透過 move()，佔用表才會同步。
+    """
+    __slots__ = ("states", "stuns", "occupants", "width")
+
+    def __init__(self, states=(), stuns=None, width=GRID_SIZE):
+        self.states = array("I", states)
+        self.stuns = array("B", bytes(len(self.states)) if stuns is None else stuns)
+        self.width = width
+        self.occupants = {}
+        for i, state in enumerate(self.states):
+            self.occupants.setdefault(state >> 2, []).append(i)
+
+    @classmethod
+    def unpack(cls, packed, width=GRID_SIZE):
+        """((x, y, 方向索引, 靜止回合), ...) → EnemyStore（撤銷時每次都會呼叫，直接逐一填入）"""
+        store = cls.__new__(cls)
+        store.states = states = array("I")
+        store.stuns = stuns = array("B")
+        store.occupants = occupants = {}
+        store.width = width
+        for i, (x, y, d, stunned) in enumerate(packed):
+            cell = cell_of((x, y), width)
+            states.append(cell * 4 + d)
+            stuns.append(stunned)
+            if cell in occupants:
+                occupants[cell].append(i)
+            else:
+                occupants[cell] = [i]
+        return store
+
+    def pack(self):
+        """→ ((x, y, 方向索引, 靜止回合), ...)，GameState 使用的格式"""
+        width = self.width
+        return tuple(((state >> 2) % width + 1, (state >> 2) // width + 1, state & 3, stunned)
+                     for state, stunned in zip(self.states, self.stuns))
+
+    def copy(self):
+        store = EnemyStore.__new__(EnemyStore)
+        store.states = array("I", self.states)
+        store.stuns = array("B", self.stuns)
+        store.width = self.width
+        store.occupants = {cell: indices.copy() for cell, indices in self.occupants.items()}
+        return store
+
+    def __len__(self):
+        return len(self.states)
+
+    def __getitem__(self, index):
+        if not -len(self.states) <= index < len(self.states):
+            raise IndexError(index)
+        return Enemy(self, index % len(self.states))
+
+    def __iter__(self):
+        return (Enemy(self, i) for i in range(len(self.states)))
+
+    def move(self, index, state):
+        """把第 index 個敵人設為狀態 state，回傳原本所在的格子"""
+        cell = self.states[index] >> 2
+        new_cell = state >> 2
+        if new_cell != cell:
+            indices = self.occupants[cell]
+            indices.remove(index)
+            if not indices:
+                del self.occupants[cell]
+            bisect.insort(self.occupants.setdefault(new_cell, []), index)
+        self.states[index] = state
+        return cell
+
+    def at(self, cell):
+        """停在格子 cell 的敵人索引（遞增），沒有則為空"""
+        return self.occupants.get(cell, ())
+
+    def in_square(self, cx, cy, radius):
+        """以 (cx, cy) 為中心、邊長 2 * radius + 1 的正方形範圍內的敵人索引（遞增）"""
+        width = self.width
+        found = []
+        for y in range(max(1, cy - radius), min(width, cy + radius) + 1):
+            for x in range(max(1, cx - radius), min(width, cx + radius) + 1):
+                found.extend(self.occupants.get(cell_of((x, y), width), ()))
+        found.sort()
+        return found
+
+
+class _LazyTable(dict):
+    """第一次查詢某個狀態時才計算並記住結果的轉移表（大棋盤用，介面與 list 的索引相同）"""
+
+    def __init__(self, compute):
+        super().__init__()
+        self.compute = compute
+
+    def __missing__(self, state):
+        value = self[state] = self.compute(state)
+        return value
+
+
+class LazyPassable:
+    """門太多時的通行表：索引方式與完整的表相同，每個門遮罩的部分在第一次查詢時才建立
+
+    完整的表大小為 2^門數 × 格子數 × 4，門多的大棋盤放不下；實際遊戲只會用到少數門遮罩，
+    最近用過的 CACHE_MASKS 個保留在記憶體中。
+    """
+
+    CACHE_MASKS = 64
+
+    def __init__(self, base, door_edges, stride):
+        self.base = base  # 所有門都打開時的表
+        self.door_edges = door_edges
+        self.stride = stride
+        self._tables = OrderedDict()
+
+    def table(self, mask):
+        """門遮罩 mask 的通行表（索引為 格子 * 4 + 方向）"""
+        table = self._tables.get(mask)
+        if table is None:
+            table = bytearray(self.base)
+            for i, edges in enumerate(self.door_edges):
+                if not mask >> i & 1:
+                    for edge in edges:
+                        table[edge] = 0
+            self._tables[mask] = table
+            if len(self._tables) > self.CACHE_MASKS:
+                self._tables.popitem(last=False)
+        else:
+            self._tables.move_to_end(mask)
+        return table
+
+    def __getitem__(self, index):
+        mask, offset = divmod(index, self.stride)
+        return self.table(mask)[offset]
+
+
+def mask_table(passable, mask, stride):
+    """門遮罩 mask 的通行表與起始位移，在迴圈中查表時避免每次都換算遮罩"""
+    if isinstance(passable, LazyPassable):
+        return passable.table(mask), 0
+    return passable, mask * stride
+
+
+class EnemyKernel:
+    """敵人轉移核心：敵人一回合後的 (位置, 方向) 只取決於目前的 (位置, 方向) 與門遮罩
+
+    敵人狀態編碼為 格子 * 4 + 方向索引。每個門遮罩的一回合轉移表與倍增跳躍表都在
+    第一次用到時建立，之後「K 回合後的位置」只需 O(log K) 次查表。狀態數超過
+    FULL_TABLE_STATES 的大棋盤只計算實際查到的狀態，移動敵人的成本與敵人數成正比。
+    """
+
+    FULL_TABLE_STATES = 1 << 16
+
+    def __init__(self, engine):
+        self.passable = engine.passable
+        self.mask_stride = engine.mask_stride
+        self.size = engine.size
+        self.steps = engine.enemy_steps
+        self.cells = self.size * self.size
+        self.lazy = self.cells * 4 > self.FULL_TABLE_STATES
+        # 綁定黃色壓版的門由玩家切換，其他門由同色壓版上的敵人數量控制（與 update_doors 相同）
+        self.yellow_bits = 0
+        self.plate_groups = []
+        for i, door in enumerate(engine.doors.values()):
+            if door["plate"] == "yellow":
+                self.yellow_bits |= 1 << i
+            else:
+                plates = engine.plates[door["plate"]]
+                cells = frozenset(cell_of(pos, self.size) for pos in plates)
+                self.plate_groups.append((1 << i, cells, len(plates)))
+        self._turns = {}
+        self._jumps = {}
+        self._orbits = {}
+
+    def encode(self, pos, direction):
+        return cell_of(pos, self.size) * 4 + DIR_INDEX[direction]
+
+    def decode(self, state):
+        """狀態 → ([x, y], Direction)"""
+        cell, d = divmod(state, 4)
+        return pos_of(cell, self.size), DIRECTIONS[d]
+
+    def walk(self, mask, state):
+        """單一敵人在門遮罩 mask 下走一回合：可通行就前進，否則反彈並用新方向再試一次"""
+        passable, base = mask_table(self.passable, mask, self.mask_stride)
+        size = self.size
+        cell, d = divmod(state, 4)
+        for _ in range(self.steps):
+            if not passable[base + cell * 4 + d]:
+                d ^= 1
+                if not passable[base + cell * 4 + d]:
+                    continue
+            cell += (size, -size, -1, 1)[d]
+        return cell * 4 + d
+
+    def turn_table(self, mask):
+        """門遮罩 mask 下的一回合轉移表：table[狀態] = 一回合後的狀態"""
+        table = self._turns.get(mask)
+        if table is None:
+            if self.lazy:
+                table = _LazyTable(lambda state: self.walk(mask, state))
+            else:
+                table = [self.walk(mask, state) for state in range(self.cells * 4)]
+            self._turns[mask] = table
+        return table
+
+    def step(self, mask, state):
+        return self.turn_table(mask)[state]
+
+    def advance(self, mask, state, turns):
+        """門遮罩固定為 mask 時，turns 回合後的狀態（倍增跳躍表，O(log turns)）"""
+        jumps = self._jumps.setdefault(mask, [self.turn_table(mask)])
+        level = 0
+        while turns:
+            if level == len(jumps):
+                previous = jumps[-1]
+                if self.lazy:
+                    jumps.append(_LazyTable(lambda s, previous=previous: previous[previous[s]]))
+                else:
+                    jumps.append([previous[s] for s in previous])
+            if turns & 1:
+                state = jumps[level][state]
+            turns >>= 1
+            level += 1
+        return state
+
+    def cycle(self, mask, state):
+        """門遮罩固定時的軌跡：回傳 (進入循環前的回合數, 循環週期)"""
+        table = self.turn_table(mask)
+        seen = {}
+        turn = 0
+        while state not in seen:
+            seen[state] = turn
+            state = table[state]
+            turn += 1
+        return seen[state], turn - seen[state]
+
+    def plate_mask(self, states):
+        """由敵人位置決定的門（不含黃色門）"""
+        mask = 0
+        for bit, plates, need in self.plate_groups:
+            if sum(1 for state in states if state >> 2 in plates) == need:
+                mask |= bit
+        return mask
+
+    def step_all(self, yellow, states):
+        """所有敵人（皆未被靜止）一起走一回合；門狀態在回合開始時決定"""
+        mask = self.plate_mask(states)
+        if yellow:
+            mask |= self.yellow_bits
+        table = self.turn_table(mask)
+        return tuple(table[state] for state in states)
+
+    def forecast(self, yellow, mask, states, stuns, turns):
+        """依 move_enemies 的規則預測之後 turns 回合每回合結束時的敵人狀態
+
+        mask 為目前的門遮罩；被靜止的敵人該回合原地不動，之後每回合的門由壓版與黃色壓版決定。
+        """
+        path = []
+        stuns = list(stuns)
+        for _ in range(turns):
+            table = self.turn_table(mask)
+            states = tuple(state if stun > 0 else table[state] for state, stun in zip(states, stuns))
+            stuns = [stun - 1 if stun > 0 else 0 for stun in stuns]
+            mask = self.plate_mask(states)
+            if yellow:
+                mask |= self.yellow_bits
+            path.append(states)
+        return path
+
+    def orbit(self, yellow, states):
+        """所有敵人一起移動的軌跡：回傳 (狀態清單, 進入循環前的回合數, 循環週期)"""
+        key = (yellow, states)
+        result = self._orbits.get(key)
+        if result is None:
+            path = []
+            seen = {}
+            while states not in seen:
+                seen[states] = len(path)
+                path.append(states)
+                states = self.step_all(yellow, states)
+            result = (path, seen[states], len(path) - seen[states])
+            self._orbits[key] = result
+        return result
+
+    def advance_all(self, yellow, states, turns):
+        """所有敵人一起移動 turns 回合後的狀態（門會隨壓版改變），偵測循環後 O(1) 查詢"""
+        path, start, period = self.orbit(yellow, states)
+        if turns >= len(path):
+            turns = start + (turns - start) % period
+        return path[turns]
+
+
+class DistanceTable:
+    """每個門遮罩下的全點對最短步數、可到達集合與強連通分量，第一次用到該遮罩時以 BFS 建立
+
+    門的開關是地形唯一會變的部分，所以「某個門狀態下能否到達」與「確切步數」都只需查表。
+    因為有單向門，可到達關係有方向性；同一個分量代表兩格可以互相到達。
+    格子數達到 UNREACHABLE 的大棋盤放不下全點對表，改成查詢時才對單一起點或終點做 BFS，
+    最近用過的 ROW_CACHE 筆結果保留在快取中。
+    """
+
+    UNREACHABLE = 255
+    ROW_CACHE = 64
+
+    def __init__(self, engine):
+        self.passable = engine.passable
+        self.mask_stride = engine.mask_stride
+        self.size = engine.size
+        self.cells = self.size * self.size
+        self.lazy = self.cells >= self.UNREACHABLE
+        self._tables = {}
+        self._rows = OrderedDict()  # (遮罩, 格子, 是否反向) → 步數清單
+        self._labels = {}  # 遮罩 → {格子: 分量編號}
+
+    def table(self, mask):
+        """回傳 (距離表, 可到達集合, 分量編號)，只適用於小棋盤
+
+        距離表為 bytes，distances[a * 格子數 + b] 為 a 到 b 的步數（無法到達為 UNREACHABLE）；
+        可到達集合為每個格子的位元遮罩；分量編號為每個格子所在強連通分量中最小的格子索引。
+        """
+        result = self._tables.get(mask)
+        if result is None:
+            cells = self.cells
+            passable, base = mask_table(self.passable, mask, self.mask_stride)
+            offsets = neighbor_offsets(self.size)
+            distances = bytearray([self.UNREACHABLE]) * (cells * cells)
+            reach = []
+            for source in range(cells):
+                row = source * cells
+                distances[row + source] = 0
+                bits = 1 << source
+                frontier = [source]
+                steps = 0
+                while frontier:
+                    steps += 1
+                    following = []
+                    for cell in frontier:
+                        for d in range(4):
+                            if passable[base + cell * 4 + d]:
+                                target = cell + offsets[d]
+                                if not bits >> target & 1:
+                                    bits |= 1 << target
+                                    distances[row + target] = steps
+                                    following.append(target)
+                    frontier = following
+                reach.append(bits)
+            labels = tuple(next(c for c in range(cells) if reach[cell] >> c & 1 and reach[c] >> cell & 1)
+                           for cell in range(cells))
+            result = self._tables[mask] = (bytes(distances), tuple(reach), labels)
+        return result
+
+    def _search(self, mask, sources, reverse=False):
+        """從 sources 出發的 BFS（reverse 時沿反方向走，得到到 sources 的步數），無法到達為 None"""
+        cells = self.cells
+        passable, base = mask_table(self.passable, mask, self.mask_stride)
+        offsets = neighbor_offsets(self.size)
+        steps = [None] * cells
+        for source in sources:
+            steps[source] = 0
+        frontier = list(sources)
+        distance = 0
+        while frontier:
+            distance += 1
+            following = []
+            for cell in frontier:
+                for d in range(4):
+                    if reverse:
+                        # 反向：找能往方向 d 走進 cell 的格子
+                        target = cell - offsets[d]
+                        if not (0 <= target < cells and passable[base + target * 4 + d]):
+                            continue
+                    elif passable[base + cell * 4 + d]:
+                        target = cell + offsets[d]
+                    else:
+                        continue
+                    if steps[target] is None:
+                        steps[target] = distance
+                        following.append(target)
+            frontier = following
+        return steps
+
+    def _row(self, mask, cell, reverse=False):
+        key = (mask, cell, reverse)
+        row = self._rows.get(key)
+        if row is None:
+            row = self._rows[key] = self._search(mask, [cell], reverse)
+            if len(self._rows) > self.ROW_CACHE:
+                self._rows.popitem(last=False)
+        else:
+            self._rows.move_to_end(key)
+        return row
+
+    def distance(self, mask, a, b):
+        """格子 a 到 b 的最短步數，無法到達時回傳 None"""
+        if self.lazy:
+            return self._row(mask, a)[b]
+        steps = self.table(mask)[0][a * self.cells + b]
+        return None if steps == self.UNREACHABLE else steps
+
+    def distances_to(self, mask, goal):
+        """每個格子到 goal 的最短步數清單（無法到達為 None）"""
+        if self.lazy:
+            return self._row(mask, goal, reverse=True)
+        distances = self.table(mask)[0]
+        cells = self.cells
+        return [None if distances[cell * cells + goal] == self.UNREACHABLE else distances[cell * cells + goal]
+                for cell in range(cells)]
+
+    def reachable(self, mask, a, b):
+        if self.lazy:
+            return self._row(mask, a)[b] is not None
+        return self.table(mask)[1][a] >> b & 1 == 1
+
+    def closure(self, mask, cells):
+        """位元遮罩 cells 中任一格可到達的所有格子（位元遮罩）"""
+        if self.lazy:
+            sources = [cell for cell in range(cells.bit_length()) if cells >> cell & 1]
+            result = 0
+            for cell, steps in enumerate(self._search(mask, sources)):
+                if steps is not None:
+                    result |= 1 << cell
+            return result
+        reach = self.table(mask)[1]
+        result = cells
+        while cells:
+            low = cells & -cells
+            result |= reach[low.bit_length() - 1]
+            cells ^= low
+        return result
+
+    def component(self, mask, cell):
+        if self.lazy:
+            labels = self._labels.setdefault(mask, {})
+            if cell not in labels:
+                # 可以到達且可以回來的格子就是同一個分量，整個分量一次記錄
+                forward = self._row(mask, cell)
+                backward = self._row(mask, cell, reverse=True)
+                members = [c for c in range(self.cells) if forward[c] is not None and backward[c] is not None]
+                for member in members:
+                    labels[member] = members[0]
+            return labels[cell]
+        return self.table(mask)[2][cell]
+
+
+class Engine:
+    """純規則引擎：可在沒有顯示器的環境下匯入、模擬與測試"""
+
+    FULL_PASSABLE_BYTES = 1 << 24  # 完整通行表的大小上限，超過時每個門遮罩延後建立
+
+    def __init__(self, level=None):
+        if level is None:
+            from level import load_level  # level 模組會匯入 engine，延後匯入以免循環
+            level = load_level()
+        self.level = level
+        # 門狀態改變時的通知：listener(改變的門名稱清單)，重新開始遊戲後仍保留
+        self.door_listeners = []
+        self.init_game()
+
+    def get_state(self):
+        """回傳目前的動態狀態（用於存檔/回溯/撤銷），靜態關卡資料不包含在內"""
+        return GameState(
+            player=tuple(self.player_pos),
+            moves_left=self.player_moves_left,
+            enemies=self.enemies.pack(),
+            turn=self.turn,
+            is_first_turn=self.is_first_turn,
+            player_turn=self.player_turn,
+            turn_start_player=tuple(self.turn_start_player_pos),
+            turn_start_enemies=self.turn_start_enemies.pack() if self.turn_start_enemies else None,
+            skill1_uses=self.skill1_uses,
+            skill2_uses=self.skill2_uses,
+            skill1_used_this_turn=self.skill1_used_this_turn,
+            skill2_used_this_turn=self.skill2_used_this_turn,
+            selected_skill=self.selected_skill,
+            stun_area=self.stun_area,
+            yellow_plate_active=self.yellow_plate_active,
+            door_mask=self.door_mask,
+            game_won=self.game_won,
+            game_lost=self.game_lost,
+            action_log=tuple(self.action_log),
+        )
+
+    def set_state(self, state):
+        """還原 get_state 產生的狀態"""
+        self.player_pos = list(state.player)
+        self.player_moves_left = state.moves_left
+        self.enemies = EnemyStore.unpack(state.enemies, self.size)
+        self.turn = state.turn
+        self.is_first_turn = state.is_first_turn
+        self.player_turn = state.player_turn
+        self.turn_start_player_pos = list(state.turn_start_player)
+        self.turn_start_enemies = EnemyStore.unpack(state.turn_start_enemies, self.size) if state.turn_start_enemies else None
+        self.skill1_uses = state.skill1_uses
+        self.skill2_uses = state.skill2_uses
+        self.skill1_used_this_turn = state.skill1_used_this_turn
+        self.skill2_used_this_turn = state.skill2_used_this_turn
+        self.selected_skill = state.selected_skill
+        self.stun_area = state.stun_area
+        self.yellow_plate_active = state.yellow_plate_active
+        self.recount_plates()
+        self._set_door_mask(state.door_mask)
+        self.game_won = state.game_won
+        self.game_lost = state.game_lost
+        self.action_log = list(state.action_log)
+
+    def init_game(self):
+        """依 self.level 初始化遊戲"""
+        level = self.level
+        # 棋盤大小與每回合步數由關卡決定（GRID_SIZE 等常數為預設關卡的值）
+        self.size = level.size
+        self.player_moves = level.player_moves
+        self.enemy_steps = level.enemy_steps
+        self.player_pos = list(level.player)
+        self.player_moves_left = self.player_moves
+
+        self.enemies = EnemyStore([cell_of((x, y), self.size) * 4 + DIR_INDEX[direction]
+                                   for x, y, direction in level.enemies], width=self.size)
+
+        # 回合系統
+        self.turn = 1
+        self.max_turns = level.max_turns
+        self.is_first_turn = True
+        self.player_turn = True  # 當前是否為玩家回合
+
+        # 記錄回合開始時的狀態
+        self.turn_start_player_pos = self.player_pos.copy()
+        self.turn_start_enemies = None  # 第一回合敵人不移動，不記錄
+
+        # 技能系統
+        self.skill1_uses = level.skill1_uses  # 回溯技能
+        self.skill2_uses = level.skill2_uses  # 靜止技能
+        self.skill1_used_this_turn = False
+        self.skill2_used_this_turn = False
+        self.selected_skill = None  # 'skill1' or 'skill2'
+        self.stun_area = None  # 靜止技能的顯示區域
+
+        # 牆壁 (紅色線條，含外框) 與單向門
+        self.walls = level.walls
+        self.one_way_doors = level.one_way_doors
+
+        # 壓版系統：黃色壓版由玩家切換，其他顏色的壓版需全部被敵人踩住
+        self.yellow_plate = level.yellow_plate
+        self.yellow_plate_active = False
+        self.plates = level.plates
+        # 壓版佔用計數：plate_at[格子索引] 為該格的壓版顏色，敵人進出壓版時增減 plate_counts
+        self.plate_at = [None] * (self.size * self.size)
+        for color, cells in self.plates.items():
+            for pos in cells:
+                self.plate_at[cell_of(pos, self.size)] = color
+        self.recount_plates()
+
+        # 門系統 (位置是兩個格子之間，plate 為控制此門的壓版顏色)
+        self.doors = {name: {"between": door["between"], "plate": door["plate"], "open": False}
+                      for name, door in level.doors.items()}
+
+        # 目標位置
+        self.goal_pos = list(level.goal)
+
+        # 通行表（門的開關以位元遮罩表示，第 i 個門對應 self.doors 的第 i 個鍵），已編譯的關卡直接沿用
+        previous_mask = getattr(self, "door_mask", 0)
+        self.compile_passability(level.passable)
+        # 每種壓版顏色控制的門（位元遮罩）
+        self.plate_doors = {}
+        for i, door in enumerate(self.doors.values()):
+            self.plate_doors[door["plate"]] = self.plate_doors.get(door["plate"], 0) | 1 << i
+        self._notify_doors(previous_mask ^ self.door_mask)
+
+        # 遊戲狀態
+        self.game_won = False
+        self.game_lost = False
+
+        self.action_log = []  # 記錄當前回合的行動
+
+        # 返回上一步功能（差異式歷史，可撤銷與重做）
+        self.history = History()
+
+        # 敵人多回合預測的快取：(狀態鍵, 每回合狀態, 威脅地圖)
+        self._forecast = None
+
+    def save_state(self):
+        self.history.record(self.get_state())  # 新動作後清空 redo
+
+    def undo(self):
+        """返回上一步（可跨回合）"""
+        state = self.history.undo(self.get_state())
+        if state is None:
+            self.action_log.append("無法撤銷！")
+            return False
+        self.set_state(state)
+        return True
+
+    def redo(self):
+        """重做（返回撤銷前的狀態）"""
+        state = self.history.redo(self.get_state())
+        if state is None:
+            self.action_log.append("無法重做！")
+            return False
+        self.set_state(state)
+        return True
+
+    def find_path_bfs(self, start, goal):
+        """使用 BFS 尋找從起點到終點的最短路徑（記錄父節點，找到後再回溯，不複製路徑）"""
+        if start == goal:
+            return []
+
+        goal = tuple(goal)
+        queue = deque([tuple(start)])
+        parents = {tuple(start): None}  # 格子 → (上一格, 方向)
+
+        while queue:
+            current = queue.popleft()
+
+            # 檢查四個方向
+            for dx, dy in [(0, 1), (0, -1), (-1, 0), (1, 0)]:
+                next_tuple = (current[0] + dx, current[1] + dy)
+
+                if next_tuple in parents:
+                    continue
+
+                if self.can_move(current, next_tuple):
+                    parents[next_tuple] = (current, (dx, dy))
+
+                    if next_tuple == goal:
+                        path = []
+                        link = parents[goal]
+                        while link is not None:
+                            current, step = link
+                            path.append(step)
+                            link = parents[current]
+                        path.reverse()
+                        return path
+
+                    queue.append(next_tuple)
+
+        return None  # 找不到路徑
+
+    def compile_passability(self, compiled=None):
+        """預先計算每個門遮罩下，每個格子往每個方向能否通行
+
+        索引為 遮罩 * 格子數 * 4 + 格子 * 4 + 方向。完整的表超過 FULL_PASSABLE_BYTES 時
+        （門多的大棋盤）改用 LazyPassable，每個門遮罩在第一次查詢時才建立。
+        牆壁、單向門或門的位置改變後需重新呼叫；compiled 為關卡快取中已算好的表。
+        規則與 _scan_move 相同，但只處理牆壁與門本身，建表時間與棋盤大小成正比。
+        """
+        self.door_names = list(self.doors)
+        self.mask_stride = self.size * self.size * 4
+        if compiled is not None:
+            self.passable = compiled
+            self.kernel = EnemyKernel(self)
+            self.distances = DistanceTable(self)
+            self.refresh_door_mask()
+            return
+        # 所有門都打開時的通行表：邊界、牆壁與單向門只各自擋住一兩個方向，不需要逐格檢查
+        size = self.size
+        base = bytearray(b"\x01") * self.mask_stride
+
+        def block(x, y, d):
+            if 1 <= x <= size and 1 <= y <= size:
+                base[cell_of((x, y), size) * 4 + d] = 0
+
+        up, down, left, right = range(4)
+        for i in range(1, size + 1):
+            block(i, size, up)
+            block(i, 1, down)
+            block(1, i, left)
+            block(size, i, right)
+        for x, y, orientation in self.walls:
+            if orientation == 'V':  # 在 x 格左邊
+                block(x - 1, y, right)
+                block(x, y, left)
+            else:  # 在 y 格下邊
+                block(x, y - 1, up)
+                block(x, y, down)
+        for x, y, direction in self.one_way_doors:
+            if direction == Direction.LEFT:  # 只能從右到左
+                block(x, y, right)
+        # 每個門關閉時擋住的兩個方向（門兩側必須相鄰，否則不影響單步移動）
+        door_edges = []
+        for door in self.doors.values():
+            (x1, y1), (x2, y2) = door["between"]
+            d = DELTA_INDEX.get((x2 - x1, y2 - y1))
+            if d is None or not all(1 <= v <= size for v in (x1, y1, x2, y2)):
+                door_edges.append(())
+                continue
+            cell1, cell2 = cell_of((x1, y1), size), cell_of((x2, y2), size)
+            door_edges.append((cell1 * 4 + d, cell2 * 4 + (d ^ 1)))
+        masks = 1 << len(self.door_names)
+        if masks * self.mask_stride > self.FULL_PASSABLE_BYTES:
+            self.passable = LazyPassable(base, door_edges, self.mask_stride)
+        else:
+            table = base * masks
+            for mask in range(masks):
+                offset = mask * self.mask_stride
+                for i, edges in enumerate(door_edges):
+                    if not mask >> i & 1:
+                        for edge in edges:
+                            table[offset + edge] = 0
+            self.passable = table
+        self.kernel = EnemyKernel(self)
+        self.distances = DistanceTable(self)
+        self.refresh_door_mask()
+
+    def refresh_door_mask(self):
+        """依 self.doors 重新計算目前的門遮罩（直接修改 doors 後需呼叫）"""
+        mask = 0
+        for i, door in enumerate(self.doors.values()):
+            if door["open"]:
+                mask |= 1 << i
+        self.door_mask = mask
+
+    def can_step(self, mask, cell, d):
+        """查表：門遮罩 mask 下，從格子索引 cell 往方向索引 d 能否通行"""
+        return self.passable[mask * self.mask_stride + cell * 4 + d]
+
+    def distance(self, from_pos, to_pos):
+        """目前門狀態下兩格之間的最短步數（查表），無法到達時回傳 None"""
+        return self.distances.distance(self.door_mask, cell_of(from_pos, self.size), cell_of(to_pos, self.size))
+
+    def can_move(self, from_pos, to_pos):
+        """檢查是否可以移動"""
+        fx, fy = from_pos
+        d = DELTA_INDEX.get((to_pos[0] - fx, to_pos[1] - fy))
+        if d is None or not (1 <= fx <= self.size and 1 <= fy <= self.size):
+            return self._scan_move(from_pos, to_pos)
+        return self.passable[self.door_mask * self.mask_stride + cell_of(from_pos, self.size) * 4 + d] == 1
+
+    def _scan_move(self, from_pos, to_pos):
+        """逐一檢查牆壁與門（用於建立通行表，以及非相鄰格子的移動）"""
+        fx, fy = from_pos
+        tx, ty = to_pos
+
+        # 檢查邊界
+        if not (1 <= tx <= self.size and 1 <= ty <= self.size):
+            return False
+
+        # 檢查牆壁
+        if fx != tx:  # 水平移動 (左右移動)
+            # 從 fx 移動到 tx，需要檢查之間的垂直牆
+            if tx > fx:  # 向右移動，檢查 tx 左邊的牆
+                if (tx, fy, 'V') in self.walls:
+                    return False
+            else:  # 向左移動，檢查 fx 左邊的牆
+                if (fx, fy, 'V') in self.walls:
+                    return False
+
+        if fy != ty:  # 垂直移動 (上下移動)
+            # 從 fy 移動到 ty，需要檢查之間的水平牆
+            if ty > fy:  # 向上移動，檢查 ty 下邊的牆
+                if (fx, ty, 'H') in self.walls:
+                    return False
+            else:  # 向下移動，檢查 fy 下邊的牆
+                if (fx, fy, 'H') in self.walls:
+                    return False
+
+        # 檢查門 (關閉的門視為牆壁)
+        for door_info in self.doors.values():
+            if not door_info["open"]:
+                pos1, pos2 = door_info["between"]
+                if [fx, fy] in [pos1, pos2] and [tx, ty] in [pos1, pos2]:
+                    return False
+
+        # 檢查單向門
+        for door in self.one_way_doors:
+            dx, dy, direction = door
+            if direction == Direction.LEFT:
+                # 只能從右到左
+                if fy == dy and tx == dx and fx == dx + 1:
+                    return True  # 正確方向
+                elif fy == dy and fx == dx and tx == dx + 1:
+                    return False  # 錯誤方向
+
+        return True
+
+    def move_player(self, dx, dy, log_action=True):
+        """移動玩家"""
+        if not self.player_turn or self.player_moves_left <= 0:
+            return False
+        new_pos = [self.player_pos[0] + dx, self.player_pos[1] + dy]
+        if self.can_move(self.player_pos, new_pos):
+            # 儲存移動前的狀態
+            self.save_state()
+            old_pos = self.player_pos.copy()
+            self.player_pos = new_pos
+            self.player_moves_left -= 1
+            # 記錄行動
+            if log_action:
+                direction = ""
+                if dx == 1: direction = "右"
+                elif dx == -1: direction = "左"
+                elif dy == 1: direction = "上"
+                elif dy == -1: direction = "下"
+                self.action_log.append(f"向{direction}移動：({old_pos[0]},{old_pos[1]}) → ({new_pos[0]},{new_pos[1]})")
+            # 檢查黃色壓版
+            if self.player_pos == self.yellow_plate:
+                self.yellow_plate_active = not self.yellow_plate_active
+                self.update_doors()
+                if log_action:
+                    status = "開啟" if self.yellow_plate_active else "關閉"
+                    self.action_log.append(f"踩到黃色壓版！黃色門{status}")
+            # 檢查是否到達目標
+            if self.player_pos == self.goal_pos:
+                self.game_won = True
+                if log_action:
+                    self.action_log.append("到達目標！勝利！")
+            return True
+        return False
+
+    def recount_plates(self):
+        """重新計算每種顏色壓版上的敵人數（直接修改 self.enemies 後需呼叫）"""
+        counts = {color: 0 for color in self.plates}
+        for cell in self.enemies.occupants:
+            color = self.plate_at[cell]
+            if color is not None:
+                counts[color] += len(self.enemies.occupants[cell])
+        self.plate_counts = counts
+
+    def _move_enemy(self, index, state):
+        """把第 index 個敵人移到狀態 state（格子 * 4 + 方向），並更新壓版計數"""
+        cell = self.enemies.move(index, state)
+        new_cell = state >> 2
+        if new_cell != cell:
+            plate_at = self.plate_at
+            if plate_at[cell] is not None:
+                self.plate_counts[plate_at[cell]] -= 1
+            if plate_at[new_cell] is not None:
+                self.plate_counts[plate_at[new_cell]] += 1
+
+    def update_doors(self):
+        """更新門的狀態：只比較壓版計數與門檻，並只切換狀態有變的門"""
+        mask = self.plate_doors.get("yellow", 0) if self.yellow_plate_active else 0
+        for color, count in self.plate_counts.items():
+            # 所有同色壓版都被敵人踩住時開門
+            if count == len(self.plates[color]):
+                mask |= self.plate_doors.get(color, 0)
+        self._set_door_mask(mask)
+
+    def _set_door_mask(self, mask):
+        changed = mask ^ self.door_mask
+        if changed:
+            for i, door in enumerate(self.doors.values()):
+                if changed >> i & 1:
+                    door["open"] = not door["open"]
+            self.door_mask = mask
+            self._notify_doors(changed)
+
+    def _notify_doors(self, changed):
+        """通知 door_listeners 哪些門改變了狀態"""
+        if changed and self.door_listeners:
+            names = [name for i, name in enumerate(self.door_names) if changed >> i & 1]
+            for listener in self.door_listeners:
+                listener(names)
+
+    def predict_enemy_next_pos(self, enemy):
+        """預測敵人下一回合的位置"""
+        # 如果敵人被靜止，下一回合不移動
+        if enemy.stunned > 0:
+            return enemy.pos
+
+        # 模擬敵人移動一回合（查轉移表）
+        state = self.kernel.step(self.door_mask, enemy.state)
+        return self.kernel.decode(state)[0]
+
+    def forecast_enemies(self, turns):
+        """之後 turns 回合每回合結束時的敵人狀態與威脅地圖，敵人或門狀態改變時才重新計算
+
+        回傳 (每回合的敵人狀態, 威脅地圖)；威脅地圖以格子索引排列，值為最早有敵人停在該格的
+        回合數（1 起算），turns 回合內都不會有敵人則為 0。假設玩家不再踩黃色壓版。
+        """
+        states = tuple(self.enemies.states)
+        stuns = tuple(self.enemies.stuns)
+        key = (states, stuns, self.door_mask, self.yellow_plate_active, turns)
+        if self._forecast is None or self._forecast[0] != key:
+            path = self.kernel.forecast(self.yellow_plate_active, self.door_mask, states, stuns, turns)
+            threat = [0] * (self.size * self.size)
+            for turn in range(len(path), 0, -1):
+                for state in path[turn - 1]:
+                    threat[state >> 2] = turn
+            self._forecast = (key, path, threat)
+        return self._forecast[1], self._forecast[2]
+
+    def move_enemies(self):
+        """移動所有敵人"""
+        # 整個敵人階段都使用移動前的門狀態
+        table = self.kernel.turn_table(self.door_mask)
+        states = self.enemies.states
+        stuns = self.enemies.stuns
+        for i in range(len(states)):
+            if stuns[i] > 0:
+                stuns[i] -= 1
+                continue
+
+            # 移動 enemy_steps 格（遇到牆壁反彈）
+            self._move_enemy(i, table[states[i]])
+
+        self.update_doors()
+
+    def enemy_at(self, x, y):
+        """回傳位於 (x, y) 的第一個敵人索引，沒有則回傳 None"""
+        if not (1 <= x <= self.size and 1 <= y <= self.size):
+            return None
+        indices = self.enemies.at(cell_of((x, y), self.size))
+        return indices[0] if indices else None
+
+    def use_skill1_on_enemy(self, enemy_index):
+        """對敵人使用回溯技能"""
+        if self.skill1_used_this_turn or self.skill1_uses <= 0:
+            self.action_log.append("技能已使用或無剩餘次數")
+            return False
+        # 第一回合敵人還沒移動，不能回溯
+        if self.turn_start_enemies is None:
+            self.action_log.append("第一回合敵人還未移動，無法回溯！")
+            self.selected_skill = None
+            return False
+        # 儲存使用技能前的狀態
+        self.save_state()
+        old_pos = self.enemies[enemy_index].pos
+        start_pos = self.turn_start_enemies[enemy_index].pos
+        # 添加調試信息
+        self.action_log.append(f"嘗試回溯敵人 #{enemy_index+1}")
+        self.action_log.append(f"當前位置：({old_pos[0]},{old_pos[1]})")
+        self.action_log.append(f"回溯目標：({start_pos[0]},{start_pos[1]})")
+        self._move_enemy(enemy_index, self.turn_start_enemies[enemy_index].state)
+        self.skill1_uses -= 1
+        self.skill1_used_this_turn = True
+        self.selected_skill = None
+        self.update_doors()
+        # 記錄行動
+        self.action_log.append(f"回溯成功！")
+        return True
+
+    def use_skill1_on_player(self):
+        """對玩家使用回溯技能"""
+        if self.skill1_used_this_turn or self.skill1_uses <= 0:
+            return False
+        # 儲存使用技能前的狀態
+        self.save_state()
+        old_pos = self.player_pos.copy()
+        self.player_pos = self.turn_start_player_pos.copy()
+        self.skill1_uses -= 1
+        self.skill1_used_this_turn = True
+        self.selected_skill = None
+        # 檢查黃色壓版狀態 (可能需要更新)
+        self.update_doors()
+        # 記錄行動
+        self.action_log.append(f"回溯玩家：({old_pos[0]},{old_pos[1]}) → ({self.player_pos[0]},{self.player_pos[1]})")
+        return True
+
+    def use_skill2(self, center_x, center_y):
+        """使用靜止技能"""
+        if self.skill2_used_this_turn or self.skill2_uses <= 0:
+            return False
+        # 儲存使用技能前的狀態
+        self.save_state()
+        # 對 3x3 範圍內的所有敵人施加靜止效果
+        stunned = self.enemies.in_square(center_x, center_y, 1)
+        for i in stunned:
+            self.enemies.stuns[i] = 1  # 下一回合不能動
+        if stunned:
+            self.skill2_uses -= 1
+            self.skill2_used_this_turn = True
+            self.selected_skill = None
+            self.stun_area = None
+            return True
+        return False
+
+    def restart(self):
+        """重新開始遊戲"""
+        self.init_game()
+        self.action_log.append("遊戲已重新開始")
+
+    def select_skill(self, skill):
+        """切換選取的技能（'skill1' 或 'skill2'），本回合已使用或沒有次數時不動作"""
+        if skill == 'skill1':
+            if self.skill1_uses > 0 and not self.skill1_used_this_turn:
+                self.selected_skill = 'skill1' if self.selected_skill != 'skill1' else None
+        elif skill == 'skill2':
+            if self.skill2_uses > 0 and not self.skill2_used_this_turn:
+                self.selected_skill = 'skill2' if self.selected_skill != 'skill2' else None
+                if self.selected_skill == 'skill2':
+                    self.stun_area = None
+
+    def preview_stun(self, center):
+        """靜止技能選取中時，預覽以 center 為中心的範圍（None 表示不顯示）"""
+        if self.selected_skill == 'skill2' and self.player_turn and not self.game_won and not self.game_lost:
+            self.stun_area = center
+
+    def click_cell(self, x, y):
+        """點擊棋盤格子：依選取的技能對玩家、敵人或範圍施放"""
+        if self.selected_skill == 'skill1':
+            self.action_log.append(f"點擊位置：({x},{y})")
+            # 檢查是否點擊玩家
+            if self.player_pos == [x, y]:
+                self.action_log.append("點擊到玩家")
+                self.use_skill1_on_player()
+            else:
+                # 檢查是否點擊敵人
+                i = self.enemy_at(x, y)
+                if i is not None:
+                    self.action_log.append(f"點擊到敵人 #{i+1}")
+                    self.use_skill1_on_enemy(i)
+                else:
+                    self.action_log.append("沒有點擊到任何單位")
+        elif self.selected_skill == 'skill2':
+            # 預覽靜止範圍
+            self.stun_area = (x, y)
+            # 實際使用技能（不論有無敵人都可施放）
+            self.use_skill2(x, y)
+
+    def end_turn(self):
+        """結束當前回合，並儲存狀態以支援跨回合撤銷"""
+        self.save_state()  # 儲存回合結束前的狀態
+        if self.is_first_turn:
+            # 第一回合結束
+            self.is_first_turn = False
+            self.turn += 1
+        else:
+            # 正常回合結束
+            self.turn += 1
+            if self.turn > self.max_turns:
+                self.game_lost = True
+                return
+        self.player_moves_left = self.player_moves
+        self.skill1_used_this_turn = False
+        self.skill2_used_this_turn = False
+        self.selected_skill = None
+        self.player_turn = False
+        self.action_log = []  # 清空行動記錄
+        # 記錄敵人移動前的狀態 (下一回合可以回溯到這裡)
+        self.turn_start_enemies = self.enemies.copy()
+        # 敵人自動移動
+        self.move_enemies()
+        # 記錄玩家位置 (玩家還沒移動)
+        self.turn_start_player_pos = self.player_pos.copy()
+        self.player_turn = True
@@ -1,24 +1,37 @@
-
 try:
     import pygame
 except ImportError:
     import pygame_ce as pygame
 import sys
 import os
-from enum import Enum
-from copy import deepcopy
-from collections import deque
+import math
+import multiprocessing
+import struct
+import time
+from collections import OrderedDict
 
-# 初始化 Pygame
-pygame.init()
+from engine import Engine, Direction, GRID_SIZE, cell_of, pos_of
+from profiler import FrameProfiler
+import advisor
+import pathing
+import replay
+import savegame
+import solver
+import tablebase
+from level import DEFAULT_LEVEL
 
 # 常數定義
-GRID_SIZE = 8
 CELL_SIZE = 70
+VIEW_CELLS = GRID_SIZE  # 畫面一次顯示的格數，較大的棋盤以視窗跟隨玩家捲動
+BOARD_PIXELS = VIEW_CELLS * CELL_SIZE
 SIDEBAR_WIDTH = 300
-WINDOW_WIDTH = GRID_SIZE * CELL_SIZE + SIDEBAR_WIDTH
-WINDOW_HEIGHT = GRID_SIZE * CELL_SIZE
+WINDOW_WIDTH = BOARD_PIXELS + SIDEBAR_WIDTH
+WINDOW_HEIGHT = BOARD_PIXELS
 FPS = 60
+IDLE_WAIT_MS = 500  # 閒置時最多等待事件的時間（毫秒）
+HINT_POLL_MS = 20  # 背景提示搜尋中時等待事件的時間，以便及時顯示新的建議
+FRAME_BUDGET_MS = 1000 / FPS  # 直方圖上的參考線
+THREAT_HORIZON = 20  # 威脅熱區預測的回合數（按 H 顯示）
 
 # Catppuccin Mocha 調色盤
 # https://catppuccin.com/palette/mocha
@@ -41,50 +54,44 @@ GRID_LINE = (181, 191, 226)  # Catppuccin Mocha subtext1 #b5bfe2，比格子本
 
 MOCHA_CRUST = (24, 25, 38)   # #181926
 
-class Direction(Enum):
-    UP = (0, 1)
-    DOWN = (0, -1)
-    LEFT = (-1, 0)
-    RIGHT = (1, 0)
+# 壓版顏色名稱（關卡檔中的 plate）→ 繪製顏色
+PLATE_COLORS = {"yellow": YELLOW, "blue": CYAN, "green": GREEN, "purple": PURPLE}
+
+
+# 移動按鍵 → 重播操作代碼（依 DIRECTIONS 順序：上、下、左、右）
+MOVE_KEYS = {pygame.K_w: 0, pygame.K_UP: 0, pygame.K_s: 1, pygame.K_DOWN: 1,
+             pygame.K_a: 2, pygame.K_LEFT: 2, pygame.K_d: 3, pygame.K_RIGHT: 3}
+
+
+class TextCache:
+    """文字 surface 的 LRU 快取：同樣的字型、文字與顏色只排版一次"""
+
+    def __init__(self, capacity=256):
+        self.capacity = capacity
+        self._surfaces = OrderedDict()
+
+    def render(self, font, text, color):
+        key = (id(font), text, color)
+        surface = self._surfaces.get(key)
+        if surface is None:
+            surface = font.render(text, True, color)
+            self._surfaces[key] = surface
+            if len(self._surfaces) > self.capacity:
+                self._surfaces.popitem(last=False)
+        else:
+            self._surfaces.move_to_end(key)
+        return surface
+
 
 class Game:
-    def get_state(self):
-        # 僅回傳遊戲狀態（用於存檔/回溯/撤銷）
-        return {
-            'player_pos': deepcopy(self.player_pos),
-            'player_moves_left': self.player_moves_left,
-            'enemies': deepcopy(self.enemies),
-            'turn': self.turn,
-            'max_turns': self.max_turns,
-            'is_first_turn': self.is_first_turn,
-            'player_turn': self.player_turn,
-            'turn_start_player_pos': deepcopy(self.turn_start_player_pos),
-            'turn_start_enemies': deepcopy(self.turn_start_enemies) if self.turn_start_enemies else None,
-            'skill1_uses': self.skill1_uses,
-            'skill2_uses': self.skill2_uses,
-            'skill1_used_this_turn': self.skill1_used_this_turn,
-            'skill2_used_this_turn': self.skill2_used_this_turn,
-            'selected_skill': self.selected_skill,
-            'stun_area': deepcopy(self.stun_area),
-            'walls': deepcopy(self.walls),
-            'one_way_doors': deepcopy(self.one_way_doors),
-            'yellow_plate': deepcopy(self.yellow_plate),
-            'yellow_plate_active': self.yellow_plate_active,
-            'blue_plates': deepcopy(self.blue_plates),
-            'green_plates': deepcopy(self.green_plates),
-            'purple_plates': deepcopy(self.purple_plates),
-            'doors': deepcopy(self.doors),
-            'goal_pos': deepcopy(self.goal_pos),
-            'game_won': self.game_won,
-            'game_lost': self.game_lost,
-            'action_log': deepcopy(self.action_log),
-        }
-    def __init__(self):
+    """pygame 畫面：只負責繪製與輸入，規則全部交給 Engine"""
+
+    def __init__(self, engine=None):
+        # 初始化 Pygame（延後到建立視窗時，匯入引擎不需要顯示器）
+        pygame.init()
         self.screen = pygame.display.set_mode((WINDOW_WIDTH, WINDOW_HEIGHT))
         pygame.display.set_caption("銀與血 - 詭秘航路 - 軍械號 II - 四重奏 - 簡易小遊戲")
         self.clock = pygame.time.Clock()
-        # 其餘初始化內容...
-        # 載入中文字體、init_game 等原本內容請保留
 
         # 載入自訂中文字體（fonts/ChironGoRoundTC-Medium.ttf）
         font_path = os.path.join(os.path.dirname(__file__), "fonts", "ChironGoRoundTC-Medium.ttf")
@@ -94,339 +101,230 @@ class Game:
         else:
             self.font = pygame.font.Font(None, 28)
             self.small_font = pygame.font.Font(None, 20)
-        # 初始化遊戲狀態
-        self.init_game()
-        
-    def init_game(self):
-        """初始化遊戲"""
-        # 玩家位置 (2,2) - 注意座標轉換
-        self.player_pos = [2, 2]
-        self.player_moves_left = 6  # 每回合 6 步
-        
-        # 4 個敵人，都向右移動
-        self.enemies = [
-            {"pos": [1, 8], "dir": Direction.RIGHT, "stunned": 0},
-            {"pos": [1, 7], "dir": Direction.RIGHT, "stunned": 0},
-            {"pos": [1, 6], "dir": Direction.RIGHT, "stunned": 0},
-            {"pos": [1, 5], "dir": Direction.RIGHT, "stunned": 0}
-        ]
-        
-        # 回合系統
-        self.turn = 1
-        self.max_turns = 20
-        self.is_first_turn = True
-        self.player_turn = True  # 當前是否為玩家回合
-        
-        # 記錄回合開始時的狀態
-        self.turn_start_player_pos = self.player_pos.copy()
-        self.turn_start_enemies = None  # 第一回合敵人不移動，不記錄
-        
-        # 技能系統
-        self.skill1_uses = 3  # 回溯技能
-        self.skill2_uses = 3  # 靜止技能
-        self.skill1_used_this_turn = False
-        self.skill2_used_this_turn = False
-        self.selected_skill = None  # 'skill1' or 'skill2'
-        self.stun_area = None  # 靜止技能的顯示區域
-        
-        # 牆壁 (紅色線條)
-        self.walls = set()
-        self.init_walls()
-        
-        # 單向門
-        self.one_way_doors = set()
-        self.init_one_way_doors()
-        
-        # 壓版系統
-        self.yellow_plate = [1, 3]
-        self.yellow_plate_active = False
-        self.blue_plates = [[5, 8], [5, 7], [5, 6]]
-        self.green_plates = [[3, 7], [3, 6], [3, 5]]
-        self.purple_plates = [[7, 8], [7, 7]]
-        
-        # 門系統 (位置是兩個格子之間)
-        self.doors = {
-            "yellow1": {"between": [[1, 6], [2, 6]], "open": False},
-            "yellow2": {"between": [[1, 7], [2, 7]], "open": False},
-            "yellow3": {"between": [[7, 8], [8, 8]], "open": False},
-            "green": {"between": [[2, 2], [3, 2]], "open": False},
-            "purple": {"between": [[4, 2], [5, 2]], "open": False},
-            "blue": {"between": [[6, 2], [7, 2]], "open": False}
-        }
-        
-        # 目標位置
-        self.goal_pos = [7, 2]
-        
-        # 遊戲狀態
-        self.game_won = False
-        self.game_lost = False
-        
-        self.action_log = []  # 記錄當前回合的行動
-        
-        # 返回上一步功能
-        self.history = []  # 儲存每一步的狀態
-        self.redo_stack = []  # 撤銷後可重做的狀態
-        
-    def init_walls(self):
-        """根據圖片初始化牆壁"""
-        # 外圍牆壁 - 最外框正方形
-        for x in range(1, 9):
-            self.walls.add((x, 1, 'H'))  # 下邊界
-            self.walls.add((x, 9, 'H'))  # 上邊界
-        for y in range(1, 9):
-            self.walls.add((1, y, 'V'))  # 左邊界
-            self.walls.add((9, y, 'V'))  # 右邊界
-        
-        # 水平牆壁 - (x,y) 和 (x,y+1) 之間
-        # (x,4) (x,5) 之間
-        for x in [1, 2, 3, 4, 5, 6, 7, 8]:
-            self.walls.add((x, 5, 'H'))
-        
-        # (x,5) (x,6) 之間
-        for x in [1, 2, 3, 4, 5, 6]:
-            self.walls.add((x, 6, 'H'))
-        
-        # (x,6) (x,7) 之間
-        for x in [1, 2, 3, 4, 5, 6, 7]:
-            self.walls.add((x, 7, 'H'))
-        
-        # (x,7) (x,8) 之間
-        for x in [1, 2, 3, 4, 5, 6, 7, 8]:
-            self.walls.add((x, 8, 'H'))
-        
-        # 垂直牆壁 - (x,y) 和 (x+1,y) 之間
-        # (2,1) (3,1) 之間
-        self.walls.add((3, 1, 'V'))
-        
-        # (2,4) (3,4) 之間
-        self.walls.add((3, 4, 'V'))
-        
-        # (4,3) (5,3) 之間
-        self.walls.add((5, 3, 'V'))
-        
-        # (4,4) (5,4) 之間
-        self.walls.add((5, 4, 'V'))
-        
-        # (6,1) (7,1) 之間
-        self.walls.add((7, 1, 'V'))
-        
-        # (6,3) (7,3) 之間
-        self.walls.add((7, 3, 'V'))
-        
-        # (6,4) (7,4) 之間
-        self.walls.add((7, 4, 'V'))
-        
-        # (4,5) (5,5) 之間
-        self.walls.add((5, 5, 'V'))
-        
-        # (6,6) (7,6) 之間
-        self.walls.add((7, 6, 'V'))
-        
-        # (7,7) (8,7) 之間
-        self.walls.add((8, 7, 'V'))
-        
-    def init_one_way_doors(self):
-        """初始化單向門"""
-        # 單向門 1: (2,3) 和 (3,3) 之間，只能從 (3,3) 走到 (2,3)
-        self.one_way_doors.add((2, 3, Direction.LEFT))
-        
-        # 單向門 2: (4,1) 和 (5,1) 之間，只能從 (5,1) 走到 (4,1)
-        self.one_way_doors.add((4, 1, Direction.LEFT))
-    
-    def save_state(self):
-        self.history.append(self.get_state())
-        self.redo_stack.clear()  # 新動作後清空 redo
-    
-    def undo(self):
-        """返回上一步（可跨回合）"""
-        if not self.history:
-            self.action_log.append("無法撤銷！")
-            return False
-        self.redo_stack.append(self.get_state())
-        state = self.history.pop()
-        self.set_state(state)
-        return True
+        # 遊戲規則引擎
+        self.engine = engine if engine is not None else Engine()
+        # 目前顯示的範圍：左下角的格子座標與邊長（棋盤比畫面小時顯示整個棋盤）
+        self.view_size = min(self.engine.size, VIEW_CELLS)
+        self.view = (1, 1)
+        # 靜態盤面快取：只在門或壓版狀態改變、或畫面捲動時重新繪製
+        self.board_surface = pygame.Surface((BOARD_PIXELS, WINDOW_HEIGHT)).convert()
+        self.board_key = None
+        self.engine.door_listeners.append(self.on_doors_changed)
+        # 半透明圖層（靜止範圍、敵人預測位置）只建立一次
+        self.stun_cell = pygame.Surface((CELL_SIZE, CELL_SIZE), pygame.SRCALPHA)
+        self.stun_cell.fill((YELLOW[0], YELLOW[1], YELLOW[2], 70))
+        pygame.draw.rect(self.stun_cell, (255, 255, 255, 40), (0, 0, CELL_SIZE, CELL_SIZE), border_radius=10)
+        self.prediction_cell = pygame.Surface((CELL_SIZE, CELL_SIZE), pygame.SRCALPHA)
+        pygame.draw.circle(self.prediction_cell, (RED[0], RED[1], RED[2], 60),
+                           (CELL_SIZE // 2, CELL_SIZE // 2), CELL_SIZE // 3)
+        # 敵人威脅熱區：預測結果由 Engine 快取，繪製好的圖層在預測改變時才重建
+        self.show_threat = False
+        self.threat_horizon = THREAT_HORIZON
+        self.threat_surface = pygame.Surface((BOARD_PIXELS, WINDOW_HEIGHT), pygame.SRCALPHA)
+        self.threat_key = None
+        # 本回合可到達的格子（按 R 顯示），同樣只在狀態改變時重建
+        self.show_reachable = False
+        self.reachable_surface = pygame.Surface((BOARD_PIXELS, WINDOW_HEIGHT), pygame.SRCALPHA)
+        self.reachable_key = None
+        # 提示（按 N 顯示）：第一次顯示時才啟動背景搜尋行程，有解答資料庫時由該行程查表
+        self.show_hint = False
+        self.advisor = None
+        self.tablebase_path = tablebase.path_for(DEFAULT_LEVEL)
+        # 側邊欄快取：顯示內容改變時才重新繪製，文字另有 LRU 快取
+        self.text_cache = TextCache()
+        self.message = None  # 側邊欄底部的提示訊息（存檔、提示狀態等）
+        self.sidebar_surface = pygame.Surface((SIDEBAR_WIDTH, WINDOW_HEIGHT)).convert()
+        self.sidebar_key = None
+        # 事件驅動繪製：記錄螢幕上目前顯示的內容，只重畫有變化的區域
+        self.board_rect = pygame.Rect(0, 0, BOARD_PIXELS, WINDOW_HEIGHT)
+        self.sidebar_rect = pygame.Rect(BOARD_PIXELS, 0, SIDEBAR_WIDTH, WINDOW_HEIGHT)
+        self.shown_board = None
+        self.shown_sidebar = None
+        # 效能分析（F3 顯示每幀耗時，F4 擷取 cProfile）
+        self.profiler = FrameProfiler()
+        self.profiler_rect = pygame.Rect(6, 6, 260, 190)
+        # 每幀都變的數字另用一個小快取，不擠掉盤面與側邊欄的文字
+        self.profiler_text = TextCache(64)
+        # 輸入錄影：所有改變遊戲狀態的操作都經由 recorder 執行（F5 存檔）
+        self.recorder = replay.Recorder(self.engine)
+        self.record_path = None
+        # 存檔：F6 存檔、F7 讀檔，關閉視窗時自動存檔（None 表示不自動存檔）
+        self.save_path = savegame.SAVE_PATH
 
-    def redo(self):
-        """重做（返回撤銷前的狀態）"""
-        if not self.redo_stack:
-            self.action_log.append("無法重做！")
-            return False
-        self.history.append(self.get_state())
-        redo_state = self.redo_stack.pop()
-        self.set_state(redo_state)
-        return True
-    
-    def find_path_bfs(self, start, goal):
-        """使用 BFS 尋找從起點到終點的最短路徑"""
-        if start == goal:
-            return []
-        
-        queue = deque([(start, [])])
-        visited = {tuple(start)}
-        
-        while queue:
-            current, path = queue.popleft()
-            
-            # 檢查四個方向
-            for dx, dy in [(0, 1), (0, -1), (-1, 0), (1, 0)]:
-                next_pos = [current[0] + dx, current[1] + dy]
-                next_tuple = tuple(next_pos)
-                
-                if next_tuple in visited:
-                    continue
-                
-                if self.can_move(current, next_pos):
-                    new_path = path + [(dx, dy)]
-                    
-                    if next_pos == goal:
-                        return new_path
-                    
-                    queue.append((next_pos, new_path))
-                    visited.add(next_tuple)
-        
-        return None  # 找不到路徑
-    
-    
-    
-    
     def coord_to_screen(self, x, y):
-        """遊戲座標 (1-8) 轉換為螢幕座標，Y 軸翻轉"""
-        screen_x = (x - 1) * CELL_SIZE
-        screen_y = (8 - y) * CELL_SIZE
+        """遊戲座標轉換為螢幕座標（相對於目前顯示範圍），Y 軸翻轉"""
+        left, bottom = self.view
+        screen_x = (x - left) * CELL_SIZE
+        screen_y = (bottom + self.view_size - 1 - y) * CELL_SIZE
         return screen_x, screen_y
     
     def screen_to_coord(self, screen_x, screen_y):
-        """螢幕座標轉換為遊戲座標 (1-8)"""
-        x = screen_x // CELL_SIZE + 1
-        y = 8 - (screen_y // CELL_SIZE)
+        """螢幕座標轉換為遊戲座標"""
+        left, bottom = self.view
+        x = screen_x // CELL_SIZE + left
+        y = bottom + self.view_size - 1 - screen_y // CELL_SIZE
         return x, y
+
+    def visible(self, x, y):
+        left, bottom = self.view
+        return left <= x < left + self.view_size and bottom <= y < bottom + self.view_size
+
+    def follow_player(self):
+        """玩家接近顯示範圍邊緣時捲動畫面，讓玩家保持在中間附近（不超出棋盤）"""
+        size, view = self.engine.size, self.view_size
+        px, py = self.engine.player_pos
+        left, bottom = self.view
+        margin = view // 4
+        if not left + margin <= px < left + view - margin:
+            left = min(max(1, px - view // 2), size - view + 1)
+        if not bottom + margin <= py < bottom + view - margin:
+            bottom = min(max(1, py - view // 2), size - view + 1)
+        self.view = (left, bottom)
     
-    def draw_grid(self):
-        """繪製格子（現代扁平風）"""
+    def render_board(self):
+        """把靜態盤面（格子、牆壁、壓版、門、單向門）繪製到快取的 surface"""
+        e = self.engine
+        surface = self.board_surface
         # 背景
         # 使用 Catppuccin Mocha 最深色 crust
-        self.screen.fill((24, 24, 37))  # Catppuccin Mocha crust #181825
-        # 格子
-        for x in range(1, 9):
-            for y in range(1, 9):
+        surface.fill((24, 24, 37))  # Catppuccin Mocha crust #181825
+        left, bottom = self.view
+        visible = self.visible
+        # 格子（只畫顯示範圍內的部分）
+        for x in range(left, left + self.view_size):
+            for y in range(bottom, bottom + self.view_size):
                 sx, sy = self.coord_to_screen(x, y)
                 rect = pygame.Rect(sx, sy, CELL_SIZE, CELL_SIZE)
                 # 陰影
                 shadow_rect = pygame.Rect(sx + 3, sy + 3, CELL_SIZE, CELL_SIZE)
-                pygame.draw.rect(self.screen, SHADOW, shadow_rect, border_radius=8)
+                pygame.draw.rect(surface, SHADOW, shadow_rect, border_radius=8)
                 # 主格子
-                pygame.draw.rect(self.screen, WHITE, rect, border_radius=8)
+                pygame.draw.rect(surface, WHITE, rect, border_radius=8)
                 # 邊框（更淡的灰色）
-                pygame.draw.rect(self.screen, GRID_LINE, rect, 2, border_radius=8)
+                pygame.draw.rect(surface, GRID_LINE, rect, 2, border_radius=8)
         # 牆壁
-        for wall in self.walls:
-            if len(wall) == 3:
+        for wall in e.walls:
+            # 牆壁畫在格子的下緣或左緣，外框的上緣與右緣牆屬於範圍外的格子
+            if len(wall) == 3 and (visible(wall[0], wall[1]) or visible(wall[0], wall[1] - 1)
+                                   or visible(wall[0] - 1, wall[1])):
                 x, y, orientation = wall
                 if orientation == 'H':
                     sx, sy = self.coord_to_screen(x, y)
-                    pygame.draw.line(self.screen, MOCHA_CRUST, (sx + 8, sy + CELL_SIZE), (sx + CELL_SIZE - 8, sy + CELL_SIZE), 6)
+                    pygame.draw.line(surface, MOCHA_CRUST, (sx + 8, sy + CELL_SIZE), (sx + CELL_SIZE - 8, sy + CELL_SIZE), 6)
                 else:
                     sx, sy = self.coord_to_screen(x, y)
-                    pygame.draw.line(self.screen, MOCHA_CRUST, (sx, sy + 8), (sx, sy + CELL_SIZE - 8), 6)
+                    pygame.draw.line(surface, MOCHA_CRUST, (sx, sy + 8), (sx, sy + CELL_SIZE - 8), 6)
         # 壓板
-        sx, sy = self.coord_to_screen(*self.yellow_plate)
-        color = YELLOW if self.yellow_plate_active else (230, 220, 120)
-        pygame.draw.rect(self.screen, color, (sx + 10, sy + 10, CELL_SIZE - 20, CELL_SIZE - 20), border_radius=10)
-        # 藍色壓板
-        for plate in self.blue_plates:
-            sx, sy = self.coord_to_screen(*plate)
-            pygame.draw.rect(self.screen, CYAN, (sx + 10, sy + 10, CELL_SIZE - 20, CELL_SIZE - 20), border_radius=10)
-        # 綠色壓板
-        for plate in self.green_plates:
-            sx, sy = self.coord_to_screen(*plate)
-            pygame.draw.rect(self.screen, GREEN, (sx + 10, sy + 10, CELL_SIZE - 20, CELL_SIZE - 20), border_radius=10)
-        # 紫色壓板
-        for plate in self.purple_plates:
-            sx, sy = self.coord_to_screen(*plate)
-            pygame.draw.rect(self.screen, PURPLE, (sx + 10, sy + 10, CELL_SIZE - 20, CELL_SIZE - 20), border_radius=10)
+        if visible(*e.yellow_plate):
+            sx, sy = self.coord_to_screen(*e.yellow_plate)
+            color = YELLOW if e.yellow_plate_active else (230, 220, 120)
+            pygame.draw.rect(surface, color, (sx + 10, sy + 10, CELL_SIZE - 20, CELL_SIZE - 20), border_radius=10)
+        # 各色壓板
+        for plate_color, plates in e.plates.items():
+            for plate in plates:
+                if not visible(*plate):
+                    continue
+                sx, sy = self.coord_to_screen(*plate)
+                pygame.draw.rect(surface, PLATE_COLORS[plate_color], (sx + 10, sy + 10, CELL_SIZE - 20, CELL_SIZE - 20), border_radius=10)
         # 門
-        for door_name, door_info in self.doors.items():
+        for door_info in e.doors.values():
             pos1, pos2 = door_info["between"]
+            if not (visible(*pos1) or visible(*pos2)):
+                continue
             is_open = door_info["open"]
-            if "yellow" in door_name:
-                color = YELLOW
-            elif "green" in door_name:
-                color = GREEN
-            elif "purple" in door_name:
-                color = PURPLE
-            elif "blue" in door_name:
-                color = CYAN
+            color = PLATE_COLORS[door_info["plate"]]
             if pos1[1] == pos2[1]:
                 y = pos1[1]
                 x = max(pos1[0], pos2[0])
                 sx, sy = self.coord_to_screen(x, y)
                 if is_open:
                     for i in range(10, CELL_SIZE - 10, 14):
-                        pygame.draw.line(self.screen, color, (sx, sy + i), (sx, sy + i + 8), 5)
+                        pygame.draw.line(surface, color, (sx, sy + i), (sx, sy + i + 8), 5)
                 else:
-                    pygame.draw.line(self.screen, color, (sx, sy + 10), (sx, sy + CELL_SIZE - 10), 10)
+                    pygame.draw.line(surface, color, (sx, sy + 10), (sx, sy + CELL_SIZE - 10), 10)
             else:
                 x = pos1[0]
                 y = max(pos1[1], pos2[1])
                 sx, sy = self.coord_to_screen(x, y)
                 if is_open:
                     for i in range(10, CELL_SIZE - 10, 14):
-                        pygame.draw.line(self.screen, color, (sx + i, sy + CELL_SIZE), (sx + i + 8, sy + CELL_SIZE), 5)
+                        pygame.draw.line(surface, color, (sx + i, sy + CELL_SIZE), (sx + i + 8, sy + CELL_SIZE), 5)
                 else:
-                    pygame.draw.line(self.screen, color, (sx + 10, sy + CELL_SIZE), (sx + CELL_SIZE - 10, sy + CELL_SIZE), 10)
+                    pygame.draw.line(surface, color, (sx + 10, sy + CELL_SIZE), (sx + CELL_SIZE - 10, sy + CELL_SIZE), 10)
         # 單向門
-        for door in self.one_way_doors:
+        for door in e.one_way_doors:
             x, y, direction = door
+            if not visible(x, y):
+                continue
             sx, sy = self.coord_to_screen(x, y)
             center_x = sx + CELL_SIZE // 2
             center_y = sy + CELL_SIZE // 2
             if direction == Direction.LEFT:
-                pygame.draw.line(self.screen, DARK_BLUE, (center_x + 18, center_y), (center_x - 18, center_y), 4)
-                pygame.draw.polygon(self.screen, DARK_BLUE, [
+                pygame.draw.line(surface, DARK_BLUE, (center_x + 18, center_y), (center_x - 18, center_y), 4)
+                pygame.draw.polygon(surface, DARK_BLUE, [
                     (center_x - 18, center_y),
                     (center_x - 8, center_y - 8),
                     (center_x - 8, center_y + 8)
                 ])
+        self.board_key = (id(e.passable), e.yellow_plate_active, self.view)
+
+    def on_doors_changed(self, names):
+        """門的開關改變時，讓靜態盤面在下次繪製時重建"""
+        self.board_key = None
+
+    def draw_grid(self):
+        """繪製格子（現代扁平風）：靜態盤面取自快取，再疊上動態圖層"""
+        e = self.engine
+        self.follow_player()
+        if self.board_key != (id(e.passable), e.yellow_plate_active, self.view):
+            self.render_board()
+        self.screen.blit(self.board_surface, (0, 0))
         # 靜止技能範圍
-        if self.stun_area:
-            cx, cy = self.stun_area
+        if e.stun_area:
+            cx, cy = e.stun_area
             for dx in range(-1, 2):
                 for dy in range(-1, 2):
                     tx, ty = cx + dx, cy + dy
-                    if 1 <= tx <= 8 and 1 <= ty <= 8:
-                        sx, sy = self.coord_to_screen(tx, ty)
-                        s = pygame.Surface((CELL_SIZE, CELL_SIZE), pygame.SRCALPHA)
-                        s.fill((YELLOW[0], YELLOW[1], YELLOW[2], 70))
-                        pygame.draw.rect(s, (255,255,255,40), (0,0,CELL_SIZE,CELL_SIZE), border_radius=10)
-                        self.screen.blit(s, (sx, sy))
+                    if 1 <= tx <= e.size and 1 <= ty <= e.size and self.visible(tx, ty):
+                        self.screen.blit(self.stun_cell, self.coord_to_screen(tx, ty))
+        playing = e.player_turn and not e.game_won and not e.game_lost
+        if playing:
+            forecast, threat = e.forecast_enemies(self.threat_horizon if self.show_threat else 1)
+            if self.show_threat:
+                self.draw_threat(threat)
+            if self.show_reachable:
+                self.draw_reachable()
         # 目標位置
-        sx, sy = self.coord_to_screen(*self.goal_pos)
-        center = (sx + CELL_SIZE // 2, sy + CELL_SIZE // 2)
-        pygame.draw.circle(self.screen, ORANGE, center, CELL_SIZE // 3)
-        pygame.draw.circle(self.screen, WHITE, center, CELL_SIZE // 3 - 8)
+        if self.visible(*e.goal_pos):
+            sx, sy = self.coord_to_screen(*e.goal_pos)
+            center = (sx + CELL_SIZE // 2, sy + CELL_SIZE // 2)
+            pygame.draw.circle(self.screen, ORANGE, center, CELL_SIZE // 3)
+            pygame.draw.circle(self.screen, WHITE, center, CELL_SIZE // 3 - 8)
         # 玩家
-        sx, sy = self.coord_to_screen(*self.player_pos)
+        sx, sy = self.coord_to_screen(*e.player_pos)
         center = (sx + CELL_SIZE // 2, sy + CELL_SIZE // 2)
         pygame.draw.circle(self.screen, DARK_BLUE, center, CELL_SIZE // 3)
         pygame.draw.circle(self.screen, WHITE, center, CELL_SIZE // 3 - 8)
-        # 敵人
-        for i, enemy in enumerate(self.enemies):
+        # 敵人（只畫顯示範圍內的）
+        for i, enemy in enumerate(e.enemies):
             # 預測位置
-            if self.player_turn and not self.game_won and not self.game_lost:
-                next_pos = self.predict_enemy_next_pos(enemy)
-                nsx, nsy = self.coord_to_screen(*next_pos)
-                next_center = (nsx + CELL_SIZE // 2, nsy + CELL_SIZE // 2)
-                s = pygame.Surface((CELL_SIZE, CELL_SIZE), pygame.SRCALPHA)
-                pygame.draw.circle(s, (RED[0], RED[1], RED[2], 60), (CELL_SIZE // 2, CELL_SIZE // 2), CELL_SIZE // 3)
-                self.screen.blit(s, (nsx, nsy))
-                pygame.draw.circle(self.screen, RED, next_center, CELL_SIZE // 3, 2)
-            sx, sy = self.coord_to_screen(*enemy["pos"])
+            if playing:
+                cell = forecast[0][i] >> 2
+                nx, ny = pos_of(cell, e.size)
+                if self.visible(nx, ny):
+                    nsx, nsy = self.coord_to_screen(nx, ny)
+                    next_center = (nsx + CELL_SIZE // 2, nsy + CELL_SIZE // 2)
+                    self.screen.blit(self.prediction_cell, (nsx, nsy))
+                    pygame.draw.circle(self.screen, RED, next_center, CELL_SIZE // 3, 2)
+            pos = enemy.pos
+            if not self.visible(*pos):
+                continue
+            sx, sy = self.coord_to_screen(*pos)
             center = (sx + CELL_SIZE // 2, sy + CELL_SIZE // 2)
             pygame.draw.circle(self.screen, RED, center, CELL_SIZE // 3)
             pygame.draw.circle(self.screen, WHITE, center, CELL_SIZE // 3 - 8)
             # 標記敵人移動方向
-            dir = enemy["dir"].value
+            dir = enemy.dir.value
             arrow_len = CELL_SIZE // 3 - 4
             # 算出箭頭終點
             dx, dy = dir
@@ -437,51 +335,156 @@ class Game:
             # 箭頭主體
             pygame.draw.line(self.screen, DARK_GRAY, center, arrow_tip, 4)
             # 箭頭三角形
-            import math
             angle = math.atan2(screen_dy, screen_dx)
             left = (arrow_tip[0] - 10 * math.cos(angle - math.pi / 6), arrow_tip[1] - 10 * math.sin(angle - math.pi / 6))
             right = (arrow_tip[0] - 10 * math.cos(angle + math.pi / 6), arrow_tip[1] - 10 * math.sin(angle + math.pi / 6))
             pygame.draw.polygon(self.screen, DARK_GRAY, [arrow_tip, left, right])
-            if enemy["stunned"] > 0:
+            if enemy.stunned > 0:
                 pygame.draw.circle(self.screen, PURPLE, center, CELL_SIZE // 3 + 6, 3)
+        if playing and self.show_hint:
+            self.draw_hint()
     
+    def draw_threat(self, threat):
+        """威脅熱區：越早有敵人停留的格子顏色越深，並標示回合數"""
+        left, bottom = self.view
+        size = self.engine.size
+        cells = [(x, y) for y in range(bottom, bottom + self.view_size) for x in range(left, left + self.view_size)]
+        turns = tuple(threat[cell_of(pos, size)] for pos in cells)
+        key = (turns, self.threat_horizon, self.view)
+        if key != self.threat_key:
+            surface = self.threat_surface
+            surface.fill((0, 0, 0, 0))
+            for (x, y), turn in zip(cells, turns):
+                if turn:
+                    sx, sy = self.coord_to_screen(x, y)
+                    alpha = 40 + 120 * (self.threat_horizon - turn) // self.threat_horizon
+                    pygame.draw.rect(surface, (RED[0], RED[1], RED[2], alpha), (sx + 4, sy + 4, CELL_SIZE - 8, CELL_SIZE - 8),
+                                     border_radius=8)
+                    label = self.text_cache.render(self.small_font, str(turn), BLACK)
+                    surface.blit(label, (sx + CELL_SIZE - label.get_width() - 6, sy + 4))
+            self.threat_key = key
+        self.screen.blit(self.threat_surface, (0, 0))
+
+    def draw_reachable(self):
+        """本回合剩餘步數內可安全到達的格子，標示所需步數"""
+        e = self.engine
+        key = (tuple(e.player_pos), e.player_moves_left, e.yellow_plate_active, e.door_mask,
+               tuple(e.enemies.states), self.view)
+        if key != self.reachable_key:
+            surface = self.reachable_surface
+            surface.fill((0, 0, 0, 0))
+            for (x, y), steps in pathing.reachable_this_turn(e).items():
+                if steps and self.visible(x, y):
+                    sx, sy = self.coord_to_screen(x, y)
+                    center = (sx + CELL_SIZE // 2, sy + CELL_SIZE // 2)
+                    pygame.draw.circle(surface, (DARK_BLUE[0], DARK_BLUE[1], DARK_BLUE[2], 160), center, 12)
+                    label = self.text_cache.render(self.small_font, str(steps), WHITE)
+                    surface.blit(label, label.get_rect(center=center))
+            self.reachable_key = key
+        self.screen.blit(self.reachable_surface, (0, 0))
+
+    def notify(self, text):
+        """在側邊欄底部顯示一則訊息（取代上一則）"""
+        self.message = text
+
+    def toggle_hint(self):
+        """切換提示；沒有與目前關卡相符的解答資料庫時改用背景搜尋，背景行程已結束時重新啟動"""
+        if not self.show_hint and (self.advisor is None or not self.advisor.alive):
+            if self.advisor is not None:
+                self.advisor.close()
+            path = self.tablebase_path
+            if tablebase.open_for(self.engine.level, path) is None:
+                self.notify("無解答資料庫，改用背景搜尋")
+                path = None
+            self.advisor = advisor.Advisor(self.engine.level, path)
+        self.show_hint = not self.show_hint
+
+    def draw_hint(self):
+        """標示背景提示目前建議的下一個動作，並在盤面左下角顯示說明"""
+        e = self.engine
+        hint = self.advisor.hint
+        if not self.advisor.alive:
+            text = "提示：背景行程已結束，按兩次 N 重新啟動"
+        elif hint is None:
+            text = "提示：搜尋中…"
+        elif hint.action is None or (hint.turns is not None and e.turn + hint.turns > e.max_turns):
+            text = "提示：已無法在回合限制內通關"
+        else:
+            action, turns = hint.action, hint.turns
+            name = "結束回合" if action[0] == "end_turn" else solver._format(action)
+            if turns is None:
+                text = f"提示：{name}（搜尋中…）"
+            else:
+                text = f"提示：{name}（{f'{turns} 回合後通關' if turns else '本回合即可通關'}）"
+            cells = []
+            if action[0] == "move_player":
+                cells = [(e.player_pos[0] + action[1], e.player_pos[1] + action[2])]
+            elif action[0] == "use_skill2":
+                cells = [(action[1] + dx, action[2] + dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1)]
+            for x, y in cells:
+                if 1 <= x <= e.size and 1 <= y <= e.size and self.visible(x, y):
+                    sx, sy = self.coord_to_screen(x, y)
+                    pygame.draw.rect(self.screen, GREEN, (sx + 3, sy + 3, CELL_SIZE - 6, CELL_SIZE - 6), 4,
+                                     border_radius=10)
+        label = self.text_cache.render(self.small_font, text, BLACK)
+        self.screen.blit(label, (8, WINDOW_HEIGHT - label.get_height() - 8))
+
+    def sidebar_state(self):
+        """側邊欄顯示的所有內容，改變時才需要重新繪製"""
+        e = self.engine
+        level = e.level
+        return (e.turn, e.max_turns, e.player_moves_left, e.player_moves, level.skill1_uses, level.skill2_uses,
+                e.skill1_uses, e.skill1_used_this_turn, e.skill2_uses, e.skill2_used_this_turn,
+                e.selected_skill, len(e.history), e.history.redo_count,
+                tuple(e.action_log[-8:]), e.game_won, e.game_lost, self.message)
+
     def draw_sidebar(self):
-        """繪製側邊欄"""
-        sidebar_rect = pygame.Rect(GRID_SIZE * CELL_SIZE, 0, SIDEBAR_WIDTH, WINDOW_HEIGHT)
-        pygame.draw.rect(self.screen, SIDEBAR_BG, sidebar_rect)
-        
-        x = GRID_SIZE * CELL_SIZE + 10
+        """繪製側邊欄（內容未改變時直接使用快取）"""
+        key = self.sidebar_state()
+        if key != self.sidebar_key:
+            self.render_sidebar()
+            self.sidebar_key = key
+        self.screen.blit(self.sidebar_surface, (BOARD_PIXELS, 0))
+
+    def render_sidebar(self):
+        """把側邊欄繪製到快取的 surface，按鈕位置換算成視窗座標"""
+        e = self.engine
+        surface = self.sidebar_surface
+        surface.fill(SIDEBAR_BG)
+        offset = BOARD_PIXELS
+
+        x = 10
         y = 20
         
         # 回合資訊
-        turn_text = self.font.render(f"回合：{self.turn}/{self.max_turns}", True, WHITE)
-        self.screen.blit(turn_text, (x, y))
+        turn_text = self.text_cache.render(self.font, f"回合：{e.turn}/{e.max_turns}", WHITE)
+        surface.blit(turn_text, (x, y))
         y += 36
         # 剩餘步數
-        moves_text = self.font.render(f"剩餘步數：{self.player_moves_left}/6", True, WHITE)
-        self.screen.blit(moves_text, (x, y))
+        moves_text = self.text_cache.render(self.font, f"剩餘步數：{e.player_moves_left}/{e.player_moves}", WHITE)
+        surface.blit(moves_text, (x, y))
         y += 44
         
         # 判斷是否遊戲結束（勝利或失敗）
-        game_over = self.game_won or self.game_lost
+        game_over = e.game_won or e.game_lost
 
         # 技能 1 按鈕
         skill1_rect = pygame.Rect(x, y, 280, 40)
         if game_over:
             color = GRAY
         else:
-            color = GREEN if self.skill1_uses > 0 and not self.skill1_used_this_turn else GRAY
-            if self.selected_skill == 'skill1':
+            color = GREEN if e.skill1_uses > 0 and not e.skill1_used_this_turn else GRAY
+            if e.selected_skill == 'skill1':
                 color = ORANGE
-        pygame.draw.rect(self.screen, color, skill1_rect)
-        text = f"技能 1: 回溯 ({self.skill1_uses}/3)"
-        if self.skill1_used_this_turn:
+        pygame.draw.rect(surface, color, skill1_rect)
+        text = f"技能 1: 回溯 ({e.skill1_uses}/{e.level.skill1_uses})"
+        if e.skill1_used_this_turn:
             text += " [已用]"
         # 技能按鈕用深色字
-        text_surf = self.small_font.render(text, True, BLACK)
+        text_surf = self.text_cache.render(self.small_font, text, BLACK)
         text_rect = text_surf.get_rect(center=skill1_rect.center)
-        self.screen.blit(text_surf, text_rect)
-        self.skill1_button = skill1_rect
+        surface.blit(text_surf, text_rect)
+        self.skill1_button = skill1_rect.move(offset, 0)
         y += 50
 
         # 技能 2 按鈕
@@ -489,68 +492,68 @@ class Game:
         if game_over:
             color = GRAY
         else:
-            color = GREEN if self.skill2_uses > 0 and not self.skill2_used_this_turn else GRAY
-            if self.selected_skill == 'skill2':
+            color = GREEN if e.skill2_uses > 0 and not e.skill2_used_this_turn else GRAY
+            if e.selected_skill == 'skill2':
                 color = ORANGE
-        pygame.draw.rect(self.screen, color, skill2_rect)
-        text = f"技能 2: 靜止 ({self.skill2_uses}/3)"
-        if self.skill2_used_this_turn:
+        pygame.draw.rect(surface, color, skill2_rect)
+        text = f"技能 2: 靜止 ({e.skill2_uses}/{e.level.skill2_uses})"
+        if e.skill2_used_this_turn:
             text += " [已用]"
         # 技能按鈕用深色字
-        text_surf = self.small_font.render(text, True, BLACK)
+        text_surf = self.text_cache.render(self.small_font, text, BLACK)
         text_rect = text_surf.get_rect(center=skill2_rect.center)
-        self.screen.blit(text_surf, text_rect)
-        self.skill2_button = skill2_rect
+        surface.blit(text_surf, text_rect)
+        self.skill2_button = skill2_rect.move(offset, 0)
         y += 50
 
         # 撤銷按鈕
         undo_rect = pygame.Rect(x, y, 135, 50)
-        undo_color = GRAY if game_over else (PURPLE if self.history else GRAY)
-        pygame.draw.rect(self.screen, undo_color, undo_rect)
-        text_surf = self.small_font.render(f"上一步 ({len(self.history)})", True, WHITE)
+        undo_color = GRAY if game_over else (PURPLE if e.history else GRAY)
+        pygame.draw.rect(surface, undo_color, undo_rect)
+        text_surf = self.text_cache.render(self.small_font, f"上一步 ({len(e.history)})", WHITE)
         text_rect = text_surf.get_rect(center=undo_rect.center)
-        self.screen.blit(text_surf, text_rect)
-        self.undo_button = undo_rect
+        surface.blit(text_surf, text_rect)
+        self.undo_button = undo_rect.move(offset, 0)
 
         # 重做按鈕
         redo_rect = pygame.Rect(x + 145, y, 135, 50)
-        redo_color = GRAY if game_over else (ORANGE if self.redo_stack else GRAY)
-        pygame.draw.rect(self.screen, redo_color, redo_rect)
-        text_surf = self.small_font.render(f"取消上一步 ({len(self.redo_stack)})", True, WHITE)
+        redo_color = GRAY if game_over else (ORANGE if e.history.redo_count else GRAY)
+        pygame.draw.rect(surface, redo_color, redo_rect)
+        text_surf = self.text_cache.render(self.small_font, f"取消上一步 ({e.history.redo_count})", WHITE)
         text_rect = text_surf.get_rect(center=redo_rect.center)
-        self.screen.blit(text_surf, text_rect)
-        self.redo_button = redo_rect
+        surface.blit(text_surf, text_rect)
+        self.redo_button = redo_rect.move(offset, 0)
         y += 55
 
         # 結束回合按鈕
         end_turn_rect = pygame.Rect(x, y, 135, 50)
         end_turn_color = GRAY if game_over else BLUE
-        pygame.draw.rect(self.screen, end_turn_color, end_turn_rect)
-        text_surf = self.small_font.render("結束回合", True, WHITE)
+        pygame.draw.rect(surface, end_turn_color, end_turn_rect)
+        text_surf = self.text_cache.render(self.small_font, "結束回合", WHITE)
         text_rect = text_surf.get_rect(center=end_turn_rect.center)
-        self.screen.blit(text_surf, text_rect)
-        self.end_turn_button = end_turn_rect
+        surface.blit(text_surf, text_rect)
+        self.end_turn_button = end_turn_rect.move(offset, 0)
 
         # 重新開始按鈕
         restart_rect = pygame.Rect(x + 145, y, 135, 50)
-        pygame.draw.rect(self.screen, RED, restart_rect)
-        text_surf = self.small_font.render("重新開始", True, WHITE)
+        pygame.draw.rect(surface, RED, restart_rect)
+        text_surf = self.text_cache.render(self.small_font, "重新開始", WHITE)
         text_rect = text_surf.get_rect(center=restart_rect.center)
-        self.screen.blit(text_surf, text_rect)
-        self.restart_button = restart_rect
+        surface.blit(text_surf, text_rect)
+        self.restart_button = restart_rect.move(offset, 0)
         y += 60
         
         # 行動記錄
-        if self.action_log:
-            log_title = self.font.render("本回合行動：", True, WHITE)
-            self.screen.blit(log_title, (x, y))
+        if e.action_log:
+            log_title = self.text_cache.render(self.font, "本回合行動：", WHITE)
+            surface.blit(log_title, (x, y))
             y += 30
             
             # 只顯示最近的 8 條記錄
-            recent_logs = self.action_log[-8:]
+            recent_logs = e.action_log[-8:]
             for log in recent_logs:
-                log_surf = self.small_font.render(log, True, WHITE)
-                self.screen.blit(log_surf, (x, y))
+                log_surf = self.text_cache.render(self.small_font, log, WHITE)
+                surface.blit(log_surf, (x, y))
                 y += 22
             y += 10
         
@@ -563,354 +566,167 @@ class Game:
         ]
         
         for text in help_texts:
-            text_surf = self.small_font.render(text, True, WHITE)
-            self.screen.blit(text_surf, (x, y))
+            text_surf = self.text_cache.render(self.small_font, text, WHITE)
+            surface.blit(text_surf, (x, y))
             y += 24
         
         # 遊戲結果
-        if self.game_won:
-            result_text = self.font.render("勝利！", True, GREEN)
-            self.screen.blit(result_text, (x + 80, y + 20))
-        elif self.game_lost:
-            result_text = self.font.render("失敗！", True, RED)
-            self.screen.blit(result_text, (x + 80, y + 20))
-    
-    def can_move(self, from_pos, to_pos):
-        """檢查是否可以移動"""
-        fx, fy = from_pos
-        tx, ty = to_pos
-        
-        # 檢查邊界
-        if not (1 <= tx <= 8 and 1 <= ty <= 8):
-            return False
-        
-        # 檢查牆壁
-        if fx != tx:  # 水平移動 (左右移動)
-            # 從 fx 移動到 tx，需要檢查之間的垂直牆
-            if tx > fx:  # 向右移動，檢查 tx 左邊的牆
-                if (tx, fy, 'V') in self.walls:
-                    return False
-            else:  # 向左移動，檢查 fx 左邊的牆
-                if (fx, fy, 'V') in self.walls:
-                    return False
-        
-        if fy != ty:  # 垂直移動 (上下移動)
-            # 從 fy 移動到 ty，需要檢查之間的水平牆
-            if ty > fy:  # 向上移動，檢查 ty 下邊的牆
-                if (fx, ty, 'H') in self.walls:
-                    return False
-            else:  # 向下移動，檢查 fy 下邊的牆
-                if (fx, fy, 'H') in self.walls:
-                    return False
-        
-        # 檢查門 (關閉的門視為牆壁)
-        for door_info in self.doors.values():
-            if not door_info["open"]:
-                pos1, pos2 = door_info["between"]
-                if [fx, fy] in [pos1, pos2] and [tx, ty] in [pos1, pos2]:
-                    return False
-        
-        # 檢查單向門
-        for door in self.one_way_doors:
-            dx, dy, direction = door
-            if direction == Direction.LEFT:
-                # 只能從右到左
-                if fy == dy and tx == dx and fx == dx + 1:
-                    return True  # 正確方向
-                elif fy == dy and fx == dx and tx == dx + 1:
-                    return False  # 錯誤方向
-        
-        return True
-    
-    def move_player(self, dx, dy, log_action=True):
-        """移動玩家"""
-        if not self.player_turn or self.player_moves_left <= 0:
-            return False
-        new_pos = [self.player_pos[0] + dx, self.player_pos[1] + dy]
-        if self.can_move(self.player_pos, new_pos):
-            # 儲存移動前的狀態
-            self.save_state()
-            old_pos = self.player_pos.copy()
-            self.player_pos = new_pos
-            self.player_moves_left -= 1
-            # 記錄行動
-            if log_action:
-                direction = ""
-                if dx == 1: direction = "右"
-                elif dx == -1: direction = "左"
-                elif dy == 1: direction = "上"
-                elif dy == -1: direction = "下"
-                self.action_log.append(f"向{direction}移動：({old_pos[0]},{old_pos[1]}) → ({new_pos[0]},{new_pos[1]})")
-            # 檢查黃色壓版
-            if self.player_pos == self.yellow_plate:
-                self.yellow_plate_active = not self.yellow_plate_active
-                self.update_doors()
-                if log_action:
-                    status = "開啟" if self.yellow_plate_active else "關閉"
-                    self.action_log.append(f"踩到黃色壓版！黃色門{status}")
-            # 檢查是否到達目標
-            if self.player_pos == self.goal_pos:
-                self.game_won = True
-                if log_action:
-                    self.action_log.append("到達目標！勝利！")
-            return True
-        return False
-    
-    def update_doors(self):
-        """更新門的狀態"""
-        # 黃色門 (三個門都由黃色壓版控制)
-        self.doors["yellow1"]["open"] = self.yellow_plate_active
-        self.doors["yellow2"]["open"] = self.yellow_plate_active
-        self.doors["yellow3"]["open"] = self.yellow_plate_active
-        
-        # 藍色門 - 檢查所有藍色壓版是否都被踩
-        blue_count = sum(1 for enemy in self.enemies if enemy["pos"] in self.blue_plates)
-        self.doors["blue"]["open"] = (blue_count == len(self.blue_plates))
-        
-        # 綠色門
-        green_count = sum(1 for enemy in self.enemies if enemy["pos"] in self.green_plates)
-        self.doors["green"]["open"] = (green_count == len(self.green_plates))
-        
-        # 紫色門
-        purple_count = sum(1 for enemy in self.enemies if enemy["pos"] in self.purple_plates)
-        self.doors["purple"]["open"] = (purple_count == len(self.purple_plates))
-    
-    def predict_enemy_next_pos(self, enemy):
-        """預測敵人下一回合的位置"""
-        # 如果敵人被靜止，下一回合不移動
-        if enemy["stunned"] > 0:
-            return enemy["pos"].copy()
-        
-        # 模擬敵人移動 4 步
-        sim_pos = enemy["pos"].copy()
-        sim_dir = enemy["dir"]
-        
-        for step in range(4):
-            dx, dy = sim_dir.value
-            new_pos = [sim_pos[0] + dx, sim_pos[1] + dy]
-            
-            if self.can_move(sim_pos, new_pos):
-                sim_pos = new_pos
-            else:
-                # 反彈
-                if sim_dir == Direction.RIGHT:
-                    sim_dir = Direction.LEFT
-                elif sim_dir == Direction.LEFT:
-                    sim_dir = Direction.RIGHT
-                elif sim_dir == Direction.UP:
-                    sim_dir = Direction.DOWN
-                else:
-                    sim_dir = Direction.UP
-                
-                # 反彈後用新方向移動
-                dx, dy = sim_dir.value
-                new_pos = [sim_pos[0] + dx, sim_pos[1] + dy]
-                if self.can_move(sim_pos, new_pos):
-                    sim_pos = new_pos
-        
-        return sim_pos
-    
-    def move_enemies(self):
-        """移動所有敵人"""
-        for enemy in self.enemies:
-            if enemy["stunned"] > 0:
-                enemy["stunned"] -= 1
-                continue
-            
-            # 移動 4 格
-            for step in range(4):
-                dx, dy = enemy["dir"].value
-                new_pos = [enemy["pos"][0] + dx, enemy["pos"][1] + dy]
-                
-                if self.can_move(enemy["pos"], new_pos):
-                    enemy["pos"] = new_pos
-                else:
-                    # 反彈 - 改變方向
-                    if enemy["dir"] == Direction.RIGHT:
-                        enemy["dir"] = Direction.LEFT
-                    elif enemy["dir"] == Direction.LEFT:
-                        enemy["dir"] = Direction.RIGHT
-                    elif enemy["dir"] == Direction.UP:
-                        enemy["dir"] = Direction.DOWN
-                    else:
-                        enemy["dir"] = Direction.UP
-                    
-                    # 反彈後用新方向移動
-                    dx, dy = enemy["dir"].value
-                    new_pos = [enemy["pos"][0] + dx, enemy["pos"][1] + dy]
-                    if self.can_move(enemy["pos"], new_pos):
-                        enemy["pos"] = new_pos
-        
-        self.update_doors()
-    
-    def use_skill1_on_enemy(self, enemy_index):
-        """對敵人使用回溯技能"""
-        if self.skill1_used_this_turn or self.skill1_uses <= 0:
-            self.action_log.append("技能已使用或無剩餘次數")
-            return False
-        # 第一回合敵人還沒移動，不能回溯
-        if self.turn_start_enemies is None:
-            self.action_log.append("第一回合敵人還未移動，無法回溯！")
-            self.selected_skill = None
-            return False
-        # 儲存使用技能前的狀態
-        self.save_state()
-        old_pos = self.enemies[enemy_index]["pos"].copy()
-        start_pos = self.turn_start_enemies[enemy_index]["pos"].copy()
-        # 添加調試信息
-        self.action_log.append(f"嘗試回溯敵人 #{enemy_index+1}")
-        self.action_log.append(f"當前位置：({old_pos[0]},{old_pos[1]})")
-        self.action_log.append(f"回溯目標：({start_pos[0]},{start_pos[1]})")
-        self.enemies[enemy_index]["pos"] = start_pos
-        self.enemies[enemy_index]["dir"] = self.turn_start_enemies[enemy_index]["dir"]
-        self.skill1_uses -= 1
-        self.skill1_used_this_turn = True
-        self.selected_skill = None
-        self.update_doors()
-        # 記錄行動
-        self.action_log.append(f"回溯成功！")
-        return True
-    
-    def use_skill1_on_player(self):
-        """對玩家使用回溯技能"""
-        if self.skill1_used_this_turn or self.skill1_uses <= 0:
-            return False
-        # 儲存使用技能前的狀態
-        self.save_state()
-        old_pos = self.player_pos.copy()
-        self.player_pos = self.turn_start_player_pos.copy()
-        self.skill1_uses -= 1
-        self.skill1_used_this_turn = True
-        self.selected_skill = None
-        # 檢查黃色壓版狀態 (可能需要更新)
-        self.update_doors()
-        # 記錄行動
-        self.action_log.append(f"回溯玩家：({old_pos[0]},{old_pos[1]}) → ({self.player_pos[0]},{self.player_pos[1]})")
-        return True
-    
-    def use_skill2(self, center_x, center_y):
-        """使用靜止技能"""
-        if self.skill2_used_this_turn or self.skill2_uses <= 0:
-            return False
-        # 儲存使用技能前的狀態
-        self.save_state()
-        # 對 3x3 範圍內的所有敵人施加靜止效果
-        stunned_any = False
-        for enemy in self.enemies:
-            ex, ey = enemy["pos"]
-            if abs(ex - center_x) <= 1 and abs(ey - center_y) <= 1:
-                enemy["stunned"] = 1  # 下一回合不能動
-                stunned_any = True
-        if stunned_any:
-            self.skill2_uses -= 1
-            self.skill2_used_this_turn = True
-            self.selected_skill = None
-            self.stun_area = None
-            return True
-        return False
+        if e.game_won:
+            result_text = self.text_cache.render(self.font, "勝利！", GREEN)
+            surface.blit(result_text, (x + 80, y + 20))
+        elif e.game_lost:
+            result_text = self.text_cache.render(self.font, "失敗！", RED)
+            surface.blit(result_text, (x + 80, y + 20))
+
+        # 提示訊息（在遊戲結果下方）
+        if self.message:
+            message = self.text_cache.render(self.small_font, self.message, YELLOW)
+            surface.blit(message, (x, y + 60))
     
-    def end_turn(self):
-        """結束當前回合，並儲存狀態以支援跨回合撤銷"""
-        self.save_state()  # 儲存回合結束前的狀態
-        if self.is_first_turn:
-            # 第一回合結束
-            self.is_first_turn = False
-            self.turn += 1
-            self.player_moves_left = 6
-            self.skill1_used_this_turn = False
-            self.skill2_used_this_turn = False
-            self.selected_skill = None
-            self.player_turn = False
-            self.action_log = []  # 清空行動記錄
-            # 記錄敵人移動前的狀態 (下一回合可以回溯到這裡)
-            self.turn_start_enemies = deepcopy(self.enemies)
-            # 敵人自動移動
-            self.move_enemies()
-            # 記錄玩家位置 (玩家還沒移動)
-            self.turn_start_player_pos = self.player_pos.copy()
-            self.player_turn = True
+    def board_state(self):
+        """盤面顯示的所有動態內容，改變時才需要重新繪製"""
+        e = self.engine
+        return (id(e.passable), e.door_mask, e.yellow_plate_active, tuple(e.player_pos),
+                e.enemies.pack(),
+                e.stun_area, e.player_turn, e.game_won, e.game_lost)
+
+    def redraw(self, force=False):
+        """只重畫內容有變化的區域，回傳需要更新到螢幕的矩形"""
+        dirty = []
+        board = self.board_state()
+        if force or board != self.shown_board:
+            self.draw_grid()
+            self.shown_board = board
+            dirty.append(self.board_rect)
+        sidebar = self.sidebar_state()
+        if force or sidebar != self.shown_sidebar:
+            self.draw_sidebar()
+            self.shown_sidebar = sidebar
+            dirty.append(self.sidebar_rect)
+        return dirty
+
+    def toggle_profiler(self):
+        """切換效能分析模式：計時繪製函式，並計算熱點呼叫次數"""
+        e = self.engine
+        if self.profiler.enabled:
+            self.profiler.disable()
         else:
-            # 正常回合結束
-            self.turn += 1
-            if self.turn > self.max_turns:
-                self.game_lost = True
-                return
-            self.player_moves_left = 6
-            self.skill1_used_this_turn = False
-            self.skill2_used_this_turn = False
-            self.selected_skill = None
-            self.player_turn = False
-            self.action_log = []  # 清空行動記錄
-            # 記錄敵人移動前的狀態 (下一回合可以回溯到這裡)
-            self.turn_start_enemies = deepcopy(self.enemies)
-            # 敵人自動移動
-            self.move_enemies()
-            # 記錄玩家位置 (玩家還沒移動)
-            self.turn_start_player_pos = self.player_pos.copy()
-            self.player_turn = True
-    
+            self.profiler.enable(timed=[(self, "draw_grid"), (self, "draw_sidebar")],
+                                 counted=[(e, "can_move"), (e, "get_state"), (e, "set_state")])
+
+    def toggle_capture(self):
+        """開始或提前結束 cProfile 擷取"""
+        if self.profiler.capturing:
+            path = self.profiler.stop_capture()
+        else:
+            self.profiler.start_capture()
+            path = None
+        if path:
+            print(f"效能分析已寫入 {path}（python -m pstats {path}）")
+
+    def draw_profiler(self):
+        """在盤面左上角繪製每幀耗時與最近幾幀的直方圖"""
+        rect = self.profiler_rect
+        pygame.draw.rect(self.screen, BLACK, rect)
+        pygame.draw.rect(self.screen, GRAY, rect, 1)
+        sections, counts = self.profiler.summary()
+        x, y = rect.x + 6, rect.y + 4
+        lines = [f"{name}: {mean * 1000:.2f} / {peak * 1000:.2f} ms" for name, (mean, peak) in sections.items()]
+        lines.append("  ".join(f"{name} {count:.0f}" for name, count in sorted(counts.items())) or "-")
+        if self.profiler.capturing:
+            lines.append("cProfile 擷取中…")
+        elif self.profiler.last_dump:
+            lines.append(self.profiler.last_dump)
+        for line in lines:
+            self.screen.blit(self.profiler_text.render(self.small_font, line, WHITE), (x, y))
+            y += 16
+        # 直方圖：每一幀一條，高度為總耗時（上限兩倍預算）
+        top, bottom = y + 4, rect.bottom - 4
+        height = bottom - top
+        scale = height / (FRAME_BUDGET_MS * 2)
+        budget_y = bottom - int(FRAME_BUDGET_MS * scale)
+        for i, frame in enumerate(self.profiler.frames):
+            ms = frame["total"] * 1000
+            bar = min(height, max(1, int(ms * scale)))
+            color = GREEN if ms <= FRAME_BUDGET_MS else RED
+            pygame.draw.line(self.screen, color, (x + i * 2, bottom), (x + i * 2, bottom - bar))
+        pygame.draw.line(self.screen, ORANGE, (x, budget_y), (rect.right - 6, budget_y))
+
     def handle_click(self, pos):
         """處理點擊事件"""
+        e = self.engine
+        act = self.recorder.apply
         mouse_x, mouse_y = pos
         
         # 檢查側邊欄按鈕
-        if mouse_x >= GRID_SIZE * CELL_SIZE:
+        if mouse_x >= BOARD_PIXELS:
             # 勝利或失敗時，僅允許重新開始
-            if self.game_won or self.game_lost:
+            if e.game_won or e.game_lost:
                 if hasattr(self, 'restart_button') and self.restart_button.collidepoint(pos):
-                    self.init_game()
-                    self.action_log.append("遊戲已重新開始")
+                    act(replay.RESTART)
                 return
             if hasattr(self, 'skill1_button') and self.skill1_button.collidepoint(pos):
-                if self.skill1_uses > 0 and not self.skill1_used_this_turn:
-                    self.selected_skill = 'skill1' if self.selected_skill != 'skill1' else None
+                act(replay.SELECT_SKILL1)
             elif hasattr(self, 'skill2_button') and self.skill2_button.collidepoint(pos):
-                if self.skill2_uses > 0 and not self.skill2_used_this_turn:
-                    self.selected_skill = 'skill2' if self.selected_skill != 'skill2' else None
-                    if self.selected_skill == 'skill2':
-                        self.stun_area = None
+                act(replay.SELECT_SKILL2)
             elif hasattr(self, 'undo_button') and self.undo_button.collidepoint(pos):
-                self.undo()
+                act(replay.UNDO)
             elif hasattr(self, 'redo_button') and self.redo_button.collidepoint(pos):
-                self.redo()
+                act(replay.REDO)
             elif hasattr(self, 'end_turn_button') and self.end_turn_button.collidepoint(pos):
-                self.end_turn()
+                act(replay.END_TURN)
             elif hasattr(self, 'restart_button') and self.restart_button.collidepoint(pos):
-                self.init_game()
-                self.action_log.append("遊戲已重新開始")
+                act(replay.RESTART)
             return
         
-        # 遊戲區域點擊
-        if mouse_x < GRID_SIZE * CELL_SIZE:
-            click_x, click_y = self.screen_to_coord(mouse_x, mouse_y)
-            if self.selected_skill == 'skill1':
-                self.action_log.append(f"點擊位置：({click_x},{click_y})")
-                # 檢查是否點擊玩家
-                if self.player_pos == [click_x, click_y]:
-                    self.action_log.append("點擊到玩家")
-                    self.use_skill1_on_player()
-                else:
-                    # 檢查是否點擊敵人
-                    found_enemy = False
-                    for i, enemy in enumerate(self.enemies):
-                        if enemy["pos"] == [click_x, click_y]:
-                            self.action_log.append(f"點擊到敵人 #{i+1}")
-                            self.use_skill1_on_enemy(i)
-                            found_enemy = True
-                            break
-                    if not found_enemy:
-                        self.action_log.append("沒有點擊到任何單位")
-            elif self.selected_skill == 'skill2':
-                # 預覽靜止範圍
-                self.stun_area = (click_x, click_y)
-                # 實際使用技能（不論有無敵人都可施放）
-                self.use_skill2(click_x, click_y)
+        # 遊戲區域點擊（技能施放規則由 Engine.click_cell 處理）
+        if mouse_x < BOARD_PIXELS and e.selected_skill:
+            x, y = self.screen_to_coord(mouse_x, mouse_y)
+            if 1 <= x <= e.size and 1 <= y <= e.size:
+                act(replay.CLICK, cell_of((x, y), e.size))
+
+    def save_recording(self, path=None):
+        """把目前的錄影寫入檔案"""
+        path = path or time.strftime("replay-%Y%m%d-%H%M%S.sbr")
+        self.recorder.save(path)
+        print(f"錄影已寫入 {path}（python replay.py {path}）")
+        self.notify("錄影已存檔")
     
+    def save_session(self, path=None):
+        """把整局遊戲（含撤銷歷史與錄影）寫入存檔"""
+        path = path or savegame.SAVE_PATH
+        start = time.perf_counter()
+        size = savegame.save(self.engine, path, self.recorder)
+        print(f"已存檔至 {path}（{size:,} 位元組，{(time.perf_counter() - start) * 1000:.1f}ms）")
+        self.notify("已存檔")
+
+    def load_session(self, path=None):
+        """讀取存檔，成功時回傳 True；檔案不存在、已損壞或屬於其他關卡時回傳 False"""
+        path = path or savegame.SAVE_PATH
+        try:
+            savegame.load(path, self.engine, self.recorder)
+        except (OSError, ValueError, EOFError, TypeError, struct.error) as error:
+            print(f"無法讀取存檔 {path}：{error}")
+            self.notify("無法讀取存檔")
+            return False
+        self.notify("已讀取存檔")
+        return True
+
     def run(self):
         """遊戲主循環"""
+        e = self.engine
         running = True
+        self.redraw(force=True)
+        pygame.display.flip()
         while running:
-            for event in pygame.event.get():
+            # 閒置時阻塞等待事件，不再每秒重畫 60 次
+            # 背景提示還在搜尋時縮短等待，收到新的建議後才能及時畫出
+            searching = self.show_hint and self.advisor.searching
+            events = [pygame.event.wait(HINT_POLL_MS if searching else IDLE_WAIT_MS)] + pygame.event.get()
+            profiling = self.profiler.enabled
+            start = time.perf_counter()
+            force = False
+            for event in events:
                 if event.type == pygame.QUIT:
                     running = False
                 elif event.type == pygame.MOUSEBUTTONDOWN:
@@ -918,32 +734,82 @@ class Game:
                         self.handle_click(event.pos)
                 elif event.type == pygame.MOUSEMOTION:
                     # 靜止技能預覽：滑鼠移動時即時顯示範圍
-                    if self.selected_skill == 'skill2' and self.player_turn and not self.game_won and not self.game_lost:
+                    if e.selected_skill == 'skill2' and e.player_turn and not e.game_won and not e.game_lost:
                         mx, my = event.pos
-                        if mx < GRID_SIZE * CELL_SIZE:
-                            cx, cy = self.screen_to_coord(mx, my)
-                            self.stun_area = (cx, cy)
-                        else:
-                            self.stun_area = None
+                        center = self.screen_to_coord(mx, my) if mx < BOARD_PIXELS else None
+                        if center is not None and not (1 <= center[0] <= e.size and 1 <= center[1] <= e.size):
+                            center = None
+                        if center != e.stun_area:
+                            self.recorder.apply(replay.PREVIEW,
+                                                None if center is None else cell_of(center, e.size))
                 elif event.type == pygame.KEYDOWN:
-                    if self.player_turn and not self.game_won and not self.game_lost:
-                        if event.key in (pygame.K_w, pygame.K_UP):
-                            self.move_player(0, 1)
-                        elif event.key in (pygame.K_s, pygame.K_DOWN):
-                            self.move_player(0, -1)
-                        elif event.key in (pygame.K_a, pygame.K_LEFT):
-                            self.move_player(-1, 0)
-                        elif event.key in (pygame.K_d, pygame.K_RIGHT):
-                            self.move_player(1, 0)
-            # 繪製
-            self.screen.fill(WHITE)
-            self.draw_grid()
-            self.draw_sidebar()
-            pygame.display.flip()
-            self.clock.tick(FPS)
+                    if event.key == pygame.K_F3:
+                        self.toggle_profiler()
+                        force = True
+                    elif event.key == pygame.K_F4:
+                        self.toggle_capture()
+                    elif event.key == pygame.K_h:
+                        self.show_threat = not self.show_threat
+                        force = True
+                    elif event.key == pygame.K_r:
+                        self.show_reachable = not self.show_reachable
+                        force = True
+                    elif event.key == pygame.K_n:
+                        self.toggle_hint()
+                        force = True
+                    elif event.key == pygame.K_F5:
+                        self.save_recording()
+                    elif event.key == pygame.K_F6:
+                        self.save_session()
+                    elif event.key == pygame.K_F7:
+                        force = self.load_session() or force
+                    elif e.player_turn and not e.game_won and not e.game_lost:
+                        op = MOVE_KEYS.get(event.key)
+                        if op is not None:
+                            self.recorder.apply(op)
+                elif event.type in (pygame.VIDEOEXPOSE, getattr(pygame, "WINDOWEXPOSED", pygame.VIDEOEXPOSE)):
+                    # 視窗被遮蔽後重新顯示，需要完整重畫
+                    force = True
+            if self.show_hint:
+                # 狀態改變就送出新的要求（放棄舊的搜尋），收到的建議改變時重畫盤面
+                self.advisor.update(e)
+                force = self.advisor.poll() or force
+            if profiling:
+                self.profiler.add("events", time.perf_counter() - start)
+            # 只更新內容有變化的區域（盤面與側邊欄會覆蓋整個視窗，不需先清空畫面）
+            dirty = self.redraw(force)
+            if self.profiler.enabled:
+                self.draw_profiler()
+                dirty.append(self.profiler_rect)
+            if dirty:
+                start = time.perf_counter()
+                pygame.display.update(dirty)
+                if profiling:
+                    self.profiler.add("display", time.perf_counter() - start)
+                self.clock.tick(FPS)
+            if profiling or self.profiler.capturing:
+                self.profiler.end_frame()
+        if self.record_path:
+            self.save_recording(self.record_path)
+        if self.save_path:
+            # 只自動保存還沒結束的遊戲；已結束時刪除舊的自動存檔，下次從頭開始
+            if e.game_won or e.game_lost:
+                savegame.remove(self.save_path)
+            else:
+                self.save_session(self.save_path)
+        if self.advisor is not None:
+            self.advisor.close()
         pygame.quit()
         sys.exit()
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()  # 打包成執行檔時，背景提示行程需要
     game = Game()
+    if "--profile" in sys.argv:
+        game.toggle_profiler()
+    if "--record" in sys.argv:
+        game.record_path = sys.argv[sys.argv.index("--record") + 1]
+    # 上次關閉時還沒結束的遊戲：預設接著玩，--new 從頭開始
+    if "--new" not in sys.argv and savegame.resumable(game.save_path):
+        game.load_session(game.save_path)
     game.run()
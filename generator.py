@@ -0,0 +1,301 @@
+"""程序化關卡產生器：大量產生四重奏風格的關卡，只保留可通關且不過於簡單的關卡
+
+用法：
+    python generator.py [-n 數量] [-j 行程數] [--seed 起始種子] [--out 資料夾]
+
+每個種子產生一個關卡（牆壁、單向門、彩色壓版與門、黃色壓版、來回巡邏的敵人），
+在主行程以標準化雜湊去除重複（旋轉、翻轉與壓版顏色互換視為同一關），再交給行程池
+以 solver 求解：到不了終點、展開超過節點上限仍找不到解或少於 MIN_TURNS 回合就能通關的
+關卡會被捨棄。通過的關卡以 <雜湊>.json 寫入輸出資料夾，index.jsonl 依最少回合數、
+其次技能使用次數由難到易排序；資料夾中既有的關卡也會參與去除重複與排序。
+"""
+import hashlib
+import json
+import multiprocessing
+import os
+import random
+import sys
+import time
+from collections import deque
+
+from engine import Engine, DIRECTIONS, Direction, cell_of
+from level import Level, LEVEL_DIR, YELLOW, border_walls
+import solver
+
+OUTPUT_DIR = os.path.join(LEVEL_DIR, "generated")
+INDEX_FILE = "index.jsonl"  # 不以 .json 結尾，load_pack 載入資料夾時不會當成關卡
+PLATE_COLORS = ("blue", "green", "purple")
+LIMITS = {"max_turns": 12, "player_moves": 6, "enemy_steps": 4, "skill1_uses": 2, "skill2_uses": 2}
+ENEMIES = 4
+MIN_TURNS = 4  # 少於這個回合數就能通關的關卡太簡單
+NODE_LIMIT = 4000  # 每個關卡求解時最多展開的節點數
+SKILL_ACTIONS = ("use_skill1_on_player", "use_skill1_on_enemy", "use_skill2")
+
+
+def generate(seed, size=8, limits=LIMITS, enemies=ENEMIES):
+    """以 seed 產生一個關卡（同一個種子永遠產生同一個關卡）
+
+    終點四周只留一兩個缺口並各放一扇彩色門，壓版放在敵人（門全開時）同一回合停下的格子上，
+    讓通關通常需要等敵人踩住壓版。單向門只產生引擎支援的 LEFT 方向；
+    門一定放在兩個相鄰且中間沒有牆壁的格子之間。
+    """
+    rng = random.Random(seed)
+    walls = set()
+    for _ in range(rng.randint(size * 2, size * 4)):
+        if rng.random() < 0.5:
+            walls.add((rng.randint(2, size), rng.randint(1, size), "V"))  # 在 x 格左邊
+        else:
+            walls.add((rng.randint(1, size), rng.randint(2, size), "H"))  # 在 y 格下邊
+    one_way_doors = {(rng.randint(1, size - 1), rng.randint(1, size), "LEFT")
+                     for _ in range(rng.randint(0, 2))}
+    cells = rng.sample([(x, y) for y in range(1, size + 1) for x in range(1, size + 1)], 3 + enemies)
+    player, goal, yellow_plate = cells[:3]
+    taken = set(cells)  # 壓版不和玩家、終點、黃色壓版或敵人的起點重疊
+    data = {
+        "name": f"生成關卡 {seed}",
+        "size": size,
+        "limits": dict(limits),
+        "player": list(player),
+        "goal": list(goal),
+        "enemies": [{"pos": list(cell), "dir": rng.choice(DIRECTIONS).name} for cell in cells[3:]],
+        "walls": None,
+        "one_way_doors": [list(door) for door in sorted(one_way_doors)],
+        "yellow_plate": list(yellow_plate),
+        "plates": {},
+        "doors": {},
+    }
+
+    # 終點的缺口：其餘方向封上牆壁
+    gx, gy = goal
+    sides = [((gx, gy), (gx, gy + 1), (gx, gy + 1, "H")), ((gx, gy - 1), (gx, gy), (gx, gy, "H")),
+             ((gx - 1, gy), (gx, gy), (gx, gy, "V")), ((gx, gy), (gx + 1, gy), (gx + 1, gy, "V"))]
+    sides = [side for side in sides if all(1 <= v <= size for p in side[:2] for v in p)]
+    rng.shuffle(sides)
+    gaps = rng.randint(1, min(2, len(sides)))
+    for _, _, wall in sides[gaps:]:
+        walls.add(wall)
+    for _, _, wall in sides[:gaps]:
+        walls.discard(wall)
+    data["walls"] = [list(w) for w in sorted(walls)]
+    used_edges = {side[:2] for side in sides[:gaps]}
+
+    def free_edge():
+        """隨機挑一條沒有牆壁也還沒有門的內部邊"""
+        while True:
+            x, y = rng.randint(1, size), rng.randint(1, size)
+            if rng.random() < 0.5 and x < size and (x + 1, y, "V") not in walls:
+                edge = ((x, y), (x + 1, y))
+            elif y < size and (x, y + 1, "H") not in walls:
+                edge = ((x, y), (x, y + 1))
+            else:
+                continue
+            if edge not in used_edges:
+                used_edges.add(edge)
+                return edge
+
+    # 敵人在門全開（沒有門）時每回合結束的位置
+    kernel = Engine(Level.from_dict(data)).kernel
+    table = kernel.turn_table(0)
+    states = [kernel.encode(enemy["pos"], Direction[enemy["dir"]]) for enemy in data["enemies"]]
+    stops = []
+    for _ in range(limits["max_turns"]):
+        states = [table[state] for state in states]
+        stops.append([kernel.decode(state)[0] for state in states])
+
+    colors = rng.sample(PLATE_COLORS, rng.randint(gaps, len(PLATE_COLORS)))
+    for i, color in enumerate(colors):
+        for _ in range(20):
+            plates = {tuple(pos) for pos in rng.sample(rng.choice(stops), rng.randint(1, 2))}
+            if not plates & taken:
+                break
+        else:
+            continue
+        taken |= plates
+        data["plates"][color] = [list(cell) for cell in sorted(plates)]
+        edge = sides[i][:2] if i < gaps else free_edge()
+        data["doors"][color] = {"between": [list(edge[0]), list(edge[1])], "plate": color}
+    for i in range(rng.randint(1, 2)):
+        edge = free_edge()
+        data["doors"][f"{YELLOW}{i + 1}"] = {"between": [list(edge[0]), list(edge[1])], "plate": YELLOW}
+    return data
+
+
+def _symmetries(size):
+    """正方形的 8 種對稱：[(座標轉換, 方向向量轉換)]"""
+    transforms = []
+    for swap in (False, True):
+        for flip_x in (False, True):
+            for flip_y in (False, True):
+                def vector(dx, dy, swap=swap, flip_x=flip_x, flip_y=flip_y):
+                    if swap:
+                        dx, dy = dy, dx
+                    return (-dx if flip_x else dx), (-dy if flip_y else dy)
+
+                def point(x, y, swap=swap, flip_x=flip_x, flip_y=flip_y):
+                    if swap:
+                        x, y = y, x
+                    return (size + 1 - x if flip_x else x), (size + 1 - y if flip_y else y)
+
+                transforms.append((point, vector))
+    return transforms
+
+
+def canonical_hash(level):
+    """關卡的標準化雜湊：在 8 種旋轉翻轉中取最小的表示，壓版顏色依內容排序後不計名稱
+
+    牆壁、門以兩側格子表示，單向門以「格子 + 不能通行的方向」表示，
+    因此轉換後即使方向不是 LEFT 也能比較；關卡名稱不影響雜湊。
+    """
+    size = level.size
+    walls = []
+    for x, y, orientation in level.walls - border_walls(size):
+        walls.append(((x - 1, y), (x, y)) if orientation == "V" else ((x, y - 1), (x, y)))
+    blocked = [((x, y), (1, 0)) for x, y, d in level.one_way_doors if d == Direction.LEFT]
+    groups = {color: (cells, []) for color, cells in level.plates.items()}
+    yellow_doors = []
+    for door in level.doors.values():
+        edge = tuple(map(tuple, door["between"]))
+        (yellow_doors if door["plate"] == YELLOW else groups[door["plate"]][1]).append(edge)
+    limits = tuple(sorted(level.limits.items()))
+    best = None
+    for point, vector in _symmetries(size):
+        def edges(items):
+            return tuple(sorted(tuple(sorted(point(*p) for p in edge)) for edge in items))
+
+        form = (
+            size, limits,
+            point(*level.player), point(*level.goal), point(*level.yellow_plate),
+            tuple(sorted((point(x, y), vector(*d.value)) for x, y, d in level.enemies)),
+            edges(walls),
+            tuple(sorted((point(*cell), vector(*delta)) for cell, delta in blocked)),
+            edges(yellow_doors),
+            tuple(sorted((tuple(sorted(point(*p) for p in cells)), edges(group_doors))
+                         for cells, group_doors in groups.values())),
+        )
+        if best is None or form < best:
+            best = form
+    return hashlib.sha1(repr(best).encode("utf-8")).hexdigest()
+
+
+def vet(data, node_limit=NODE_LIMIT, min_turns=MIN_TURNS):
+    """求解並篩選一個關卡，通過時回傳 {"turns", "skills", "nodes"}，否則回傳 (None, 原因)"""
+    level = Level.from_dict(data)
+    engine = Engine(level)
+    all_open = (1 << len(engine.door_names)) - 1
+    start, goal = cell_of(engine.player_pos, level.size), cell_of(engine.goal_pos, level.size)
+    if engine.distances.distance(all_open, start, goal) is None:
+        return None, "unreachable"
+    result = solver.solve(engine, node_limit=node_limit)
+    if not result.solved:
+        return None, "node_limit" if result.stats.get("node_limit") else "unsolvable"
+    if result.turns < min_turns:
+        return None, "trivial"
+    if not solver.replay(result.actions, Engine(level)).game_won:
+        return None, "replay"
+    skills = sum(1 for action in result.actions if action[0] in SKILL_ACTIONS)
+    return {"turns": result.turns, "skills": skills, "nodes": result.nodes_expanded}, None
+
+
+def _vet_worker(job):
+    seed, digest, data = job
+    info, reason = vet(data)
+    return seed, digest, data, info, reason
+
+
+def rank_key(entry):
+    """排序鍵：回合數多的在前，其次技能用得多的在前"""
+    return -entry["turns"], -entry["skills"], entry["hash"]
+
+
+def load_index(directory):
+    """讀取輸出資料夾的排名（每行一個關卡的 JSON），不存在時回傳空清單"""
+    try:
+        with open(os.path.join(directory, INDEX_FILE), encoding="utf-8") as f:
+            return [json.loads(line) for line in f if line.strip()]
+    except FileNotFoundError:
+        return []
+
+
+def run(count, workers=None, seed=0, directory=OUTPUT_DIR, max_attempts=None, progress=None):
+    """產生直到新增 count 個通過篩選的關卡（或嘗試了 max_attempts 個種子），回傳統計
+
+    關卡在主行程產生並去除重複，求解交給 workers 個行程；progress(統計) 會在每個結果後呼叫。
+    """
+    os.makedirs(directory, exist_ok=True)
+    index = load_index(directory)
+    seen = {entry["hash"] for entry in index}
+    max_attempts = count * 50 if max_attempts is None else max_attempts
+    stats = {"attempts": 0, "duplicates": 0, "accepted": 0, "rejected": {}}
+    started = time.perf_counter()
+
+    def jobs():
+        for next_seed in range(seed, seed + max_attempts):
+            data = generate(next_seed)
+            digest = canonical_hash(Level.from_dict(data))
+            stats["attempts"] += 1
+            if digest in seen:
+                stats["duplicates"] += 1
+                continue
+            seen.add(digest)
+            yield next_seed, digest, data
+
+    # 同時送出的工作數有上限，達到數量後不會多產生關卡；依送出順序取結果，輸出與行程數無關
+    workers = workers or os.cpu_count() or 1
+    pending = deque()
+    queue = jobs()
+    with multiprocessing.Pool(workers) as pool:
+        while stats["accepted"] < count:
+            while len(pending) < workers * 4:
+                job = next(queue, None)
+                if job is None:
+                    break
+                pending.append(pool.apply_async(_vet_worker, (job,)))
+            if not pending:
+                break
+            job_seed, digest, data, info, reason = pending.popleft().get()
+            if info is None:
+                stats["rejected"][reason] = stats["rejected"].get(reason, 0) + 1
+            else:
+                stats["accepted"] += 1
+                filename = f"{digest[:12]}.json"
+                data["name"] = f"生成關卡 {digest[:8]}"
+                with open(os.path.join(directory, filename), "w", encoding="utf-8") as f:
+                    json.dump(data, f, ensure_ascii=False, indent=2)
+                index.append(dict(info, hash=digest, seed=job_seed, file=filename))
+            if progress is not None:
+                progress(stats)
+    index.sort(key=rank_key)
+    with open(os.path.join(directory, INDEX_FILE), "w", encoding="utf-8") as f:
+        for entry in index:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+    stats["elapsed"] = time.perf_counter() - started
+    stats["index"] = index
+    return stats
+
+
+def _option(name, default, convert=int):
+    return convert(sys.argv[sys.argv.index(name) + 1]) if name in sys.argv else default
+
+
+def main():
+    count = _option("-n", 10)
+    workers = _option("-j", None)
+    seed = _option("--seed", int(time.time()))
+    directory = _option("--out", OUTPUT_DIR, str)
+
+    def progress(stats):
+        print(f"\r嘗試 {stats['attempts']}，重複 {stats['duplicates']}，通過 {stats['accepted']}/{count}",
+              end="", flush=True)
+
+    stats = run(count, workers, seed, directory, progress=progress)
+    elapsed = stats["elapsed"]
+    print(f"\n耗時 {elapsed:.1f}s，每小時約 {stats['accepted'] / max(elapsed, 1e-9) * 3600:,.0f} 個關卡")
+    print("捨棄原因：", ", ".join(f"{reason} {n}" for reason, n in sorted(stats["rejected"].items())) or "無")
+    for rank, entry in enumerate(stats["index"][:10], 1):
+        print(f"  {rank:2d}. {entry['file']}  {entry['turns']} 回合，技能 {entry['skills']} 次，"
+              f"展開 {entry['nodes']} 節點")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,283 @@
+"""撤銷/重做歷史：以可逆差異記錄每個動作，定期保存關鍵影格並限制記憶體用量"""
+import marshal
+import struct
+import sys
+from collections import deque
+
+# 每隔幾筆差異保存一次完整狀態（關鍵影格）
+KEYFRAME_INTERVAL = 64
+# 歷史記錄（含重做記錄）的記憶體上限（位元組，估計值），超過時丟棄最舊的記錄
+MEMORY_BUDGET = 4 * 1024 * 1024
+# to_bytes() 的開頭：可撤銷與可重做的步數，不解碼記錄也能顯示
+COUNTS = struct.Struct("<II")
+MARSHAL_VERSION = 4
+
+
+def diff(before, after):
+    """兩個狀態（NamedTuple）之間的差異：((欄位索引, 舊值, 新值), ...)"""
+    return tuple((i, old, new) for i, (old, new) in enumerate(zip(before, after))
+                 if old is not new and old != new)
+
+
+def apply_delta(state, delta, forward=True):
+    """套用差異：forward 為 True 時得到新狀態，否則還原成舊狀態"""
+    if not delta:
+        return state
+    values = list(state)
+    k = 2 if forward else 1
+    for item in delta:
+        values[item[0]] = item[k]
+    return state._make(values)
+
+
+def estimate_size(obj):
+    """粗估物件佔用的位元組數：只計算 tuple 本身，字串與數字在相鄰狀態間共用"""
+    if not isinstance(obj, tuple):
+        return 0
+    return sys.getsizeof(obj) + sum(estimate_size(item) for item in obj)
+
+
+class History:
+    """差異式撤銷/重做歷史，undo()/redo() 的成本只與該次差異大小有關
+
+    每筆記錄為 (銜接差異, 動作差異, 關鍵影格, 估計大小)。銜接差異記錄兩次動作之間
+    不經 record() 的狀態改變（例如選取技能），使相鄰記錄能精確串接；第一筆記錄
+    一定帶有關鍵影格，之後每 keyframe_interval 筆再存一次，供 state_at() 快速定位。
+    """
+
+    def __init__(self, keyframe_interval=KEYFRAME_INTERVAL, memory_budget=MEMORY_BUDGET):
+        self.keyframe_interval = keyframe_interval
+        self.memory_budget = memory_budget
+        self.clear()
+
+    def clear(self):
+        self.__dict__.pop("_packed", None)
+        self._entries = deque()
+        self._redo = []  # [(差異, 銜接差異, 估計大小)]
+        self._base = 0  # _entries[0] 的絕對索引
+        self._pending = None  # 動作前記錄、尚未算出差異的狀態
+        self._tail = None  # 最後一筆記錄之後的狀態
+        self._redo_start = None  # 重做堆疊頂端那筆差異的起點狀態
+        self.memory_used = 0
+        self.dropped = 0  # 因記憶體上限而丟棄的記錄數
+
+    def copy(self):
+        """複製歷史（記錄本身不可變，只複製容器）"""
+        packed = self.__dict__.get("_packed")
+        if packed is not None:
+            other = History.__new__(History)
+            other._packed = packed
+            return other
+        other = History(self.keyframe_interval, self.memory_budget)
+        other.__dict__.update(self.__dict__)
+        other._entries = deque(self._entries)
+        other._redo = list(self._redo)
+        return other
+
+    def __len__(self):
+        """可撤銷的步數"""
+        packed = self.__dict__.get("_packed")
+        if packed is not None:
+            return packed[2]
+        return len(self._entries) + (self._pending is not None)
+
+    @property
+    def redo_count(self):
+        """可重做的步數"""
+        packed = self.__dict__.get("_packed")
+        if packed is not None:
+            return packed[3]
+        return len(self._redo)
+
+    def to_bytes(self):
+        """序列化整份歷史：步數 + marshal 編碼的記錄（狀態轉成一般 tuple）"""
+        packed = self.__dict__.get("_packed")
+        if packed is not None:
+            return packed[0]
+
+        def plain(state):
+            return None if state is None else tuple(state)
+
+        body = (
+            self.keyframe_interval, self.memory_budget, self._base, self.memory_used, self.dropped,
+            plain(self._pending), plain(self._tail), plain(self._redo_start),
+            tuple((link, delta, plain(keyframe), size) for link, delta, keyframe, size in self._entries),
+            tuple(self._redo),
+        )
+        return COUNTS.pack(len(self), len(self._redo)) + marshal.dumps(body, MARSHAL_VERSION)
+
+    @classmethod
+    def from_bytes(cls, data, make):
+        """由 to_bytes() 的內容建立歷史；記錄在第一次用到時才解碼，make(tuple) 把 tuple 轉回狀態
+
+        長度不足以放下步數時丟出 ValueError。第一次解碼時沿著差異重建每個狀態並交給 make 檢查，
+        make 可對無效的內容丟出 ValueError；解碼失敗（內容損壞）時歷史改為空的，
+        撤銷與重做只會回傳 None，不會把錯誤帶進遊戲。
+        """
+        if len(data) < COUNTS.size:
+            raise ValueError("歷史記錄不完整")
+        history = cls.__new__(cls)
+        history._packed = (bytes(data), make) + COUNTS.unpack_from(data)
+        return history
+
+    def __getattr__(self, name):
+        # 只有 from_bytes() 建立、尚未解碼的歷史會缺少屬性
+        packed = self.__dict__.pop("_packed", None)
+        if packed is None:
+            raise AttributeError(name)
+        try:
+            self._decode(*packed[:2])
+        except (ValueError, EOFError, TypeError, IndexError, MemoryError, struct.error):
+            History.__init__(self)
+        return getattr(self, name)
+
+    def _decode(self, data, make):
+        def state(values):
+            return None if values is None else make(values)
+
+        (keyframe_interval, memory_budget, base, memory_used, dropped,
+         pending, tail, redo_start, entries, redo) = marshal.loads(memoryview(data)[COUNTS.size:])
+        entries = deque((link, delta, state(keyframe), size) for link, delta, keyframe, size in entries)
+        redo = [(delta, link, size) for delta, link, size in redo]
+        pending, tail, redo_start = state(pending), state(tail), state(redo_start)
+        numbers = [keyframe_interval, memory_budget, base, memory_used, dropped]
+        numbers += [entry[3] for entry in entries] + [size for _, _, size in redo]
+        if not all(type(n) is int for n in numbers) or keyframe_interval <= 0:
+            raise ValueError("歷史記錄不一致")
+        if entries and (entries[0][2] is None or tail is None) or redo and redo_start is None:
+            raise ValueError("歷史記錄不一致")
+        # 沿著差異走過每個狀態交給 make 檢查；撤銷時差異會反向套用，反向也必須回到原本的狀態
+        current = None  # 上一筆記錄之後的狀態
+        for link, delta, keyframe, _ in entries:
+            before = keyframe
+            if current is not None:
+                linked = make(apply_delta(current, link)) if link else current
+                before = linked if before is None else before
+                if linked != before or apply_delta(before, link, forward=False) != current:
+                    raise ValueError("歷史記錄不一致")
+            after = make(apply_delta(before, delta))
+            if apply_delta(after, delta, forward=False) != before:
+                raise ValueError("歷史記錄不一致")
+            current = after
+        if entries and current != tail:
+            raise ValueError("歷史記錄不一致")
+        current = redo_start
+        for delta, link, _ in reversed(redo):
+            after = make(apply_delta(current, delta))
+            if apply_delta(after, delta, forward=False) != current:
+                raise ValueError("歷史記錄不一致")
+            current = make(apply_delta(after, link)) if link else after
+        # 全部解碼成功後才寫入，避免留下解到一半的歷史
+        self.keyframe_interval, self.memory_budget, self._base = keyframe_interval, memory_budget, base
+        self.memory_used, self.dropped = memory_used, dropped
+        self._pending, self._tail, self._redo_start = pending, tail, redo_start
+        self._entries = entries
+        self._redo = redo
+
+    def record(self, state):
+        """動作前呼叫：記下動作前的狀態，並清空重做記錄"""
+        self._flush(state)
+        self._pending = state
+        for _, _, size in self._redo:
+            self.memory_used -= size
+        self._redo.clear()
+
+    def undo(self, current):
+        """回傳上一步的狀態，沒有可撤銷的記錄時回傳 None"""
+        self._flush(current)
+        if not self._entries:
+            return None
+        link, delta, keyframe, size = self._entries.pop()
+        self.memory_used -= size
+        before = keyframe if keyframe is not None else apply_delta(self._tail, delta, forward=False)
+        if current is not self._tail and current != self._tail:
+            delta = diff(before, current)
+        # 重做完這一步後，還要經過銜接差異才能接上下一筆重做記錄的起點
+        redo_link = diff(current, self._redo_start) if self._redo else ()
+        size = estimate_size(delta) + estimate_size(redo_link)
+        self._redo.append((delta, redo_link, size))
+        self.memory_used += size
+        self._redo_start = before
+        self._tail = apply_delta(before, link, forward=False)
+        self._trim()
+        return before
+
+    def redo(self, current):
+        """回傳撤銷前的狀態，沒有可重做的記錄時回傳 None"""
+        self._flush(current)
+        if not self._redo:
+            return None
+        delta, redo_link, size = self._redo.pop()
+        self.memory_used -= size
+        after = apply_delta(self._redo_start, delta)
+        if current is not self._redo_start and current != self._redo_start:
+            delta = diff(current, after)
+        self._append(current, delta, after)
+        self._redo_start = apply_delta(after, redo_link) if self._redo else None
+        return after
+
+    def state_at(self, index):
+        """第 index 筆記錄之前的狀態（index 等於記錄數時為最新狀態），從最近的關鍵影格推算"""
+        entries = self._entries
+        i = index - self._base
+        if not 0 <= i <= len(entries) or not entries:
+            raise IndexError(index)
+        j = min(i, len(entries) - 1)
+        while entries[j][2] is None:
+            j -= 1
+        state = entries[j][2]
+        for k in range(j, i):
+            state = apply_delta(state, entries[k][1])
+            if k + 1 < len(entries):
+                state = apply_delta(state, entries[k + 1][0])
+        return state
+
+    @property
+    def first_index(self):
+        """仍保留的最舊記錄的絕對索引"""
+        return self._base
+
+    def _flush(self, current):
+        """把動作前記錄的狀態與目前狀態比較，存成一筆差異"""
+        if self._pending is not None:
+            before, self._pending = self._pending, None
+            self._append(before, diff(before, current), current)
+
+    def _append(self, before, delta, after):
+        if self._entries and (before is self._tail or before == self._tail):
+            link = ()
+        else:
+            link = diff(self._tail, before) if self._entries else ()
+        index = self._base + len(self._entries)
+        keyframe = None
+        if not self._entries or index % self.keyframe_interval == 0:
+            keyframe = before
+        size = estimate_size(link) + estimate_size(delta)
+        if keyframe is not None:
+            size += estimate_size(keyframe)
+        self._entries.append((link, delta, keyframe, size))
+        self.memory_used += size
+        self._tail = after
+        self._trim()
+
+    def _trim(self):
+        """超過記憶體上限時丟棄最舊的記錄，並讓新的第一筆記錄帶有關鍵影格；
+        撤銷記錄只剩一筆仍超過時，從最遠的重做記錄開始丟棄"""
+        entries = self._entries
+        while self.memory_used > self.memory_budget and len(entries) > 1:
+            _, delta, keyframe, size = entries.popleft()
+            self.memory_used -= size
+            self._base += 1
+            self.dropped += 1
+            link, next_delta, next_keyframe, next_size = entries[0]
+            if next_keyframe is None:
+                next_keyframe = apply_delta(apply_delta(keyframe, delta), link)
+                extra = estimate_size(next_keyframe)
+                entries[0] = ((), next_delta, next_keyframe, next_size + extra)
+                self.memory_used += extra
+        redo = self._redo
+        while self.memory_used > self.memory_budget and redo:
+            self.memory_used -= redo.pop(0)[2]
+            self.dropped += 1
+        if not redo:
+            self._redo_start = None
@@ -0,0 +1,300 @@
+"""關卡資料：JSON 編輯格式，以及預先編譯（含通行表）的二進位快取
+
+用法：
+    python level.py [關卡檔或資料夾 ...]   # 編譯並快取關卡（預設為 levels/）
+
+JSON 欄位（座標皆為 1 起算的 [x, y]）：
+    name、size、limits（max_turns、player_moves、enemy_steps、skill1_uses、skill2_uses）、
+    player、goal、enemies（pos、dir）、walls（[x, y, "H"|"V"]，外框牆壁自動加入）、
+    one_way_doors（[x, y, 方向]）、yellow_plate、plates（顏色 → 壓版清單）、
+    doors（名稱 → between、plate：控制此門的壓版顏色，"yellow" 為玩家踩的黃色壓版）
+編譯後的二進位檔存放在關卡檔旁的 __pycache__/，以來源檔的修改時間與大小判斷是否過期。
+"""
+import json
+import os
+import struct
+import sys
+import time
+
+from engine import Engine, Direction, LazyPassable
+
+LEVEL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "levels")
+DEFAULT_LEVEL = os.path.join(LEVEL_DIR, "quartet.json")
+YELLOW = "yellow"  # 由玩家踩踏切換的壓版顏色
+
+MAGIC = b"SBLV"
+VERSION = 2  # 2：座標改為 16 位元、數量改為 32 位元，支援大棋盤與大量敵人
+HEADER = struct.Struct("<4sBQQ")  # 標記、版本、來源修改時間（ns）、來源大小
+DIRECTION_NAMES = [d.name for d in Direction]
+
+
+class Level:
+    """一個關卡的靜態資料"""
+
+    def __init__(self, name, size, limits, player, goal, enemies, walls, one_way_doors,
+                 yellow_plate, plates, doors, passable=None):
+        self.name = name
+        self.size = size
+        self.max_turns = limits["max_turns"]
+        self.player_moves = limits["player_moves"]
+        self.enemy_steps = limits["enemy_steps"]
+        self.skill1_uses = limits["skill1_uses"]
+        self.skill2_uses = limits["skill2_uses"]
+        self.player = list(player)
+        self.goal = list(goal)
+        self.enemies = [(x, y, direction) for x, y, direction in enemies]  # (x, y, Direction)
+        self.walls = set(walls)  # 含外框
+        self.one_way_doors = set(one_way_doors)  # (x, y, Direction)
+        self.yellow_plate = list(yellow_plate)
+        self.plates = {color: [list(p) for p in cells] for color, cells in plates.items()}
+        self.doors = {name: {"between": [list(p) for p in door["between"]], "plate": door["plate"]}
+                      for name, door in doors.items()}
+        self.passable = passable  # 編譯後的通行表（bytes），未編譯時為 None
+
+    @property
+    def limits(self):
+        return {"max_turns": self.max_turns, "player_moves": self.player_moves,
+                "enemy_steps": self.enemy_steps, "skill1_uses": self.skill1_uses,
+                "skill2_uses": self.skill2_uses}
+
+    @classmethod
+    def from_dict(cls, data):
+        """由 JSON 內容建立關卡，並檢查門所綁定的壓版顏色是否存在"""
+        size = data["size"]
+        walls = {(x, y, orientation) for x, y, orientation in data["walls"]}
+        walls |= border_walls(size)
+        for name, door in data["doors"].items():
+            if door["plate"] != YELLOW and door["plate"] not in data["plates"]:
+                raise ValueError(f"門 {name} 綁定了不存在的壓版顏色：{door['plate']}")
+        return cls(
+            name=data.get("name", ""),
+            size=size,
+            limits=data["limits"],
+            player=data["player"],
+            goal=data["goal"],
+            enemies=[(e["pos"][0], e["pos"][1], Direction[e["dir"]]) for e in data["enemies"]],
+            walls=walls,
+            one_way_doors={(x, y, Direction[d]) for x, y, d in data["one_way_doors"]},
+            yellow_plate=data["yellow_plate"],
+            plates=data["plates"],
+            doors=data["doors"],
+        )
+
+    def to_dict(self):
+        """轉回 JSON 格式（外框牆壁不寫出）"""
+        border = border_walls(self.size)
+        return {
+            "name": self.name,
+            "size": self.size,
+            "limits": self.limits,
+            "player": self.player,
+            "goal": self.goal,
+            "enemies": [{"pos": [x, y], "dir": d.name} for x, y, d in self.enemies],
+            "walls": [list(w) for w in sorted(self.walls - border)],
+            "one_way_doors": [[x, y, d.name] for x, y, d in sorted(self.one_way_doors, key=_door_order)],
+            "yellow_plate": self.yellow_plate,
+            "plates": self.plates,
+            "doors": self.doors,
+        }
+
+    def compile(self):
+        """建立通行表（只需做一次，之後隨二進位快取保存）"""
+        self.passable = None
+        passable = Engine(self).passable
+        # 門太多時通行表在執行時才逐一建立，不放進快取
+        self.passable = None if isinstance(passable, LazyPassable) else bytes(passable)
+        return self
+
+
+def border_walls(size):
+    """最外框的牆壁"""
+    walls = set()
+    for i in range(1, size + 1):
+        walls.add((i, 1, 'H'))  # 下邊界
+        walls.add((i, size + 1, 'H'))  # 上邊界
+        walls.add((1, i, 'V'))  # 左邊界
+        walls.add((size + 1, i, 'V'))  # 右邊界
+    return walls
+
+
+def _door_order(door):
+    x, y, d = door
+    return x, y, DIRECTION_NAMES.index(d.name)
+
+
+def pack(level):
+    """關卡 → 二進位（不含檔頭）"""
+    out = bytearray()
+
+    def u8(*values):
+        out.extend(bytes(values))
+
+    def u16(*values):  # 座標
+        out.extend(struct.pack(f"<{len(values)}H", *values))
+
+    def count(value):
+        out.extend(struct.pack("<I", value))
+
+    def text(value):
+        data = value.encode("utf-8")
+        out.extend(struct.pack("<H", len(data)))
+        out.extend(data)
+
+    text(level.name)
+    u16(level.size)
+    u8(level.player_moves, level.enemy_steps, level.skill1_uses, level.skill2_uses)
+    out.extend(struct.pack("<H", level.max_turns))
+    u16(*level.player, *level.goal, *level.yellow_plate)
+    count(len(level.enemies))
+    for x, y, d in level.enemies:
+        u16(x, y)
+        u8(DIRECTION_NAMES.index(d.name))
+    walls = sorted(level.walls)
+    count(len(walls))
+    for x, y, orientation in walls:
+        u16(x, y)
+        u8(orientation == 'V')
+    count(len(level.one_way_doors))
+    for x, y, d in sorted(level.one_way_doors, key=_door_order):
+        u16(x, y)
+        u8(DIRECTION_NAMES.index(d.name))
+    colors = list(level.plates)
+    u8(len(colors))
+    for color in colors:
+        text(color)
+        count(len(level.plates[color]))
+        for x, y in level.plates[color]:
+            u16(x, y)
+    u8(len(level.doors))
+    for name, door in level.doors.items():
+        text(name)
+        (x1, y1), (x2, y2) = door["between"]
+        u16(x1, y1, x2, y2)
+        text(door["plate"])
+    passable = level.passable or b""
+    out.extend(struct.pack("<I", len(passable)))
+    out.extend(passable)
+    return bytes(out)
+
+
+def unpack(data):
+    """pack() 的反向轉換"""
+    view = memoryview(data)
+    offset = 0
+
+    def u8(count=1):
+        nonlocal offset
+        values = tuple(view[offset:offset + count])
+        offset += count
+        return values
+
+    def u16(count=1):
+        nonlocal offset
+        values = struct.unpack_from(f"<{count}H", view, offset)
+        offset += 2 * count
+        return values
+
+    def number(fmt):
+        nonlocal offset
+        (value,) = struct.unpack_from(fmt, view, offset)
+        offset += struct.calcsize(fmt)
+        return value
+
+    def text():
+        nonlocal offset
+        length = number("<H")
+        value = bytes(view[offset:offset + length]).decode("utf-8")
+        offset += length
+        return value
+
+    name = text()
+    (size,) = u16()
+    player_moves, enemy_steps, skill1_uses, skill2_uses = u8(4)
+    max_turns = number("<H")
+    px, py, gx, gy, yx, yy = u16(6)
+    enemies = []
+    for _ in range(number("<I")):
+        x, y = u16(2)
+        enemies.append((x, y, Direction[DIRECTION_NAMES[u8()[0]]]))
+    walls = set()
+    for _ in range(number("<I")):
+        x, y = u16(2)
+        walls.add((x, y, 'V' if u8()[0] else 'H'))
+    one_way_doors = set()
+    for _ in range(number("<I")):
+        x, y = u16(2)
+        one_way_doors.add((x, y, Direction[DIRECTION_NAMES[u8()[0]]]))
+    plates = {}
+    for _ in range(u8()[0]):
+        color = text()
+        plates[color] = [list(u16(2)) for _ in range(number("<I"))]
+    doors = {}
+    for _ in range(u8()[0]):
+        door_name = text()
+        x1, y1, x2, y2 = u16(4)
+        doors[door_name] = {"between": [[x1, y1], [x2, y2]], "plate": text()}
+    length = number("<I")
+    passable = bytes(view[offset:offset + length]) or None
+    limits = {"max_turns": max_turns, "player_moves": player_moves, "enemy_steps": enemy_steps,
+              "skill1_uses": skill1_uses, "skill2_uses": skill2_uses}
+    return Level(name, size, limits, (px, py), (gx, gy), enemies, walls, one_way_doors,
+                 (yx, yy), plates, doors, passable)
+
+
+def cache_path(path):
+    """關卡檔對應的二進位快取路徑"""
+    directory, filename = os.path.split(os.path.abspath(path))
+    return os.path.join(directory, "__pycache__", os.path.splitext(filename)[0] + ".lvc")
+
+
+def load_level(path=DEFAULT_LEVEL, use_cache=True):
+    """載入關卡：快取有效時直接讀取二進位檔，否則解析 JSON、編譯並寫入快取"""
+    stat = os.stat(path)
+    cached = cache_path(path)
+    if use_cache:
+        try:
+            with open(cached, "rb") as f:
+                data = f.read()
+            magic, version, mtime, size = HEADER.unpack_from(data)
+            if magic == MAGIC and version == VERSION and mtime == stat.st_mtime_ns and size == stat.st_size:
+                return unpack(memoryview(data)[HEADER.size:])
+        except (OSError, struct.error):
+            pass
+    with open(path, encoding="utf-8") as f:
+        level = Level.from_dict(json.load(f)).compile()
+    if use_cache:
+        try:
+            os.makedirs(os.path.dirname(cached), exist_ok=True)
+            with open(cached, "wb") as f:
+                f.write(HEADER.pack(MAGIC, VERSION, stat.st_mtime_ns, stat.st_size) + pack(level))
+        except OSError:
+            pass  # 唯讀目錄等情況下仍可使用，只是每次都重新編譯
+    return level
+
+
+def load_pack(directory=LEVEL_DIR, use_cache=True):
+    """載入資料夾中所有關卡：{檔名（不含副檔名）: Level}"""
+    levels = {}
+    for filename in sorted(os.listdir(directory)):
+        if filename.endswith(".json"):
+            levels[os.path.splitext(filename)[0]] = load_level(os.path.join(directory, filename), use_cache)
+    return levels
+
+
+def main():
+    targets = sys.argv[1:] or [LEVEL_DIR]
+    for target in targets:
+        start = time.perf_counter()
+        if os.path.isdir(target):
+            levels = load_pack(target)
+        else:
+            levels = {os.path.splitext(os.path.basename(target))[0]: load_level(target)}
+        elapsed = time.perf_counter() - start
+        for key, level in levels.items():
+            print(f"{key}：{level.name}（{level.size}x{level.size}，{len(level.enemies)} 個敵人，"
+                  f"{len(level.doors)} 道門）")
+        print(f"載入 {len(levels)} 個關卡，耗時 {elapsed * 1000:.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
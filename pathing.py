@@ -0,0 +1,145 @@
+"""時空路徑搜尋：在 (格子, 回合, 剩餘步數) 上以 A* 尋找避開敵人的多回合路線
+
+不使用技能。「安全」的定義：玩家不走進敵人目前所在的格子，回合結束時也不停在
+敵人這一回合移動後會停下的格子（敵人途中經過的格子不算）。
+"""
+import heapq
+from collections import deque
+
+from engine import DIRECTIONS, cell_of, neighbor_offsets, pos_of
+
+
+def _enemy_states(engine):
+    return tuple(engine.enemies.states), tuple(engine.enemies.stuns)
+
+
+def _door_mask(kernel, enemies, yellow):
+    mask = kernel.plate_mask(enemies)
+    if yellow:
+        mask |= kernel.yellow_bits
+    return mask
+
+
+def find_route(engine, goal=None, max_turns=None):
+    """從目前狀態到 goal（預設為終點）回合數最少、其次步數最少的安全路線
+
+    搜尋節點為 (格子, 剩餘步數, 黃色壓版, 敵人狀態, 靜止回合)，回合數與步數為成本。
+    每個節點只記錄父節點與動作，找到後再回溯出路線。回傳與 solver 相同格式的動作清單
+    （("move_player", dx, dy) 或 ("end_turn",)），找不到時回傳 None。
+    """
+    kernel = engine.kernel
+    size = engine.size
+    offsets = neighbor_offsets(size)
+    moves_per_turn = engine.player_moves
+    goal = cell_of(goal or engine.goal_pos, size)
+    yellow_plate = cell_of(engine.yellow_plate, size)
+    max_turns = engine.max_turns if max_turns is None else max_turns
+    # 所有門都打開時到終點的步數是可採納的估計
+    distances = engine.distances.distances_to((1 << len(engine.door_names)) - 1, goal)
+    start_cell = cell_of(engine.player_pos, size)
+    if start_cell == goal:
+        return []
+    if distances[start_cell] is None:
+        return None
+    enemies, stuns = _enemy_states(engine)
+    start = (start_cell, engine.player_moves_left, engine.yellow_plate_active, enemies, stuns)
+
+    def estimate(cell, moves_left):
+        remaining = distances[cell]
+        if remaining is None:
+            return None
+        extra = max(0, remaining - moves_left)
+        return -(-extra // moves_per_turn), remaining
+
+    # 最晚能在哪一回合抵達（第一回合結束不檢查上限，所以多一回合）
+    last_turn = max_turns + (1 if engine.is_first_turn else 0)
+    parents = {start: None}  # 節點 → (父節點, 動作)
+    best = {start: (0, 0)}
+    heap = [(estimate(start_cell, start[1]), (0, 0), 0, start)]
+    counter = 1
+    while heap:
+        _, cost, _, node = heapq.heappop(heap)
+        if best[node] != cost:
+            continue
+        cell, moves_left, yellow, enemies, stuns = node
+        turns, steps = cost
+        mask = _door_mask(kernel, enemies, yellow)
+        occupied = {state >> 2 for state in enemies}
+        successors = []
+        if moves_left > 0:
+            for d, offset in enumerate(offsets):
+                target = cell + offset
+                if not engine.can_step(mask, cell, d) or target in occupied:
+                    continue
+                if target == goal:
+                    parents[None] = (node, ("move_player",) + DIRECTIONS[d].value)
+                    return _route(parents)
+                new_yellow = yellow != (target == yellow_plate)
+                successors.append(((target, moves_left - 1, new_yellow, enemies, stuns), (turns, steps + 1),
+                                   ("move_player",) + DIRECTIONS[d].value))
+        # 結束回合：第一回合結束不檢查回合上限，之後超過上限就輸了
+        turn = engine.turn + turns
+        if (turns == 0 and engine.is_first_turn) or turn + 1 <= max_turns:
+            table = kernel.turn_table(mask)
+            moved = tuple(state if stun > 0 else table[state] for state, stun in zip(enemies, stuns))
+            if all(state >> 2 != cell for state in moved):
+                successors.append(((cell, moves_per_turn, yellow, moved, (0,) * len(stuns)),
+                                   (turns + 1, steps), ("end_turn",)))
+        for child, child_cost, action in successors:
+            previous = best.get(child)
+            if previous is not None and previous <= child_cost:
+                continue
+            h = estimate(child[0], child[1])
+            if h is None or engine.turn + child_cost[0] + h[0] > last_turn:
+                continue
+            best[child] = child_cost
+            parents[child] = (node, action)
+            heapq.heappush(heap, ((child_cost[0] + h[0], child_cost[1] + h[1]), child_cost, counter, child))
+            counter += 1
+    return None
+
+
+def _route(parents):
+    """從終點沿父節點回溯出動作清單"""
+    actions = []
+    link = parents[None]
+    while link is not None:
+        node, action = link
+        actions.append(action)
+        link = parents[node]
+    actions.reverse()
+    return actions
+
+
+def reachable_this_turn(engine):
+    """本回合剩餘步數內可安全到達的格子：{(x, y): 最少步數}，包含目前位置
+
+    會考慮途中踩到黃色壓版造成的門變化；不是玩家回合或遊戲已結束時回傳空字典。
+    """
+    if not engine.player_turn or engine.game_won or engine.game_lost:
+        return {}
+    kernel = engine.kernel
+    size = engine.size
+    offsets = neighbor_offsets(size)
+    yellow_plate = cell_of(engine.yellow_plate, size)
+    enemies, _ = _enemy_states(engine)
+    occupied = {state >> 2 for state in enemies}
+    masks = {yellow: _door_mask(kernel, enemies, yellow) for yellow in (False, True)}
+    start = (cell_of(engine.player_pos, size), engine.yellow_plate_active)
+    steps = {start: 0}
+    reached = {tuple(engine.player_pos): 0}
+    queue = deque([start])
+    while queue:
+        cell, yellow = node = queue.popleft()
+        if steps[node] >= engine.player_moves_left:
+            continue
+        for d, offset in enumerate(offsets):
+            target = cell + offset
+            if not engine.can_step(masks[yellow], cell, d) or target in occupied:
+                continue
+            child = (target, yellow != (target == yellow_plate))
+            if child not in steps:
+                steps[child] = steps[node] + 1
+                reached.setdefault(tuple(pos_of(target, size)), steps[child])
+                queue.append(child)
+    return reached
@@ -0,0 +1,122 @@
+"""效能分析：每幀各階段的耗時、熱點呼叫次數，以及指定幀數的 cProfile 擷取（不依賴 pygame）"""
+import cProfile
+import time
+from collections import deque
+
+# 保留最近幾幀的耗時（直方圖與平均值）
+HISTORY_FRAMES = 120
+# 預設擷取的幀數
+CAPTURE_FRAMES = 300
+SECTIONS = ("events", "draw_grid", "draw_sidebar", "display")
+
+
+class FrameProfiler:
+    """記錄每幀耗時與呼叫次數
+
+    計時與計數以包裝實例方法的方式加入，關閉時還原成原本的方法，不影響一般遊玩的效能。
+    """
+
+    def __init__(self, history=HISTORY_FRAMES):
+        self.enabled = False
+        self.frames = deque(maxlen=history)  # [{階段: 秒數, "total": 秒數}]
+        self.counts = deque(maxlen=history)  # [{呼叫名稱: 次數}]
+        self._current = {}
+        self._calls = {}
+        self._wrapped = []  # [(物件, 方法名稱)]
+        self._capture = None  # (cProfile.Profile, 剩餘幀數, 輸出路徑)
+        self.last_dump = None
+
+    def enable(self, timed=(), counted=()):
+        """開始記錄；timed 與 counted 為 [(物件, 方法名稱)]，前者計時、後者只計數"""
+        if self.enabled:
+            return
+        self.enabled = True
+        for target, name in timed:
+            self._wrap(target, name, timed=True)
+        for target, name in counted:
+            self._wrap(target, name, timed=False)
+
+    def disable(self):
+        """停止記錄並還原被包裝的方法"""
+        for target, name in self._wrapped:
+            delattr(target, name)  # 移除實例上的包裝，恢復類別上的方法
+        self._wrapped.clear()
+        self.enabled = False
+        self._current = {}
+        self._calls = {}
+
+    def _wrap(self, target, name, timed):
+        original = getattr(target, name)
+
+        if timed:
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return original(*args, **kwargs)
+                finally:
+                    self._current[name] = self._current.get(name, 0.0) + time.perf_counter() - start
+        else:
+            def wrapper(*args, **kwargs):
+                self._calls[name] = self._calls.get(name, 0) + 1
+                return original(*args, **kwargs)
+
+        setattr(target, name, wrapper)
+        self._wrapped.append((target, name))
+
+    def add(self, section, seconds):
+        """累加目前這一幀某個階段的耗時"""
+        self._current[section] = self._current.get(section, 0.0) + seconds
+
+    def end_frame(self):
+        """結束一幀：保存這一幀的紀錄，擷取中時倒數剩餘幀數"""
+        frame = self._current
+        frame["total"] = sum(frame.get(section, 0.0) for section in SECTIONS)
+        self.frames.append(frame)
+        self.counts.append(self._calls)
+        self._current = {}
+        self._calls = {}
+        if self._capture is not None:
+            profile, remaining, path = self._capture
+            if remaining <= 1:
+                self.stop_capture()
+            else:
+                self._capture = (profile, remaining - 1, path)
+
+    def summary(self):
+        """最近幾幀的統計：({階段: (平均秒數, 最大秒數)}, {呼叫名稱: 每幀平均次數})"""
+        frames = self.frames
+        if not frames:
+            return {}, {}
+        sections = {}
+        for section in SECTIONS + ("total",):
+            values = [frame.get(section, 0.0) for frame in frames]
+            sections[section] = (sum(values) / len(values), max(values))
+        totals = {}
+        for counts in self.counts:
+            for name, count in counts.items():
+                totals[name] = totals.get(name, 0) + count
+        return sections, {name: count / len(self.counts) for name, count in totals.items()}
+
+    @property
+    def capturing(self):
+        return self._capture is not None
+
+    def start_capture(self, frames=CAPTURE_FRAMES, path=None):
+        """以 cProfile 擷取接下來 frames 幀，結束後寫入 path（pstats 格式）"""
+        if self._capture is not None:
+            return
+        path = path or time.strftime("profile-%Y%m%d-%H%M%S.prof")
+        profile = cProfile.Profile()
+        profile.enable()
+        self._capture = (profile, frames, path)
+
+    def stop_capture(self):
+        """提前結束擷取並寫檔，回傳輸出路徑"""
+        if self._capture is None:
+            return None
+        profile, _, path = self._capture
+        profile.disable()
+        profile.dump_stats(path)
+        self._capture = None
+        self.last_dump = path
+        return path
@@ -0,0 +1,248 @@
+"""輸入重播：把每個操作記錄成精簡的二進位串流，可在無畫面下全速重播並快速跳到任一回合
+
+用法：
+    python replay.py 錄影.sbr [--turn 回合]
+
+每個操作一個位元組，點擊與預覽另外帶一個 varint 格子索引。檔案中另存每個回合第一個
+操作的位置與結束時狀態的校驗碼，重播時可確認結果一致。從存檔接著錄的錄影另帶開始時的
+存檔快照（savegame 格式），重播時先載入快照再開始。跳轉時從最近的關鍵影格
+（完整狀態與撤銷歷史）開始重播，關鍵影格在重播過程中每 KEYFRAME_INTERVAL 個操作建立一次。
+"""
+import bisect
+import struct
+import sys
+import time
+import zlib
+
+from engine import Engine, DIRECTIONS, pos_of
+import savegame
+
+MAGIC = b"SBRP"
+VERSION = 2  # 2：名稱之後帶開始快照（長度為 0 表示從關卡初始狀態開始）
+KEYFRAME_INTERVAL = 256
+
+# 操作代碼：0-3 為依 DIRECTIONS 順序移動
+END_TURN = 4
+UNDO = 5
+REDO = 6
+RESTART = 7
+SELECT_SKILL1 = 8
+SELECT_SKILL2 = 9
+CLICK = 10  # 之後接格子索引
+PREVIEW = 11  # 之後接 格子索引 + 1，0 表示清除預覽
+WITH_CELL = (CLICK, PREVIEW)
+
+
+def apply(engine, op, cell=None):
+    """對引擎執行一個操作（遊戲與重播共用同一份對應）"""
+    if op < 4:
+        dx, dy = DIRECTIONS[op].value
+        return engine.move_player(dx, dy)
+    if op == END_TURN:
+        return engine.end_turn()
+    if op == UNDO:
+        return engine.undo()
+    if op == REDO:
+        return engine.redo()
+    if op == RESTART:
+        return engine.restart()
+    if op == SELECT_SKILL1:
+        return engine.select_skill('skill1')
+    if op == SELECT_SKILL2:
+        return engine.select_skill('skill2')
+    if op == CLICK:
+        return engine.click_cell(*pos_of(cell, engine.size))
+    if op == PREVIEW:
+        return engine.preview_stun(None if cell is None else tuple(pos_of(cell, engine.size)))
+    raise ValueError(f"未知的操作代碼：{op}")
+
+
+def checksum(state):
+    """狀態的校驗碼（GameState 只含數字、字串與 tuple，repr 是確定的）"""
+    return zlib.crc32(repr(state).encode("utf-8"))
+
+
+def _varint(out, value):
+    while value >= 0x80:
+        out.append(value & 0x7F | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(data, offset):
+    value = shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, offset
+        shift += 7
+
+
+def decode_actions(data):
+    """操作串流 → [(代碼, 格子索引或 None)]"""
+    actions = []
+    offset = 0
+    while offset < len(data):
+        op = data[offset]
+        offset += 1
+        cell = None
+        if op in WITH_CELL:
+            cell, offset = _read_varint(data, offset)
+            if op == PREVIEW:
+                cell = cell - 1 if cell else None
+        actions.append((op, cell))
+    return actions
+
+
+class Recorder:
+    """記錄遊戲中的每個操作；透過 apply() 執行操作即會同時記錄"""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.start()
+
+    def start(self, snapshot=b""):
+        """從引擎目前的狀態開始一段新的錄影
+
+        目前狀態不是關卡初始狀態時，snapshot 應為此刻的 savegame.dumps()，重播時從快照開始。
+        """
+        self.snapshot = snapshot
+        self.data = bytearray()
+        self.count = 0
+        self.turn_index = {self.engine.turn: 0}  # 回合 → 第一次到達該回合時的操作序號
+
+    def apply(self, op, cell=None):
+        self.data.append(op)
+        if op in WITH_CELL:
+            _varint(self.data, cell if op == CLICK else (0 if cell is None else cell + 1))
+        self.count += 1
+        result = apply(self.engine, op, cell)
+        self.turn_index.setdefault(self.engine.turn, self.count)
+        return result
+
+    def to_bytes(self):
+        """完整的錄影檔內容"""
+        name = self.engine.level.name.encode("utf-8")
+        out = bytearray(MAGIC)
+        out += struct.pack("<BH", VERSION, len(name)) + name
+        out += struct.pack("<I", len(self.snapshot)) + self.snapshot
+        out += struct.pack("<I", len(self.data)) + self.data
+        out += struct.pack("<H", len(self.turn_index))
+        for turn, index in sorted(self.turn_index.items()):
+            _varint(out, turn)
+            _varint(out, index)
+        out += struct.pack("<I", checksum(self.engine.get_state()))
+        return bytes(out)
+
+    def save(self, path):
+        with open(path, "wb") as f:
+            f.write(self.to_bytes())
+
+
+class Replay:
+    """讀取錄影並在引擎上重播，支援跳到任一回合"""
+
+    def __init__(self, data, engine=None):
+        data = memoryview(data)
+        if bytes(data[:4]) != MAGIC:
+            raise ValueError("不是錄影檔")
+        version, name_length = struct.unpack_from("<BH", data, 4)
+        if version not in (1, VERSION):
+            raise ValueError(f"不支援的錄影版本：{version}")
+        offset = 7
+        self.level_name = bytes(data[offset:offset + name_length]).decode("utf-8")
+        offset += name_length
+        snapshot = b""
+        if version >= 2:
+            (length,) = struct.unpack_from("<I", data, offset)
+            offset += 4
+            snapshot = bytes(data[offset:offset + length])
+            offset += length
+        (length,) = struct.unpack_from("<I", data, offset)
+        offset += 4
+        self.actions = decode_actions(data[offset:offset + length])
+        offset += length
+        (turns,) = struct.unpack_from("<H", data, offset)
+        offset += 2
+        self.turn_index = {}
+        for _ in range(turns):
+            turn, offset = _read_varint(data, offset)
+            self.turn_index[turn], offset = _read_varint(data, offset)
+        (self.checksum,) = struct.unpack_from("<I", data, offset)
+        self.engine = engine if engine is not None else Engine()
+        if self.engine.level.name != self.level_name:
+            raise ValueError(f"錄影屬於關卡 {self.level_name}，目前關卡為 {self.engine.level.name}")
+        if snapshot:
+            savegame.loads(snapshot, self.engine)
+        else:
+            self.engine.init_game()
+        self.position = 0  # 已執行的操作數
+        self._keyframes = [0]  # 已建立關鍵影格的操作序號（遞增）
+        self._states = {0: (self.engine.get_state(), self.engine.history.copy())}
+
+    @classmethod
+    def load(cls, path, engine=None):
+        with open(path, "rb") as f:
+            return cls(f.read(), engine)
+
+    def __len__(self):
+        return len(self.actions)
+
+    def play(self, until=None):
+        """全速重播到第 until 個操作（預設為結尾），回傳引擎"""
+        until = len(self.actions) if until is None else until
+        engine = self.engine
+        actions = self.actions
+        while self.position < until:
+            op, cell = actions[self.position]
+            apply(engine, op, cell)
+            self.position += 1
+            if self.position % KEYFRAME_INTERVAL == 0 and self.position not in self._states:
+                self._states[self.position] = (engine.get_state(), engine.history.copy())
+                bisect.insort(self._keyframes, self.position)
+        return engine
+
+    def seek(self, index):
+        """跳到第 index 個操作之前的狀態：從最近的關鍵影格開始重播"""
+        if not 0 <= index <= len(self.actions):
+            raise IndexError(index)
+        start = self._keyframes[bisect.bisect_right(self._keyframes, index) - 1]
+        if not start <= self.position <= index:
+            state, history = self._states[start]
+            self.engine.set_state(state)
+            self.engine.history = history.copy()
+            self.position = start
+        return self.play(index)
+
+    def seek_turn(self, turn):
+        """跳到第一次進入第 turn 回合時的狀態"""
+        return self.seek(self.turn_index[turn])
+
+    def verify(self):
+        """重播到結尾，確認結束狀態與錄影時一致"""
+        return checksum(self.seek(len(self.actions)).get_state()) == self.checksum
+
+
+def main():
+    if len(sys.argv) < 2:
+        print(__doc__)
+        return 1
+    replay = Replay.load(sys.argv[1])
+    start = time.perf_counter()
+    ok = replay.verify()
+    elapsed = time.perf_counter() - start
+    print(f"{replay.level_name}：{len(replay)} 個操作，{len(replay.turn_index)} 個回合，"
+          f"重播 {elapsed * 1000:.1f}ms（{len(replay) / max(elapsed, 1e-9):,.0f} 操作/秒）")
+    print("結束狀態：", "一致" if ok else "不一致")
+    if "--turn" in sys.argv:
+        turn = int(sys.argv[sys.argv.index("--turn") + 1])
+        engine = replay.seek_turn(turn)
+        print(f"第 {turn} 回合開始：玩家 {tuple(engine.player_pos)}，"
+              f"敵人 {[tuple(enemy.pos) for enemy in engine.enemies]}")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
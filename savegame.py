@@ -0,0 +1,241 @@
+"""存檔：把整局遊戲（目前狀態、撤銷/重做歷史、行動記錄、關卡名稱與錄影）寫成精簡的二進位檔
+
+用法：
+    python savegame.py [存檔.sbs]    # 顯示存檔內容並確認可以載入（預設為自動存檔）
+
+檔案格式（小端序）：標記、版本、關卡名稱，接著是三個帶長度的區段：目前狀態（marshal
+編碼的 GameState）、撤銷歷史（History.to_bytes()，開頭即為可撤銷/重做步數）與輸入錄影
+（可為空），檔尾是之前所有內容的 CRC32。marshal 不能安全解碼損壞的資料，因此載入時先檢查
+CRC32 與每個區段的長度，之後只解碼目前狀態，歷史在第一次撤銷或重做時才解碼並檢查。
+自動存檔放在每個使用者固定的資料夾（見 default_path()），不受啟動時的工作目錄影響。
+"""
+import marshal
+import os
+import struct
+import sys
+import time
+import zlib
+
+from engine import Engine, GameState
+from history import History, MARSHAL_VERSION
+
+MAGIC = b"SBSV"
+VERSION = 3  # 2：錄影區段另存錄影開始時的存檔快照；3：檔尾加上 CRC32
+SECTION = struct.Struct("<I")
+CHECKSUM = struct.Struct("<I")
+RECORDING = struct.Struct("<I")  # 錄影區段開頭：操作數，之後是 marshal 的回合索引、操作串流與開始快照
+
+
+def default_path():
+    """每個使用者固定的自動存檔位置：Windows 為 %APPDATA%，其他系統為 $XDG_DATA_HOME 或 ~/.local/share"""
+    base = (os.environ.get("APPDATA") or os.environ.get("XDG_DATA_HOME")
+            or os.path.join(os.path.expanduser("~"), ".local", "share"))
+    return os.path.join(base, "SliverAndBlood", "save.sbs")
+
+
+SAVE_PATH = default_path()
+
+
+def _section(out, data):
+    out += SECTION.pack(len(data))
+    out += data
+
+
+def _read_section(data, offset):
+    if offset + SECTION.size > len(data):
+        raise ValueError("存檔已損壞：區段不完整")
+    (length,) = SECTION.unpack_from(data, offset)
+    offset += SECTION.size
+    if offset + length > len(data):
+        raise ValueError("存檔已損壞：區段長度超過檔案大小")
+    return data[offset:offset + length], offset + length
+
+
+def dumps(engine, recorder=None):
+    """整局遊戲 → bytes；recorder 為 replay.Recorder 時一併保存錄影，載入後可以接著錄"""
+    name = engine.level.name.encode("utf-8")
+    out = bytearray(MAGIC)
+    out += struct.pack("<BH", VERSION, len(name)) + name
+    _section(out, marshal.dumps(tuple(engine.get_state()), MARSHAL_VERSION))
+    _section(out, engine.history.to_bytes())
+    recording = b""
+    if recorder is not None:
+        recording = RECORDING.pack(recorder.count) + marshal.dumps(
+            (tuple(recorder.turn_index.items()), bytes(recorder.data), recorder.snapshot), MARSHAL_VERSION)
+    _section(out, recording)
+    out += CHECKSUM.pack(zlib.crc32(out))
+    return bytes(out)
+
+
+def _header(data):
+    """檢查標記與版本，回傳 (版本, 關卡名稱, 目前狀態區段的位置)"""
+    if bytes(data[:4]) != MAGIC or len(data) < 7:
+        raise ValueError("不是存檔")
+    version, name_length = struct.unpack_from("<BH", data, 4)
+    if version not in (1, 2, VERSION):
+        raise ValueError(f"不支援的存檔版本：{version}")
+    offset = 7
+    if offset + name_length > len(data):
+        raise ValueError("存檔已損壞：關卡名稱不完整")
+    level_name = bytes(data[offset:offset + name_length]).decode("utf-8")
+    return version, level_name, offset + name_length
+
+
+def _sections(data):
+    """檢查標記、版本、CRC32 與每個區段的長度，回傳 (關卡名稱, 目前狀態, 撤銷歷史, 錄影)"""
+    version, level_name, offset = _header(data)
+    if version >= 3:
+        end = len(data) - CHECKSUM.size
+        if end < offset or CHECKSUM.unpack_from(data, end)[0] != zlib.crc32(data[:end]):
+            raise ValueError("存檔已損壞：檢查碼不符")
+        data = data[:end]
+    state, offset = _read_section(data, offset)
+    history, offset = _read_section(data, offset)
+    recording, offset = _read_section(data, offset)
+    if offset != len(data):
+        raise ValueError("存檔已損壞：檔案結尾有多餘的資料")
+    if recording and len(recording) < RECORDING.size:
+        raise ValueError("存檔已損壞：錄影區段不完整")
+    return level_name, state, history, recording
+
+
+# GameState 中只能是整數或布林值的欄位
+INT_FIELDS = ("moves_left", "turn", "skill1_uses", "skill2_uses", "door_mask")
+BOOL_FIELDS = ("is_first_turn", "player_turn", "skill1_used_this_turn", "skill2_used_this_turn",
+               "yellow_plate_active", "game_won", "game_lost")
+
+
+def _unmarshal(data):
+    """marshal.loads()：內容損壞時一律丟出 ValueError（長度欄位損壞時可能要求配置極大的記憶體）"""
+    try:
+        return marshal.loads(data)
+    except (EOFError, TypeError, MemoryError) as error:
+        raise ValueError(f"存檔已損壞：{error}") from error
+
+
+def _checked_state(engine, values, seen=None):
+    """marshal 解出的 tuple → GameState，欄位型別不對或座標、敵人與門遮罩超出 engine 的關卡範圍時丟出 ValueError
+
+    seen 為 {id: 敵人配置}，記錄已檢查過的敵人配置物件：歷史中相鄰的狀態大多共用同一個物件。
+    marshal 的內容損壞時可能產生自我參照的 tuple，因此這裡不對內容做雜湊。
+    """
+    state = GameState._make(values)
+    size = engine.size
+    if not (all(type(getattr(state, name)) is int for name in INT_FIELDS)
+            and all(type(getattr(state, name)) is bool for name in BOOL_FIELDS)
+            and _on_board(state.player, size) and _on_board(state.turn_start_player, size)
+            and (state.stun_area is None or _on_board(state.stun_area, size))
+            and state.selected_skill in (None, "skill1", "skill2")
+            and type(state.action_log) is tuple
+            and all(type(line) is str and "\0" not in line for line in state.action_log)
+            and 0 <= state.door_mask < 1 << len(engine.doors)):
+        raise ValueError("存檔已損壞：狀態超出關卡範圍")
+    for enemies in (state.enemies, state.turn_start_enemies):
+        if enemies is None or seen is not None and id(enemies) in seen:
+            continue
+        if not (type(enemies) is tuple and len(enemies) == len(engine.enemies) and all(
+                type(enemy) is tuple and len(enemy) == 4 and _on_board(enemy[:2], size)
+                and type(enemy[2]) is int and 0 <= enemy[2] < 4 and type(enemy[3]) is int and 0 <= enemy[3] < 256
+                for enemy in enemies)):
+            raise ValueError("存檔已損壞：敵人超出關卡範圍")
+        if seen is not None:
+            seen[id(enemies)] = enemies
+    return state
+
+
+def _on_board(pos, size):
+    return type(pos) is tuple and len(pos) == 2 and all(type(v) is int and 1 <= v <= size for v in pos)
+
+
+def read_state(data):
+    """只解碼存檔的關卡名稱與目前狀態：(關卡名稱, GameState)；其餘區段只檢查長度"""
+    level_name, state, _, _ = _sections(memoryview(data))
+    return level_name, GameState._make(_unmarshal(state))
+
+
+def loads(data, engine=None, recorder=None):
+    """把 dumps() 的內容載入 engine（預設為新的 Engine），回傳 engine
+
+    存檔屬於其他關卡或已損壞時丟出 ValueError（區段數量不對時也可能是 TypeError），
+    此時 engine 與 recorder 都不會被修改。recorder 不為 None 時還原存檔中的錄影；存檔沒有錄影時，
+    新的錄影以載入後的局面（不含錄影的存檔）為開始快照，重播時先載入快照。
+    """
+    level_name, state, history, recording = _sections(memoryview(data))
+    engine = engine if engine is not None else Engine()
+    if engine.level.name != level_name:
+        raise ValueError(f"存檔屬於關卡 {level_name}，目前關卡為 {engine.level.name}")
+    state = _checked_state(engine, _unmarshal(state))
+    seen = {}
+    history = History.from_bytes(history, lambda values: _checked_state(engine, values, seen))
+    if recorder is not None and recording:
+        turn_index, stream, *snapshot = _unmarshal(recording[RECORDING.size:])
+        snapshot = snapshot[0] if snapshot else b""  # 第 1 版存檔沒有快照
+        if not (type(stream) is bytes and type(snapshot) is bytes and type(turn_index) is tuple
+                and all(type(item) is tuple and len(item) == 2 and all(type(v) is int for v in item)
+                        for item in turn_index)):
+            raise ValueError("存檔已損壞：錄影內容無效")
+        turn_index = dict(turn_index)
+    engine.set_state(state)
+    engine.history = history
+    if recorder is not None:
+        if recording:
+            recorder.start(snapshot)
+            (recorder.count,) = RECORDING.unpack_from(recording)
+            recorder.turn_index = turn_index
+            recorder.data = bytearray(stream)
+        else:
+            recorder.start(dumps(engine))
+    return engine
+
+
+def save(engine, path=SAVE_PATH, recorder=None):
+    """寫入存檔：先寫到暫存檔再取代，寫到一半中斷也不會損壞舊存檔"""
+    data = dumps(engine, recorder)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    temp = path + ".tmp"
+    with open(temp, "wb") as f:
+        f.write(data)
+    os.replace(temp, path)
+    return len(data)
+
+
+def load(path=SAVE_PATH, engine=None, recorder=None):
+    with open(path, "rb") as f:
+        return loads(f.read(), engine, recorder)
+
+
+def resumable(path=SAVE_PATH):
+    """存檔是否存在、可讀取且遊戲尚未結束（已通關或失敗的存檔不再接著玩）"""
+    try:
+        with open(path, "rb") as f:
+            _, state = read_state(f.read())
+    except (OSError, ValueError, EOFError, TypeError, struct.error):
+        return False
+    return not (state.game_won or state.game_lost)
+
+
+def remove(path=SAVE_PATH):
+    """刪除存檔（不存在時忽略）"""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def main():
+    path = sys.argv[1] if len(sys.argv) > 1 else SAVE_PATH
+    if not os.path.exists(path):
+        print(__doc__)
+        print(f"找不到存檔：{path}")
+        return 1
+    start = time.perf_counter()
+    engine = load(path)
+    elapsed = time.perf_counter() - start
+    print(f"{engine.level.name}：第 {engine.turn} 回合，玩家 {tuple(engine.player_pos)}，"
+          f"可撤銷 {len(engine.history)} 步、可重做 {engine.history.redo_count} 步")
+    print(f"檔案 {os.path.getsize(path):,} 位元組，載入 {elapsed * 1000:.2f}ms（歷史尚未解碼）")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,1135 @@
+"""四重奏關卡求解器：在完整遊戲狀態空間中搜尋回合數最少的通關步驟
+
+用法：
+    python solver.py          # 單一行程 A* 搜尋
+    python solver.py -j 4     # 以 4 個行程平行搜尋
+
+回傳的動作序列可直接交給 Engine 重播，每個動作是 (方法名稱, *參數)，例如
+("move_player", 1, 0)、("use_skill2", 3, 6)、("end_turn",)。
+"""
+import heapq
+import multiprocessing
+import os
+import queue
+import sys
+import time
+from dataclasses import dataclass, field
+
+from engine import Engine, DIRECTIONS, cell_of, pos_of
+
+
+@dataclass
+class SolveResult:
+    actions: list = None  # 找不到解時為 None
+    turns: int = 0  # 通關時的回合數
+    nodes_expanded: int = 0  # 展開的回合層節點數
+    table_size: int = 0  # 置換表中的項目數
+    elapsed: float = 0.0
+    stats: dict = field(default_factory=dict)
+
+    @property
+    def solved(self):
+        return self.actions is not None
+
+    @property
+    def nodes_per_second(self):
+        return self.nodes_expanded / self.elapsed if self.elapsed > 0 else 0.0
+
+
+class Board:
+    """由 Engine 編譯出的靜態關卡資料，並快取搜尋中反覆用到的計算結果
+
+    敵人配置以整數表示：第 i 個敵人佔 enemy_bits 個位元，內容為 (格子 * 4 + 方向) * 2 + 靜止，
+    回溯目標用同樣的格式（靜止位元為 0）。節點的雜湊與比較只需處理小整數，比巢狀 tuple 快得多。
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.door_names = engine.door_names
+        self.kernel = engine.kernel
+        self.yellow_bits = engine.kernel.yellow_bits
+        self.plate_groups = engine.kernel.plate_groups
+        self.size = engine.size
+        self.moves = engine.player_moves
+        self.yellow_plate = cell_of(engine.yellow_plate, self.size)
+        self.goal = cell_of(engine.goal_pos, self.size)
+        self.cells = self.size * self.size
+        self.enemy_count = len(engine.enemies.states)
+        self.enemy_bits = (self.cells * 8 - 1).bit_length()
+        field = (1 << self.enemy_bits) - 1
+        # 每個敵人的格子與方向位元（不含靜止位元），用於回溯單一敵人
+        self.position_masks = [field - 1 << i * self.enemy_bits for i in range(self.enemy_count)]
+        self.stun_bits = sum(1 << i * self.enemy_bits for i in range(self.enemy_count))
+        self.shifts = [i * self.enemy_bits for i in range(self.enemy_count)]
+        self._neighbors = {}
+        self._unpacked = {}
+        self._plate_masks = {}
+        self._moved = {}
+        self._code_moves = {}
+        self._turn_ends = {}
+        self._stuns = {}
+        self._stun_targets = {}
+        self._endings = {}
+        self._rewind_endings = {}
+        self._closures = {}
+
+    def pack(self, enemies):
+        """((格子, 方向, 靜止), ...) → 整數"""
+        packed = 0
+        for i, (cell, d, stunned) in enumerate(enemies):
+            packed |= (cell * 8 + d * 2 + stunned) << i * self.enemy_bits
+        return packed
+
+    def unpack(self, enemies):
+        """整數 → ((格子, 方向, 靜止), ...)"""
+        result = self._unpacked.get(enemies)
+        if result is None:
+            bits = self.enemy_bits
+            field = (1 << bits) - 1
+            result = self._unpacked[enemies] = tuple(
+                (code >> 3, code >> 1 & 3, code & 1)
+                for code in (enemies >> i * bits & field for i in range(self.enemy_count)))
+        return result
+
+    def plate_mask(self, enemies):
+        """由敵人位置決定的門（不含黃色門）"""
+        mask = self._plate_masks.get(enemies)
+        if mask is None:
+            field = (1 << self.enemy_bits) - 1
+            cells = [(enemies >> shift & field) >> 3 for shift in self.shifts]
+            mask = 0
+            for bit, plates, need in self.plate_groups:
+                if sum(1 for cell in cells if cell in plates) == need:
+                    mask |= bit
+            self._plate_masks[enemies] = mask
+        return mask
+
+    def door_mask(self, yellow, enemies):
+        mask = self.plate_mask(enemies)
+        return mask | self.yellow_bits if yellow else mask
+
+    def neighbors(self, mask):
+        """回傳 table[cell][dir] = 目標格子或 -1（不可通行）"""
+        table = self._neighbors.get(mask)
+        if table is None:
+            engine = self.engine
+            table = []
+            for cell in range(self.cells):
+                pos = pos_of(cell, self.size)
+                row = []
+                for d, direction in enumerate(DIRECTIONS):
+                    dx, dy = direction.value
+                    row.append(cell_of((pos[0] + dx, pos[1] + dy), self.size) if engine.can_step(mask, cell, d) else -1)
+                table.append(tuple(row))
+            table = tuple(table)
+            self._neighbors[mask] = table
+        return table
+
+    def enemy_move(self, mask, cell, d):
+        """敵人在門狀態 mask 下走完一回合後的 (格子, 方向)"""
+        return divmod(self.kernel.turn_table(mask)[cell * 4 + d], 4)
+
+    def move_enemies(self, mask, enemies):
+        """所有敵人走完一回合（被靜止的敵人原地不動並減少靜止回合）"""
+        key = (mask, enemies)
+        moved = self._moved.get(key)
+        if moved is None:
+            # 門狀態 mask 下單一敵人編碼 → 移動後的編碼
+            codes = self._code_moves.get(mask)
+            if codes is None:
+                codes = self._code_moves[mask] = {}
+            field = (1 << self.enemy_bits) - 1
+            moved = 0
+            for shift in self.shifts:
+                code = enemies >> shift & field
+                new = codes.get(code)
+                if new is None:
+                    new = codes[code] = code - 1 if code & 1 else self.kernel.turn_table(mask)[code >> 1] * 2
+                moved |= new << shift
+            self._moved[key] = moved
+        return moved
+
+    def endings(self, enemies):
+        """回合結束前是否施放靜止的所有結果：[(用掉的靜止次數, 回溯目標, 移動後的敵人)]，不施放的排在最前面
+
+        移動後的敵人同 turn_end，以黃色壓版是否開啟為索引。
+        """
+        result = self._endings.get(enemies)
+        if result is None:
+            result = self._endings[enemies] = [(0,) + self.turn_end(enemies)] + [
+                (1,) + self.turn_end(stunned) for stunned, _ in self.stun_options(enemies)]
+        return result
+
+    def rewind_endings(self, enemies, se, part):
+        """回溯 part 對應的敵人後，回合結束時的所有結果（格式同 endings），靜止可在回溯前或後施放"""
+        key = (enemies, se, part)
+        result = self._rewind_endings.get(key)
+        if result is None:
+            rewound = enemies & ~part | se & part
+            finals = {rewound: 0}
+            for stunned, _ in self.stun_options(rewound):
+                finals.setdefault(stunned, 1)
+            for stunned, _ in self.stun_options(enemies):
+                finals.setdefault(stunned & ~part | se & part, 1)
+            result = self._rewind_endings[key] = [(used,) + self.turn_end(final) for final, used in finals.items()]
+        return result
+
+    def turn_end(self, enemies):
+        """回合結束時的 (回溯目標, (黃色壓版關閉時移動後的敵人, 開啟時移動後的敵人))"""
+        entry = self._turn_ends.get(enemies)
+        if entry is None:
+            base = self.plate_mask(enemies)
+            entry = self._turn_ends[enemies] = (
+                enemies & ~self.stun_bits,
+                (self.move_enemies(base, enemies), self.move_enemies(base | self.yellow_bits, enemies)))
+        return entry
+
+    def stun_options(self, enemies):
+        """列出靜止技能的所有有效結果：[(施放後的敵人, 施放中心)]"""
+        options = self._stuns.get(enemies)
+        if options is None:
+            options = [(enemies | bits, center) for bits, center in self.stun_targets(enemies & ~self.stun_bits)
+                       if enemies | bits != enemies]
+            self._stuns[enemies] = options
+        return options
+
+    def stun_targets(self, positions):
+        """每種可被同一次靜止涵蓋的敵人組合：[(靜止位元, 施放中心)]，中心取掃描順序中的第一格"""
+        targets = self._stun_targets.get(positions)
+        if targets is None:
+            size = self.size
+            covered = {}
+            for i, (cell, _, _) in enumerate(self.unpack(positions)):
+                ex, ey = pos_of(cell, size)
+                for cy in range(max(ey - 1, 1), min(ey + 1, size) + 1):
+                    for cx in range(max(ex - 1, 1), min(ex + 1, size) + 1):
+                        covered[(cy, cx)] = covered.get((cy, cx), 0) | 1 << i * self.enemy_bits
+            first = {}
+            for (cy, cx), bits in sorted(covered.items()):
+                if bits not in first:
+                    first[bits] = (cx, cy)
+            targets = self._stun_targets[positions] = list(first.items())
+        return targets
+
+
+# 完整搜尋狀態欄位：
+# (player, moves, yellow, s1_uses, s1_ready, s2_uses, s2_ready, enemies, start_player, start_enemies, turn)
+# enemies 與 start_enemies 為 Board.pack 的整數；start_enemies 為 None 表示第一回合無法回溯敵人。
+# 回溯技能本回合已無法使用時，start_player/start_enemies 會被正規化成 -1/None 以合併等價狀態。
+
+def initial_state(engine, board):
+    enemies = board.pack((state >> 2, state & 3, stunned)
+                         for state, stunned in zip(engine.enemies.states, engine.enemies.stuns))
+    start_enemies = None
+    if engine.turn_start_enemies is not None:
+        start_enemies = board.pack((state >> 2, state & 3, 0) for state in engine.turn_start_enemies.states)
+    return _normalize((
+        cell_of(engine.player_pos, board.size),
+        engine.player_moves_left,
+        engine.yellow_plate_active,
+        engine.skill1_uses,
+        not engine.skill1_used_this_turn,
+        engine.skill2_uses,
+        not engine.skill2_used_this_turn,
+        enemies,
+        cell_of(engine.turn_start_player_pos, board.size),
+        start_enemies,
+        engine.turn,
+    ))
+
+
+def _normalize(state):
+    player, moves, yellow, s1, s1_ready, s2, s2_ready, enemies, sp, se, turn = state
+    s1_ready = s1_ready and s1 > 0
+    s2_ready = s2_ready and s2 > 0
+    if not s1_ready:
+        sp, se = -1, None
+    return (player, moves, yellow, s1, s1_ready, s2, s2_ready, enemies, sp, se, turn)
+
+
+def successors(state, board, max_turns):
+    """產生 (動作, 下一狀態, 是否通關)"""
+    player, moves, yellow, s1, s1_ready, s2, s2_ready, enemies, sp, se, turn = state
+    mask = board.door_mask(yellow, enemies)
+
+    # 玩家移動
+    if moves > 0:
+        row = board.neighbors(mask)[player]
+        for d, nxt in enumerate(row):
+            if nxt < 0:
+                continue
+            dx, dy = DIRECTIONS[d].value
+            new_yellow = (not yellow) if nxt == board.yellow_plate else yellow
+            yield (("move_player", dx, dy),
+                   (nxt, moves - 1, new_yellow, s1, s1_ready, s2, s2_ready, enemies, sp, se, turn),
+                   nxt == board.goal)
+
+    # 技能 1：回溯
+    if s1_ready:
+        yield (("use_skill1_on_player",),
+               _normalize((sp, moves, yellow, s1 - 1, False, s2, s2_ready, enemies, sp, se, turn)),
+               False)
+        if se is not None:
+            for i, part in enumerate(board.position_masks):
+                if not (enemies ^ se) & part:
+                    continue
+                yield (("use_skill1_on_enemy", i),
+                       _normalize((player, moves, yellow, s1 - 1, False, s2, s2_ready, enemies & ~part | se & part,
+                                   sp, se, turn)),
+                       False)
+
+    # 技能 2：靜止
+    if s2_ready:
+        for new_enemies, (cx, cy) in board.stun_options(enemies):
+            yield (("use_skill2", cx, cy),
+                   _normalize((player, moves, yellow, s1, s1_ready, s2 - 1, False, new_enemies, sp, se, turn)),
+                   False)
+
+    # 結束回合：敵人在回合開始時的門狀態下移動
+    if turn < max_turns:
+        yield (("end_turn",),
+               _normalize((player, board.moves, yellow, s1, True, s2, True,
+                           board.move_enemies(mask, enemies), player, enemies & ~board.stun_bits, turn + 1)),
+               False)
+
+
+# 回合層節點 key = (enemies, yellow, s1_uses, s2_uses, start_enemies, turn)，
+# 代表回合開始時除了玩家位置以外的所有狀態；玩家可能所在的格子以位元遮罩另外記錄。
+
+def explicit_state(board, key, cell):
+    """回合層節點 (key, 玩家格子) → 回合開始時的完整搜尋狀態"""
+    enemies, yellow, s1, s2, se, turn = key
+    return _normalize((cell, board.moves, yellow, s1, True, s2, True, enemies, cell, se, turn))
+
+
+def turn_key(state):
+    """回合開始時的完整搜尋狀態 → (回合層節點, 玩家格子)"""
+    player, moves, yellow, s1, s1_ready, s2, s2_ready, enemies, sp, se, turn = state
+    return (enemies, yellow, s1, s2, se if s1 > 0 else None, turn), player
+
+
+class Reach:
+    """玩家移動閉包：{(格子, 黃色壓版): (剩餘步數, 回合起點格子)}，每項只保留剩餘步數最多者"""
+    __slots__ = ("best", "groups", "most_moves", "won", "expanded")
+
+    def __init__(self, board, start, masks):
+        tables = (board.neighbors(masks[0]), board.neighbors(masks[1]))
+        yellow_plate = board.yellow_plate
+        goal = board.goal
+        best = dict(start)
+        buckets = [[] for _ in range(board.moves + 1)]
+        for key, (moves, _) in start.items():
+            buckets[moves].append(key)
+        self.won = None  # 到達目標時為起點格子
+        self.expanded = 0
+        for moves in range(board.moves, 0, -1):
+            for key in buckets[moves]:
+                entry = best[key]
+                if entry[0] != moves:
+                    continue
+                self.expanded += 1
+                cell, yellow = key
+                for nxt in tables[yellow][cell]:
+                    if nxt < 0:
+                        continue
+                    if nxt == goal:
+                        self.won = entry[1]
+                        return
+                    new_key = (nxt, (not yellow) if nxt == yellow_plate else yellow)
+                    old = best.get(new_key)
+                    if old is None or old[0] < moves - 1:
+                        best[new_key] = (moves - 1, entry[1])
+                        buckets[moves - 1].append(new_key)
+        self.best = best
+        groups = {}
+        most = {}
+        for (cell, yellow), (moves, _) in best.items():
+            groups[yellow] = groups.get(yellow, 0) | 1 << cell
+            most[yellow] = max(most.get(yellow, 0), moves)
+        self.groups = tuple(groups.items())
+        self.most_moves = most
+
+
+def _reach(board, cache_key, start_fn, masks):
+    reach = board._closures.get(cache_key)
+    if reach is None:
+        reach = board._closures[cache_key] = Reach(board, start_fn(), masks)
+    return reach
+
+
+def expand_turn(board, key, cells, max_turns, want=None, shared=None):
+    """展開一個回合層節點（cells 為玩家格子遮罩）
+
+    回傳 (結果, 通關起點格子)；結果為 {下一回合節點: 玩家格子遮罩}。
+    回合內技能的所有時機組合都會列舉：回溯玩家、回溯敵人（前後皆可移動）、靜止（回溯前或後）。
+    want=(下一回合節點, 格子) 時改為回傳能走到該處的起點格子，用於還原動作。
+    與回溯目標無關的部分（不回溯敵人）只從 shared 中的格子展開，預設為 cells：
+    只差在回溯目標的節點已從其餘格子展開過時，這部分的子節點都已經產生過。
+    """
+    enemies, yellow, s1, s2, se, turn = key
+    yellow_bits = board.yellow_bits
+    results = {}
+    found = []
+
+    def masks_of(current):
+        base = board.plate_mask(current)
+        return base, base | yellow_bits
+
+    def finish(reach, endings, s1_left):
+        """reach 中每個位置 × 回合結束時的每種敵人結果（board.endings 的格式）→ 子節點"""
+        if turn >= max_turns:
+            return
+        groups = reach.groups
+        next_turn = turn + 1
+        get = results.get
+        for used, start_enemies, moved in endings:
+            if used > s2:
+                break
+            if s1_left == 0:
+                start_enemies = None
+            for y, mask in groups:
+                child = (moved[y], y, s1_left, s2 - used, start_enemies, next_turn)
+                results[child] = get(child, 0) | mask
+                if want is not None and child == want[0] and mask >> want[1] & 1:
+                    found.append(reach.best[(want[1], y)][1])
+
+    def free_reach(start):
+        return _reach(board, ("free", masks, yellow, start),
+                      lambda: {(c, yellow): (board.moves, c) for c in range(board.cells) if start >> c & 1},
+                      masks)
+
+    masks = masks_of(enemies)
+    moved_freely = free_reach(cells)
+    if moved_freely.won is not None:
+        return None, moved_freely.won
+    if shared is None:
+        shared = cells
+    if shared:
+        finish(moved_freely if shared == cells else free_reach(shared), board.endings(enemies), s1)
+
+    if s1 > 0 and shared:
+        # 回溯玩家：每個起點分開計算，回溯後回到該起點並保留剩餘步數
+        def rewound_start():
+            start = {}
+            for c in range(board.cells):
+                if shared >> c & 1:
+                    for y, moves in free_reach(1 << c).most_moves.items():
+                        start[(c, y)] = (moves, c)
+            return start
+
+        rewound = _reach(board, ("player", masks, yellow, shared), rewound_start, masks)
+        if rewound.won is not None:
+            return None, rewound.won
+        finish(rewound, board.endings(enemies), s1 - 1)
+
+    # 回溯敵人：回溯前後玩家都可以移動，靜止可在回溯前或後施放
+    if s1 > 0 and se is not None:
+        for part in board.position_masks:
+            if not (enemies ^ se) & part:
+                continue
+            after_masks = masks_of(enemies & ~part | se & part)
+            after = _reach(board, ("enemy", masks, yellow, cells, after_masks),
+                           lambda: moved_freely.best, after_masks)
+            if after.won is not None:
+                return None, after.won
+            finish(after, board.rewind_endings(enemies, se, part), s1 - 1)
+
+    if want is not None:
+        return None, found[0] if found else None
+    return results, None
+
+
+def explicit_turn(board, state, max_turns, target=None, keep=None):
+    """在單一回合內做完整狀態的廣度優先搜尋，找出到達 target（或通關）的最短動作序列
+
+    keep 為 (技能 1, 技能 2) 至少要保留的次數，預設為 target 的剩餘次數（技能次數只會減少）。
+    """
+    if keep is None and target is not None:
+        keep = (target[3], target[5])
+    if keep is not None:
+        # 不能再用的技能視為本回合已用過，successors 就不會產生它們（回合結束後的狀態不受影響）
+        player, moves, yellow, s1, s1_ready, s2, s2_ready, enemies, sp, se, turn = state
+        state = _normalize((player, moves, yellow, s1, s1_ready and s1 > keep[0], s2, s2_ready and s2 > keep[1],
+                            enemies, sp, se, turn))
+    parents = {state: None}
+    queue = [state]
+    expanded = 0
+    while queue:
+        next_queue = []
+        for current in queue:
+            expanded += 1
+            for action, child, won in successors(current, board, max_turns):
+                hit = won if target is None else (action[0] == "end_turn" and child == target)
+                if hit:
+                    actions = [action]
+                    while parents[current] is not None:
+                        current, action = parents[current]
+                        actions.append(action)
+                    actions.reverse()
+                    return actions, expanded
+                if action[0] == "end_turn" or child in parents:
+                    continue
+                parents[child] = (current, action)
+                next_queue.append(child)
+        queue = next_queue
+    return None, expanded
+
+
+class LowerBound:
+    """可採納的下界：從回合層節點出發，至少還要幾個回合才可能通關
+
+    放寬條件：每個敵人獨立計算（任意門狀態下的移動、可單獨使用全部靜止次數，回溯次數需加總），
+    只要某階段有足夠多的敵人可能站在同色壓版上，就視為該門可能開啟；玩家在每個階段
+    可穿過所有可能開啟的門且不受步數限制。因此回傳值不會高估真實所需回合數。
+
+    大部分節點的下界都超過 A* 目前的門檻，先用只依敵人配置與格子快取的更寬鬆下界
+    （回溯目標可為任何前一回合位置、技能次數取關卡上限）篩掉，需要時才計算完整的下界。
+    """
+
+    def __init__(self, board):
+        self.board = board
+        self.plates = [(bit, plates, need) for bit, plates, need in board.plate_groups]
+        self._any_moves = {}
+        self._plate_costs = {}
+        self._enemy = {}
+        self.rows = []  # enemy_costs 的結果：各色壓版最少需要的回溯次數
+        self._row_ids = {}
+        self._masks = {}
+        self._combos = {}
+        self.shifts = board.shifts
+        self._closure = {}
+        level = board.engine.level
+        self.skill_uses = (level.skill1_uses, level.skill2_uses)
+        self._predecessors = None
+        self._relaxed = {}
+
+    def moves_any(self, cell, d):
+        key = (cell, d)
+        result = self._any_moves.get(key)
+        if result is None:
+            board = self.board
+            result = frozenset(board.enemy_move(mask, cell, d) for mask in range(1 << len(board.door_names)))
+            self._any_moves[key] = result
+        return result
+
+    def predecessors(self, cell, d):
+        """上一回合開始時可能的 (格子, 方向)：任意門狀態下走到這裡，或被靜止而留在原地"""
+        if self._predecessors is None:
+            self._predecessors = {}
+            for c in range(self.board.cells):
+                for nd in range(4):
+                    self._predecessors.setdefault((c, nd), set()).add((c, nd))
+                    for target in self.moves_any(c, nd):
+                        self._predecessors.setdefault(target, set()).add((c, nd))
+        return self._predecessors[(cell, d)]
+
+    def plate_costs(self, enemy, prev, phase):
+        """各階段站上各色壓版的 [(回溯次數, 靜止次數)] 帕雷托前緣，逐階段延伸到第 phase 階段並快取
+
+        enemy 與 prev 為單一敵人的編碼（格式同 Board.pack，prev 為 -1 表示沒有回溯目標，
+        -2 表示可能是任何前一回合位置）。技能次數以關卡上限計算，不同剩餘次數的節點共用結果。
+        """
+        key = (enemy, prev)
+        entry = self._plate_costs.get(key)
+        if entry is None:
+            # 狀態 (格子, 方向, 靜止, 上一回合位置) → [(回溯次數, 靜止次數)] 帕雷托前緣
+            cell, d, stunned = enemy >> 3, enemy >> 1 & 3, enemy & 1
+            if prev == -2:
+                lasts = self.predecessors(cell, d)
+            else:
+                lasts = [(prev >> 3, prev >> 1 & 3) if prev >= 0 else None]
+            entry = self._plate_costs[key] = [[], {(cell, d, stunned, last): [(0, 0)] for last in lasts}]
+        phases, states = entry
+        plates = self.plates
+        s1, s2 = self.skill_uses
+        while len(phases) <= phase:
+            fronts = [[] for _ in plates]
+            following = {}
+            for (cell, d, stunned, last), costs in states.items():
+                for used1, used2 in costs:
+                    options = [(cell, d, stunned, used1, used2)]
+                    if last is not None and used1 < s1:
+                        options.append((last[0], last[1], stunned, used1 + 1, used2))
+                    if used2 < s2:
+                        options += [(c, nd, 1, u1, u2 + 1) for c, nd, _, u1, u2 in options]
+                    for c, nd, st, u1, u2 in options:
+                        for front, (_, group, _) in zip(fronts, plates):
+                            if c in group:
+                                _add_pareto(front, (u1, u2))
+                        targets = ((c, nd),) if st > 0 else self.moves_any(c, nd)
+                        for target in targets:
+                            _add_pareto(following.setdefault(target + (0, (c, nd)), []), (u1, u2))
+            phases.append(fronts)
+            states = entry[1] = following
+        return phases
+
+    def enemy_costs(self, enemy, prev, s1, s2, phase):
+        """各階段各色壓版站上去最少需要的回溯次數（s1 + 1 表示不可能），逐階段延伸到第 phase 階段並快取
+
+        回傳每個階段在 self.rows 中的索引清單（之後延伸時同一個清單會原地增長），
+        相同的次數組合共用同一個索引，讓 door_masks 的快取鍵只含小整數。
+        """
+        key = (enemy, prev, s1, s2)
+        phases = self._enemy.get(key)
+        if phases is None:
+            phases = self._enemy[key] = []
+        if len(phases) <= phase:
+            fronts = self.plate_costs(enemy, prev, phase)
+            for j in range(len(phases), phase + 1):
+                best = tuple(min([u1 for u1, u2 in front if u1 <= s1 and u2 <= s2], default=s1 + 1)
+                             for front in fronts[j])
+                row = self._row_ids.get(best)
+                if row is None:
+                    row = self._row_ids[best] = len(self.rows)
+                    self.rows.append(best)
+                phases.append(row)
+        return phases
+
+    def door_masks(self, enemies, se, s1, s2, phase):
+        """到第 phase 階段為止，每個階段可能開啟的門（黃色門一律視為可能開啟）
+
+        se 為 -1 表示每個敵人的回溯目標都可能是任何前一回合位置。
+        """
+        key = (enemies, se, s1, s2)
+        entry = self._masks.get(key)
+        if entry is None:
+            field = (1 << self.board.enemy_bits) - 1
+            if se is None or se < 0:
+                parts = [(enemies >> shift & field, -1 if se is None else -2) for shift in self.shifts]
+            else:
+                parts = [(enemies >> shift & field, se >> shift & field) for shift in self.shifts]
+            columns = []
+            for enemy, last in parts:
+                column = self._enemy.get((enemy, last, s1, s2))
+                columns.append(column if column is not None else self.enemy_costs(enemy, last, s1, s2, 0))
+            entry = self._masks[key] = ([], columns, parts)
+        masks, columns, parts = entry
+        while len(masks) <= phase:
+            j = len(masks)
+            for phases, (enemy, last) in zip(columns, parts):
+                if len(phases) <= j:
+                    self.enemy_costs(enemy, last, s1, s2, j)
+            combo = (s1,) + tuple([phases[j] for phases in columns])
+            mask = self._combos.get(combo)
+            if mask is None:
+                mask = self.board.yellow_bits
+                for (bit, _, need), column in zip(self.plates, zip(*(self.rows[row] for row in combo[1:]))):
+                    if sum(sorted(column)[:need]) <= s1:
+                        mask |= bit
+                self._combos[combo] = mask
+            masks.append(mask)
+        return masks
+
+    def __call__(self, key, cells, max_turns, at_most=None):
+        """回傳至少還需要的回合數（0 表示本回合可能通關），不可能通關時回傳 None
+
+        給定 at_most 時只檢查到第 at_most 階段，仍無法通關就回傳 at_most + 1（依然是下界）。
+        """
+        enemies, yellow, s1, s2, se, turn = key
+        last = max_turns - turn
+        if at_most is not None and at_most < last:
+            last = at_most
+            relaxed_key = (enemies, cells, last)
+            h = self._relaxed.get(relaxed_key, -1)
+            if h == -1:
+                h = self._relaxed[relaxed_key] = self._search(enemies, -1, *self.skill_uses, cells, last)
+            if h is None:
+                return last + 1
+        h = self._search(enemies, se, s1, s2, cells, last)
+        if h is None and last < max_turns - turn:
+            return last + 1
+        return h
+
+    def _search(self, enemies, se, s1, s2, cells, last):
+        """逐階段擴張玩家可到達的格子，回傳第一個可能到達終點的階段，到第 last 階段仍不行時回傳 None"""
+        goal = self.board.goal
+        entry = self._masks.get((enemies, se, s1, s2))
+        masks = entry[0] if entry is not None else ()
+        closures = self._closure
+        reach = cells
+        for phase in range(last + 1):
+            if phase >= len(masks):
+                masks = self.door_masks(enemies, se, s1, s2, phase)
+            closed = closures.get((reach, masks[phase]))
+            reach = closed if closed is not None else self.closure(reach, masks[phase])
+            if reach >> goal & 1:
+                return phase
+        return None
+
+    def closure(self, cells, mask):
+        key = (cells, mask)
+        result = self._closure.get(key)
+        if result is None:
+            result = self._closure[key] = self.board.engine.distances.closure(mask, cells)
+        return result
+
+
+def _add_pareto(front, cost):
+    for other in front:
+        if other[0] <= cost[0] and other[1] <= cost[1]:
+            return
+    front[:] = [other for other in front if not (cost[0] <= other[0] and cost[1] <= other[1])]
+    front.append(cost)
+
+
+def _uncovered(entries, key, cells):
+    """支配剪枝：同一盤面下，回合數不晚且技能次數不少的其他節點已產生過的格子可略過"""
+    enemies, yellow, s1, s2, se, turn = key
+    for t, a, b, seen in entries:
+        if t <= turn and a >= s1 and b >= s2 and (t != turn or a != s1 or b != s2):
+            cells &= ~seen
+            if not cells:
+                return 0
+    return cells
+
+
+class Frontier:
+    """A* 的開放清單與置換表（solve() 與平行搜尋的每個分片共用）
+
+    parents 記錄 節點 → [(父節點, 由父節點新增的格子遮罩), ...]，父節點 None 表示根回合；
+    expanded_cells 記錄每個節點實際展開過的格子，兩者用於還原動作序列。
+    """
+
+    def __init__(self, board, max_turns, bound=None):
+        self.board = board
+        self.max_turns = max_turns
+        self.bound = LowerBound(board) if bound is None else bound
+        self.table = {}  # 置換表：盤面 → [[回合, 技能1, 技能2, 已產生格子遮罩], ...]
+        self.entries = {}  # 節點 → 它在置換表中的項目
+        self.parents = {}
+        self.expanded_cells = {}
+        self.shared_cells = {}  # 不含回溯目標的節點 → 已展開過與回溯目標無關部分的格子遮罩
+        self.heap = []
+        self.pending = {}  # 節點 → 尚未展開的格子遮罩
+        self.counter = 0
+        self.expanded = 0
+        self.pruned = 0
+
+    def add(self, key, mask, parent, limit=None):
+        """加入由 parent 產生的節點；見 add_children()"""
+        self.add_children({key: mask}, parent, limit)
+
+    def add_children(self, children, parent, limit=None):
+        """加入由 parent 產生的子節點 {節點: 格子遮罩}；已產生過、被支配或不可能通關的格子直接捨棄
+
+        置換表記錄的是產生過的格子：支配它的節點不論還在開放清單中或已經展開，都不必再展開它。
+        limit 為父節點的 f 值：下界只算到 f = limit 為止，超過的節點先以 limit + 1 排入，
+        取出時再補算（多數子節點的 f 值都大於最後的解，不必算出完整的下界）。
+        """
+        table = self.table
+        own_entries = self.entries
+        parents = self.parents
+        bound = self.bound
+        for key, mask in children.items():
+            # 被支配的格子也記為已產生：支配它們的節點同樣支配本節點能支配的節點
+            entry = own_entries.get(key)
+            if entry is not None:
+                mask &= ~entry[3]
+                if not mask:
+                    continue
+                entry[3] |= mask
+                entries = table[(key[0], key[1], key[4])]
+            else:
+                enemies, yellow, s1, s2, se, turn = key
+                entry = own_entries[key] = [turn, s1, s2, mask]
+                entries = table.get((enemies, yellow, se))
+                if entries is None:
+                    entries = table[(enemies, yellow, se)] = []
+                entries.append(entry)
+            cells = _uncovered(entries, key, mask)
+            if not cells:
+                self.pruned += 1
+                continue
+            parents.setdefault(key, []).append((parent, cells))
+            at_most = None if limit is None else limit - key[5]
+            h = bound(key, cells, self.max_turns, at_most)
+            if h is not None:
+                self._push(key, cells, h, at_most is None or h <= at_most)
+
+    def _push(self, key, cells, h, exact):
+        cells = self.pending[key] = self.pending.get(key, 0) | cells
+        self.counter += 1
+        # f = 回合 + 下界；同分時先展開較深、格子多、資源多的節點；exact 為 False 表示下界尚未算完
+        heapq.heappush(self.heap, (key[5] + h, -key[5], -bin(cells).count("1"), -key[2] - key[3],
+                                   self.counter, key, exact))
+
+    def top(self):
+        """開放清單中最小的 f 值，清單為空時回傳 None"""
+        heap = self.heap
+        while heap and heap[0][5] not in self.pending:
+            heapq.heappop(heap)
+        return heap[0][0] if heap else None
+
+    def expand_next(self, limit=None):
+        """展開 f 值不超過 limit 的下一個節點
+
+        回傳 (f, 節點, {子節點: 格子遮罩}, 通關格子或 None)，沒有可展開的節點時回傳 None。
+        """
+        heap = self.heap
+        while heap:
+            if limit is not None and heap[0][0] > limit:
+                return None
+            f, _, _, _, _, key, exact = heapq.heappop(heap)
+            cells = self.pending.pop(key, 0)
+            if not cells:
+                continue
+            # 排入之後才產生的較好節點可能已經支配這些格子
+            remaining = _uncovered(self.table[(key[0], key[1], key[4])], key, cells)
+            if not remaining:
+                self.pruned += 1
+                continue
+            if not exact:
+                h = self.bound(key, remaining, self.max_turns, f - key[5])
+                if h is None:
+                    continue
+                if h > f - key[5]:
+                    self._push(key, remaining, h, False)
+                    continue
+            self.expanded_cells[key] = self.expanded_cells.get(key, 0) | remaining
+            self.expanded += 1
+            # 只差在回溯目標的節點產生的子節點大多相同，已展開過的格子只需要列舉回溯敵人的部分
+            shared_key = key[:4] + key[5:]
+            done = self.shared_cells.get(shared_key, 0)
+            self.shared_cells[shared_key] = done | remaining
+            results, won = expand_turn(self.board, key, remaining, self.max_turns, shared=remaining & ~done)
+            return f, key, results, won
+        return None
+
+    @property
+    def table_size(self):
+        return sum(len(entries) for entries in self.table.values())
+
+
+def solve(engine=None, max_turns=None, node_limit=None, stop=None):
+    """從 engine 目前狀態（預設為新遊戲）搜尋回合數最少的通關動作序列
+
+    以回合為單位做 A* 搜尋：每個節點是「敵人配置 + 黃色壓版 + 技能次數 + 回溯目標」，
+    並帶著一組玩家可能所在的格子（位元遮罩）。置換表以盤面記錄已展開的格子，
+    同一盤面下回合數不晚、技能次數不少的節點會支配較差的節點。找到解後再逐回合
+    以完整狀態搜尋還原實際動作。展開超過 node_limit 個節點仍未找到解時放棄，
+    此時 stats["node_limit"] 為 True；每次展開前呼叫 stop()，回傳 True 時同樣放棄並設定 stats["stopped"]。
+    """
+    if engine is None:
+        engine = Engine()
+    if max_turns is None:
+        max_turns = engine.max_turns
+    started = time.perf_counter()
+    board = Board(engine)
+    root = initial_state(engine, board)
+    result = SolveResult()
+    frontier = Frontier(board, max_turns)
+
+    def done(actions, turns):
+        result.actions = actions
+        result.turns = turns
+        result.nodes_expanded += frontier.expanded
+        result.table_size = frontier.table_size
+        result.elapsed = time.perf_counter() - started
+        result.stats = {"pruned": frontier.pruned, "closures": len(board._closures)}
+        return result
+
+    # 根回合可能停在回合中途，以完整狀態搜尋
+    if engine.game_won or engine.game_lost or not engine.player_turn:
+        return done(None, 0)
+    actions, layer, result.nodes_expanded = _root_layer(board, root, max_turns)
+    if actions is not None:
+        return done(actions, root[10])
+    frontier.add_children(layer, None)
+
+    while True:
+        if node_limit is not None and frontier.expanded >= node_limit:
+            done(None, 0).stats["node_limit"] = True
+            return result
+        if stop is not None and stop():
+            done(None, 0).stats["stopped"] = True
+            return result
+        step = frontier.expand_next()
+        if step is None:
+            return done(None, 0)
+        f, key, results, won = step
+        if won is not None:
+            actions = _reconstruct(board, root, frontier.parents, frontier.expanded_cells, key, won, max_turns)
+            return done(actions, key[5])
+        frontier.add_children(results, key, f)
+
+
+def _root_layer(board, root, max_turns):
+    """以完整狀態搜尋根回合：回傳 (本回合即可通關的動作或 None, {下一回合節點: 格子遮罩}, 展開數)"""
+    actions, _ = explicit_turn(board, root, max_turns)
+    if actions is not None:
+        return actions, {}, 0
+    layer = {}
+    queue = [root]
+    seen = {root}
+    expanded = 0
+    while queue:
+        next_queue = []
+        for state in queue:
+            expanded += 1
+            for action, child, _ in successors(state, board, max_turns):
+                if child in seen:
+                    continue
+                seen.add(child)
+                if action[0] == "end_turn":
+                    key, cell = turn_key(child)
+                    layer[key] = layer.get(key, 0) | 1 << cell
+                else:
+                    next_queue.append(child)
+        queue = next_queue
+    return None, layer, expanded
+
+
+def _shard_of(key, shards):
+    """節點所屬的分片：以支配剪枝的盤面（敵人、黃色壓版、回溯目標）雜湊，讓可互相支配的節點落在同一分片"""
+    return hash((key[0], key[1], key[4])) % shards
+
+
+def _shard_worker(index, conn, inboxes, outstanding, done, incumbent, board, bound, max_turns, nodes, batch):
+    """平行搜尋的工作行程：非同步展開自己分片的節點，子節點成批轉送給所屬分片
+
+    outstanding 是忙碌中的行程數加上轉送中的批次數：送出批次前先加一，收到批次的行程
+    先把自己標為忙碌再減一，因此降到 0 時所有分片都已沒有 f 值小於 incumbent 的節點，
+    也沒有還在路上的子節點，由最後一個閒下來的行程設定 done。
+    """
+    shards = len(inboxes)
+    frontier = Frontier(board, max_turns, bound)
+    frontier.add_children(nodes, None)
+    inbox = inboxes[index]
+    out = [[] for _ in range(shards)]
+    won = None
+    busy = True
+    seconds = 0.0
+
+    def adjust(delta):
+        with outstanding.get_lock():
+            outstanding.value += delta
+            if outstanding.value == 0:
+                done.set()
+
+    while True:
+        try:
+            items = inbox.get(block=not busy)
+        except queue.Empty:
+            items = ()
+        if items is None:
+            break
+        if items:
+            if not busy:
+                adjust(1)
+                busy = True
+            adjust(-1)
+            started = time.perf_counter()
+            for parent, f, children in items:
+                frontier.add_children(children, parent, f)
+            seconds += time.perf_counter() - started
+            continue
+        started = time.perf_counter()
+        step = None
+        for _ in range(batch):
+            # 只有 f 值小於目前最佳解回合數的節點可能找到更好的解
+            step = frontier.expand_next(incumbent.value - 1)
+            if step is None:
+                break
+            f, key, results, cell = step
+            if cell is not None:
+                if won is None or key[5] < won[0][5]:
+                    won = (key, cell)
+                with incumbent.get_lock():
+                    incumbent.value = min(incumbent.value, key[5])
+                continue
+            own = {}
+            routed = [{} for _ in range(shards)]
+            for child, mask in results.items():
+                shard = _shard_of(child, shards)
+                if shard == index:
+                    own[child] = mask
+                else:
+                    routed[shard][child] = mask
+            frontier.add_children(own, key, f)
+            for shard, children in enumerate(routed):
+                if children:
+                    out[shard].append((key, f, children))
+        for shard, items in enumerate(out):
+            if items:
+                adjust(1)
+                inboxes[shard].put(items)
+                out[shard] = []
+        seconds += time.perf_counter() - started
+        if step is None:
+            busy = False
+            adjust(-1)
+
+    conn.send((won, frontier.expanded, frontier.pruned, frontier.table_size, seconds))
+    while True:
+        command, payload = conn.recv()
+        if command == "parents":
+            conn.send(frontier.parents[payload])
+        elif command == "expanded_cells":
+            conn.send(frontier.expanded_cells[payload])
+        else:
+            conn.close()
+            return
+
+
+class _ShardLookup:
+    """把 dict 查詢轉送給擁有該節點的工作行程（用於還原動作序列）"""
+
+    def __init__(self, conns, command):
+        self.conns = conns
+        self.command = command
+
+    def __getitem__(self, key):
+        conn = self.conns[_shard_of(key, len(self.conns))]
+        conn.send((self.command, key))
+        return conn.recv()
+
+
+def solve_parallel(engine=None, max_turns=None, workers=None, batch=16):
+    """多行程版本的 solve()：節點依盤面雜湊分片給各工作行程，各自維護開放清單與置換表
+
+    各行程不互相等待：每次最多展開 batch 個自己的節點，屬於自己分片的子節點直接加入，
+    其餘子節點依分片累積成批送出。找到解時更新全體共用的最佳回合數，之後只展開 f 值
+    比它小的節點；所有行程都沒有這樣的節點、也沒有轉送中的子節點時搜尋結束，
+    此時最佳回合數即為最少回合數。stats["workers"] 記錄每個工作行程的展開數與吞吐量。
+    """
+    if engine is None:
+        engine = Engine()
+    if max_turns is None:
+        max_turns = engine.max_turns
+    if workers is None:
+        workers = os.cpu_count() or 1
+    started = time.perf_counter()
+    board = Board(engine)
+    root = initial_state(engine, board)
+    result = SolveResult()
+    if engine.game_won or engine.game_lost or not engine.player_turn:
+        result.elapsed = time.perf_counter() - started
+        return result
+    actions, layer, result.nodes_expanded = _root_layer(board, root, max_turns)
+    if actions is not None:
+        result.actions, result.turns = actions, root[10]
+        result.elapsed = time.perf_counter() - started
+        return result
+
+    # 與節點無關的轉移表與前驅表先在主行程建好，工作行程啟動時直接繼承
+    bound = LowerBound(board)
+    bound.predecessors(board.goal, 0)
+    nodes = [{} for _ in range(workers)]
+    for key, cells in layer.items():
+        nodes[_shard_of(key, workers)][key] = cells
+    inboxes = [multiprocessing.Queue() for _ in range(workers)]
+    outstanding = multiprocessing.Value("i", workers)
+    incumbent = multiprocessing.Value("i", max_turns + 1)
+    done = multiprocessing.Event()
+    conns, processes = [], []
+    for index in range(workers):
+        parent_conn, child_conn = multiprocessing.Pipe()
+        process = multiprocessing.Process(
+            target=_shard_worker, daemon=True,
+            args=(index, child_conn, inboxes, outstanding, done, incumbent, board, bound, max_turns, nodes[index], batch))
+        process.start()
+        conns.append(parent_conn)
+        processes.append(process)
+    stats = []
+    pruned = 0
+    won = None
+    try:
+        done.wait()
+        for inbox in inboxes:
+            inbox.put(None)
+        for conn in conns:
+            found, expanded, shard_pruned, size, seconds = conn.recv()
+            stats.append({"nodes": expanded, "seconds": seconds,
+                          "nodes_per_second": expanded / seconds if seconds > 0 else 0.0})
+            result.nodes_expanded += expanded
+            result.table_size += size
+            pruned += shard_pruned
+            if found is not None and (won is None or found[0][5] < won[0][5]):
+                won = found
+        if won is not None:
+            key, cell = won
+            result.actions = _reconstruct(board, root, _ShardLookup(conns, "parents"),
+                                          _ShardLookup(conns, "expanded_cells"), key, cell, max_turns)
+            result.turns = key[5]
+    finally:
+        for inbox, conn in zip(inboxes, conns):
+            inbox.put(None)
+            conn.send(("quit", None))
+        for process in processes:
+            process.join()
+    result.elapsed = time.perf_counter() - started
+    result.stats = {"pruned": pruned, "workers": stats}
+    return result
+
+
+def _reconstruct(board, root, parents, expanded_cells, key, cell, max_turns):
+    """依父節點鏈逐回合還原完整動作序列"""
+    chain = [(key, cell)]
+    while True:
+        key, cell = chain[-1]
+        parent = next(p for p, mask in parents[key] if mask >> cell & 1)
+        if parent is None:
+            break
+        _, origin = expand_turn(board, parent, expanded_cells[parent], max_turns, want=(key, cell))
+        chain.append((parent, origin))
+    chain.reverse()
+    actions, _ = explicit_turn(board, root, max_turns, explicit_state(board, *chain[0]))
+    for (k, c), (nk, nc) in zip(chain, chain[1:]):
+        step, _ = explicit_turn(board, explicit_state(board, k, c), max_turns, explicit_state(board, nk, nc))
+        actions += step
+    step, _ = explicit_turn(board, explicit_state(board, *chain[-1]), max_turns)
+    return actions + step
+
+
+def replay(actions, engine=None):
+    """把動作序列套用到 Engine 上，回傳最後的 Engine"""
+    if engine is None:
+        engine = Engine()
+    for name, *args in actions:
+        getattr(engine, name)(*args)
+    return engine
+
+
+def main():
+    if "-j" in sys.argv:
+        result = solve_parallel(workers=int(sys.argv[sys.argv.index("-j") + 1]))
+    else:
+        result = solve()
+    if not result.solved:
+        print("找不到解")
+    else:
+        print(f"最少回合數：{result.turns}，共 {len(result.actions)} 個動作")
+        turn = 1
+        line = []
+        for action in result.actions:
+            if action[0] == "end_turn":
+                print(f"  回合 {turn}: {' '.join(_format(a) for a in line) or '（不動）'}")
+                turn += 1
+                line = []
+            else:
+                line.append(action)
+        print(f"  回合 {turn}: {' '.join(_format(a) for a in line)}")
+        print("重播驗證：", "勝利" if replay(result.actions).game_won else "失敗")
+    print(f"展開節點：{result.nodes_expanded}，置換表：{result.table_size}，"
+          f"剪枝：{result.stats.get('pruned', 0)}，耗時 {result.elapsed:.3f}s，"
+          f"{result.nodes_per_second:,.0f} 節點/秒")
+    for index, worker in enumerate(result.stats.get("workers", ())):
+        print(f"  行程 {index}：展開 {worker['nodes']}，{worker['nodes_per_second']:,.0f} 節點/秒")
+    return 0 if result.solved else 1
+
+
+def _format(action):
+    name = action[0]
+    if name == "move_player":
+        return {(1, 0): "→", (-1, 0): "←", (0, 1): "↑", (0, -1): "↓"}[action[1:]]
+    if name == "use_skill1_on_player":
+        return "[回溯玩家]"
+    if name == "use_skill1_on_enemy":
+        return f"[回溯敵人#{action[1] + 1}]"
+    if name == "use_skill2":
+        return f"[靜止({action[1]},{action[2]})]"
+    return name
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,528 @@
+"""解答資料庫：離線以逆向分析標出每個可到達的回合開始狀態「還要幾回合才能通關」與本回合的最佳動作，
+存成可記憶體映射的檔案，遊戲中直接查表提示下一步
+
+用法：
+    python tablebase.py [關卡檔]                        # 顯示已建立的資料庫
+    python tablebase.py --build [-j 行程數] [關卡檔]   # 建立資料庫（需安裝 numpy），存在關卡檔旁的 __pycache__/
+
+建立很耗時：四重奏有約 270 萬個可到達的狀態，單一行程約需 25 分鐘（展開約 10 分鐘，動作計畫
+可用 -j 分給多個行程）、約 2 GB 記憶體，檔案約 40 MB，因此只有明確加上 --build 才會建立。
+
+狀態與 solver 的回合層節點相同：(玩家格子, 黃色壓版, 技能 1/2 剩餘次數, 敵人, 回溯目標)，
+不含回合數。每個敵人只可能出現在「從起點出發、任意門狀態下走得到」的狀態上，
+因此以各敵人的局部編號（有回溯目標時為「回溯目標 → 目前狀態」配對的編號）做混合進位，
+得到一個沒有碰撞的完美編碼。編碼空間中只有少數狀態可到達，檔案以位元圖標出它們，
+每 64 個索引另存之前的狀態數，查詢時由這兩者算出狀態的序號，再以序號讀出：
+通關前還要結束的回合數（UNWINNABLE 表示無法通關），以及本回合的動作計畫
+（固定寬度的動作代碼，不足處以 PADDING 補齊）。
+
+建立方式：從起點逐格展開所有可到達的狀態並記下子狀態，再從「本回合就能通關」的狀態
+一層層往回標記，同時記下每個狀態命中的子狀態；最後在回合內找出到達該子狀態（或直接通關）
+的最短動作序列。檔案以唯讀方式映射，多個遊戲行程開啟同一個檔案時共用同一份記憶體。
+
+查表只涵蓋回合開始的狀態與照著計畫走到的回合中途狀態：偏離計畫（或從回合中途讀檔）的
+回合中途狀態不在資料庫裡，best_action() 回傳 None，提示行程改用 solver 從頭搜尋
+（四重奏開局約需一秒）。要讓這些狀態也能查表，得存下每個回合中途狀態，檔案會大上數十倍。
+"""
+import contextlib
+import json
+import mmap
+import multiprocessing
+import os
+import struct
+import sys
+import time
+import zlib
+from array import array
+
+from engine import DELTA_INDEX, DIRECTIONS, Engine, cell_of, pos_of
+import solver
+
+MAGIC = b"SBTB"
+VERSION = 2
+HEADER = struct.Struct("<4sBIIBBHB")  # 標記、版本、關卡指紋、格子數、技能 1/2 上限、敵人數、計畫寬度
+UNWINNABLE = 255
+UNKNOWN = 254  # 只在建立時使用：不在分析範圍內（無法從關卡起點到達）的狀態
+# 動作代碼：0 ~ 3 為移動方向，之後依序為結束回合、回溯玩家、回溯第 i 個敵人、以第 c 格為中心施放靜止
+END_TURN = 4
+SKILL1_PLAYER = 5
+SKILL1_ENEMY = 6
+PADDING = 255
+PLAN_CHUNK = 10000  # 每個工作行程一次建立的動作計畫數
+NO_LIMIT = 1 << 30  # 展開時不檢查回合上限：回合數不屬於狀態，是否超過上限由查詢端判斷
+
+
+def fingerprint(level):
+    """關卡內容的校驗碼（名稱以外的任何改變都會讓舊的資料庫失效）"""
+    data = dict(level.to_dict(), name="")
+    return zlib.crc32(json.dumps(data, sort_keys=True).encode("utf-8"))
+
+
+def path_for(level_path):
+    """關卡檔對應的資料庫路徑"""
+    directory, filename = os.path.split(os.path.abspath(level_path))
+    return os.path.join(directory, "__pycache__", os.path.splitext(filename)[0] + ".sbtb")
+
+
+def enemy_domains(engine):
+    """每個敵人可能的狀態與（回溯目標, 目前狀態）配對：[(狀態清單, 配對清單)]"""
+    kernel = engine.kernel
+    tables = [kernel.turn_table(mask) for mask in range(1 << len(engine.door_names))]
+    domains = []
+    for start in engine.enemies.states:
+        seen = {start}
+        stack = [start]
+        while stack:
+            state = stack.pop()
+            for table in tables:
+                if table[state] not in seen:
+                    seen.add(table[state])
+                    stack.append(table[state])
+        # 回溯目標是敵人移動前的狀態；被靜止的敵人原地不動
+        pairs = {(state, table[state]) for state in seen for table in tables} | {(state, state) for state in seen}
+        domains.append((sorted(seen), sorted(pairs)))
+    return domains
+
+
+class Encoding:
+    """回合層狀態 ↔ 檔案中的索引（完美編碼）"""
+
+    def __init__(self, cells, skill1, skill2, domains):
+        self.cells = cells
+        self.skill1 = skill1
+        self.skill2 = skill2
+        self.domains = domains
+        # 敵人以 solver.Board 的整數格式表示：每個敵人 enemy_bits 個位元，(狀態 * 2 + 靜止)
+        self.enemy_bits = (cells * 8 - 1).bit_length()
+        self.shifts = [i * self.enemy_bits for i in range(len(domains))]
+        self.state_index = [{state: i for i, state in enumerate(states)} for states, _ in domains]
+        self.pair_index = [{pair: i for i, pair in enumerate(pairs)} for _, pairs in domains]
+        self.plain = 1  # 沒有回溯目標時的敵人組合數
+        self.paired = 1  # 有回溯目標時的敵人組合數
+        for states, pairs in domains:
+            self.plain *= len(states)
+            self.paired *= len(pairs)
+        self.keys = (self.plain + self.paired) * (skill2 + 1) * (skill1 + 1) * 2
+        self.size = self.keys * cells
+
+    def key_code(self, key):
+        """回合層節點 (enemies, yellow, s1, s2, se[, turn]) → 節點編號，無法編碼時回傳 None"""
+        enemies, yellow, s1, s2, se = key[:5]
+        field = (1 << self.enemy_bits) - 1
+        code = 0
+        if se is None:
+            for shift, index in zip(reversed(self.shifts), reversed(self.state_index)):
+                i = index.get((enemies >> shift & field) >> 1)
+                if i is None:
+                    return None
+                code = code * len(index) + i
+        else:
+            for shift, index in zip(reversed(self.shifts), reversed(self.pair_index)):
+                i = index.get(((se >> shift & field) >> 1, (enemies >> shift & field) >> 1))
+                if i is None:
+                    return None
+                code = code * len(index) + i
+            code += self.plain
+        if not (0 <= s1 <= self.skill1 and 0 <= s2 <= self.skill2):
+            return None
+        return ((code * (self.skill2 + 1) + s2) * (self.skill1 + 1) + s1) * 2 + bool(yellow)
+
+    def key_of(self, code):
+        """key_code() 的反函數：節點編號 → (enemies, yellow, s1, s2, se)"""
+        code, yellow = divmod(code, 2)
+        code, s1 = divmod(code, self.skill1 + 1)
+        code, s2 = divmod(code, self.skill2 + 1)
+        enemies = 0
+        if code < self.plain:
+            se = None
+            for shift, (states, _) in zip(self.shifts, self.domains):
+                code, i = divmod(code, len(states))
+                enemies |= states[i] * 2 << shift
+        else:
+            code -= self.plain
+            se = 0
+            for shift, (_, pairs) in zip(self.shifts, self.domains):
+                code, i = divmod(code, len(pairs))
+                prev, state = pairs[i]
+                enemies |= state * 2 << shift
+                se |= prev * 2 << shift
+        return enemies, bool(yellow), s1, s2, se
+
+    def index(self, key, cell):
+        code = self.key_code(key)
+        return None if code is None else code * self.cells + cell
+
+
+
+
+def action_code(action, board):
+    """solver 格式的動作 → 動作代碼"""
+    name = action[0]
+    if name == "move_player":
+        return DELTA_INDEX[action[1:]]
+    if name == "end_turn":
+        return END_TURN
+    if name == "use_skill1_on_player":
+        return SKILL1_PLAYER
+    if name == "use_skill1_on_enemy":
+        return SKILL1_ENEMY + action[1]
+    return SKILL1_ENEMY + board.enemy_count + cell_of(action[1:], board.size)
+
+
+def code_action(code, board):
+    """動作代碼 → solver 格式的動作"""
+    if code < END_TURN:
+        return ("move_player",) + DIRECTIONS[code].value
+    if code == END_TURN:
+        return ("end_turn",)
+    if code == SKILL1_PLAYER:
+        return ("use_skill1_on_player",)
+    if code < SKILL1_ENEMY + board.enemy_count:
+        return ("use_skill1_on_enemy", code - SKILL1_ENEMY)
+    return ("use_skill2",) + tuple(pos_of(code - SKILL1_ENEMY - board.enemy_count, board.size))
+
+
+def plan_width(board):
+    """一回合最長的最短動作序列：每步移動、兩種技能各一次與結束回合"""
+    return board.moves + 3
+
+
+def _plans(board, encoding, width, chunk):
+    """一段狀態的動作計畫：chunk 為 [(索引, 值, 命中的子節點編號, 命中的格子遮罩)]，依序各佔 width 個位元組
+
+    在回合內以廣度優先搜尋找出到達命中的子狀態（或直接通關）的最短動作序列。
+    """
+    plans = bytearray([PADDING]) * (len(chunk) * width)
+    for rank, (index, value, child, hit) in enumerate(chunk):
+        if value == UNWINNABLE:
+            continue
+        code, cell = divmod(index, encoding.cells)
+        start = solver.explicit_state(board, encoding.key_of(code) + (0,), cell)
+        if value:
+            target = solver.explicit_state(board, encoding.key_of(child) + (1,), (hit & -hit).bit_length() - 1)
+            actions, _ = solver.explicit_turn(board, start, NO_LIMIT, target)
+        else:
+            # 本回合就能通關：依序找不用技能、只回溯、只靜止、兩種都用的走法，多數狀態不必展開所有技能組合
+            s1, s2 = start[3], start[5]
+            for keep in dict.fromkeys([(s1, s2), (max(s1 - 1, 0), s2), (s1, max(s2 - 1, 0)), (0, 0)]):
+                actions, _ = solver.explicit_turn(board, start, NO_LIMIT, keep=keep)
+                if actions is not None:
+                    break
+        plans[rank * width:rank * width + len(actions)] = bytes(action_code(action, board) for action in actions)
+    return bytes(plans)
+
+
+_worker_context = None  # 工作行程的 (Board, Encoding)
+
+
+def _init_worker(level, domains):
+    global _worker_context
+    board = solver.Board(Engine(level))
+    _worker_context = board, Encoding(board.cells, level.skill1_uses, level.skill2_uses, domains)
+
+
+def _plans_worker(chunk):
+    board, encoding = _worker_context
+    return _plans(board, encoding, plan_width(board), chunk)
+
+
+def build(level, progress=None, workers=None):
+    """逆向分析 level，回傳 (Encoding, 計畫寬度, 檔案的資料區段, 統計)；需要 numpy
+
+    展開與逆向標記在目前的行程中進行，最後的動作計畫交給 workers 個行程（預設為 CPU 數）。
+    progress(訊息) 在建立過程中定期呼叫。
+    """
+    import numpy as np
+
+    if level.size * level.size > 64:
+        raise ValueError("解答資料庫以 64 位元遮罩記錄玩家格子，只支援 8x8 以內的棋盤")
+    started = time.perf_counter()
+    workers = workers or os.cpu_count() or 1
+    engine = Engine(level)
+    board = solver.Board(engine)
+    encoding = Encoding(board.cells, level.skill1_uses, level.skill2_uses, enemy_domains(engine))
+    root_key, root_cell = solver.turn_key(solver.initial_state(engine, board))
+
+    # 展開：每個狀態記下 {子節點編號: 玩家格子遮罩}，以 CSR 形式存成陣列
+    seen = {root_key[:5]: 1 << root_cell}
+    queue = [(root_key[:5], 1 << root_cell)]
+    owners = array("q")  # 展開過且本回合無法通關的狀態索引
+    starts = array("q", [0])  # 每個狀態的子節點在 children/masks 中的起點
+    children = array("q")
+    masks = array("Q")
+    wins = array("q")
+    expanded = 0
+    while queue:
+        key, cells = queue.pop()
+        code = encoding.key_code(key)
+        turn_key = key + (0,)
+        while cells:
+            low = cells & -cells
+            cells ^= low
+            cell = low.bit_length() - 1
+            results, won = solver.expand_turn(board, turn_key, low, NO_LIMIT)
+            expanded += 1
+            if progress is not None and expanded % 10000 == 0:
+                progress(f"已展開 {expanded:,} 個狀態，待展開 {len(queue):,} 個節點")
+            if won is not None:
+                wins.append(code * encoding.cells + cell)
+                continue
+            owners.append(code * encoding.cells + cell)
+            for child, mask in results.items():
+                child = child[:5]
+                children.append(encoding.key_code(child))
+                masks.append(mask)
+                new = mask & ~seen.get(child, 0)
+                if new:
+                    seen[child] = seen.get(child, 0) | new
+                    queue.append((child, new))
+            starts.append(len(children))
+    del seen
+
+    # 逆向標記：solved[節點] 為已知 turns 回合內可通關的格子遮罩，子節點命中它的狀態需要 turns + 1 回合，
+    # 並記下命中的子節點與格子，之後據此找出本回合的動作
+    values = np.full(encoding.size, UNKNOWN, dtype=np.uint8)
+    owners = np.frombuffer(owners, dtype=np.int64)
+    values[owners] = UNWINNABLE
+    wins = np.frombuffer(wins, dtype=np.int64)
+    values[wins] = 0
+    solved = np.zeros(encoding.keys, dtype=np.uint64)
+    target_keys = np.full(len(owners), -1, dtype=np.int64)
+    target_cells = np.zeros(len(owners), dtype=np.uint64)
+
+    def mark(states):
+        bits = np.left_shift(np.uint64(1), (states % encoding.cells).astype(np.uint64))
+        np.bitwise_or.at(solved, states // encoding.cells, bits)
+
+    mark(wins)
+    counts = np.diff(np.frombuffer(starts, dtype=np.int64))
+    edge_owner = np.repeat(np.arange(len(owners)), counts)
+    children = np.frombuffer(children, dtype=np.int64)
+    masks = np.frombuffer(masks, dtype=np.uint64)
+    edges = len(children)
+    turns = 0
+    while len(children) and turns < UNKNOWN - 1:
+        hits = np.flatnonzero((masks & solved[children]) != 0)
+        # 同一個狀態命中多個子節點時選剩餘技能次數最多的：提示不浪費技能，回合內的動作也較快找到
+        skills = children[hits] // 2
+        spare = skills % (encoding.skill1 + 1) + skills // (encoding.skill1 + 1) % (encoding.skill2 + 1)
+        hits = hits[np.lexsort((-spare, edge_owner[hits]))]
+        found, first = np.unique(edge_owner[hits], return_index=True)
+        if not len(found):
+            break
+        chosen = hits[first]
+        target_keys[found] = children[chosen]
+        target_cells[found] = masks[chosen] & solved[children[chosen]]
+        turns += 1
+        states = owners[found]
+        values[states] = turns
+        mark(states)
+        # 只保留還沒有答案的狀態的邊
+        keep = np.ones(len(owners), dtype=bool)
+        keep[found] = False
+        alive = keep[edge_owner]
+        children, masks, edge_owner = children[alive], masks[alive], edge_owner[alive]
+    del children, masks, edge_owner
+
+    # 只保留可到達的狀態：位元圖、每 64 個索引之前的狀態數、依序號排列的值
+    present = values != UNKNOWN
+    words = -(-encoding.size // 64)
+    flags = np.zeros(words * 64, dtype=bool)
+    flags[:encoding.size] = present
+    counts = flags.reshape(words, 64).sum(axis=1)
+    bitmap = np.packbits(flags, bitorder="little").tobytes()
+    ranks = (np.cumsum(counts) - counts).astype("<u4").tobytes()
+    del flags, present
+    indices = np.flatnonzero(values != UNKNOWN)
+    values = values[indices]
+    order = np.searchsorted(indices, owners)
+    ranked_keys = np.full(len(indices), -1, dtype=np.int64)
+    ranked_keys[order] = target_keys
+    ranked_cells = np.zeros(len(indices), dtype=np.uint64)
+    ranked_cells[order] = target_cells
+
+    # 本回合的動作計畫：分段交給 workers 個行程（每段各自在回合內搜尋），依序號接起來
+    width = plan_width(board)
+    chunks = (list(zip(indices[i:i + PLAN_CHUNK].tolist(), values[i:i + PLAN_CHUNK].tolist(),
+                       ranked_keys[i:i + PLAN_CHUNK].tolist(), ranked_cells[i:i + PLAN_CHUNK].tolist()))
+              for i in range(0, len(indices), PLAN_CHUNK))
+    plans = bytearray()
+    with contextlib.ExitStack() as stack:
+        if workers == 1:
+            parts = (_plans(board, encoding, width, chunk) for chunk in chunks)
+        else:
+            pool = stack.enter_context(multiprocessing.Pool(workers, _init_worker, (level, encoding.domains)))
+            parts = pool.imap(_plans_worker, chunks)
+        for part in parts:
+            plans += part
+            if progress is not None:
+                progress(f"已建立 {len(plans) // width:,} / {len(indices):,} 個狀態的動作計畫")
+    stats = {"states": len(indices), "wins": len(wins), "edges": edges,
+             "max_turns": turns, "elapsed": time.perf_counter() - started}
+    return encoding, width, (bitmap, ranks, values.tobytes(), plans), stats
+
+
+def write(path, level, encoding, width, sections):
+    """寫入資料庫檔案（先寫暫存檔再取代）；各區段從 8 的倍數位置開始"""
+    out = bytearray(HEADER.pack(MAGIC, VERSION, fingerprint(level), encoding.cells,
+                                encoding.skill1, encoding.skill2, len(encoding.domains), width))
+    for states, pairs in encoding.domains:
+        out += struct.pack("<I", len(states)) + array("I", states).tobytes()
+        out += struct.pack("<I", len(pairs)) + array("I", [s for pair in pairs for s in pair]).tobytes()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp = path + ".tmp"
+    with open(temp, "wb") as f:
+        f.write(out)
+        for section in sections:
+            f.write(bytes(-f.tell() % 8))
+            f.write(section)
+    os.replace(temp, path)
+
+
+class Tablebase:
+    """以唯讀記憶體映射開啟的解答資料庫"""
+
+    def __init__(self, path, level=None):
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        data = self._map
+        magic, version, self.fingerprint, cells, skill1, skill2, count, width = HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError(f"不支援的資料庫檔案：{path}")
+        if level is not None and fingerprint(level) != self.fingerprint:
+            self.close()
+            raise ValueError(f"資料庫 {path} 與目前的關卡不符，請重新建立")
+        offset = HEADER.size
+        domains = []
+        for _ in range(count):
+            (length,) = struct.unpack_from("<I", data, offset)
+            states = array("I", data[offset + 4:offset + 4 + length * 4]).tolist()
+            offset += 4 + length * 4
+            (length,) = struct.unpack_from("<I", data, offset)
+            flat = array("I", data[offset + 4:offset + 4 + length * 8]).tolist()
+            offset += 4 + length * 8
+            domains.append((states, list(zip(flat[::2], flat[1::2]))))
+        self.encoding = Encoding(cells, skill1, skill2, domains)
+        self.width = width
+
+        def section(length):
+            nonlocal offset
+            offset += -offset % 8
+            offset += length
+            return memoryview(data)[offset - length:offset]
+
+        words = -(-self.encoding.size // 64)
+        self.bitmap = section(words * 8).cast("Q")
+        self.ranks = section(words * 4).cast("I")
+        self.states = self.ranks[-1] + bin(self.bitmap[-1]).count("1")
+        self.values = section(self.states)
+        self.plans = section(self.states * width)
+        self._boards = {}
+        self._hints = {}  # 目前回合計畫上的完整狀態 → (動作, 回合數)
+
+    def close(self):
+        self.bitmap = self.ranks = self.values = self.plans = None
+        self._map.close()
+
+    def rank(self, key, cell):
+        """回合層節點 + 玩家格子 → 狀態的序號，不在資料庫中時回傳 None"""
+        index = self.encoding.index(key, cell)
+        if index is None:
+            return None
+        word, bit = divmod(index, 64)
+        bits = self.bitmap[word]
+        if not bits >> bit & 1:
+            return None
+        return self.ranks[word] + bin(bits & ((1 << bit) - 1)).count("1")
+
+    def value(self, key, cell):
+        """回合層節點 + 玩家格子 → 通關前還要結束的回合數；無法通關或不在資料庫中時回傳 None"""
+        rank = self.rank(key, cell)
+        if rank is None:
+            return None
+        value = self.values[rank]
+        return None if value == UNWINNABLE else value
+
+    def best_action(self, engine):
+        """目前狀態的最佳下一個動作：(動作, 通關前還要結束的回合數)，無法通關時回傳 (None, None)
+
+        回合開始時讀出該狀態的值與本回合的動作計畫；回合中只認得照著計畫走到的狀態，
+        其他狀態（例如偏離了計畫，或從回合中途讀檔）回傳 None，由呼叫端改用 solver 搜尋。
+        動作格式與 solver 相同，例如 ("move_player", 1, 0)、("end_turn",)。
+        """
+        if not engine.player_turn or engine.game_won or engine.game_lost:
+            return None
+        board = self._boards.get(id(engine.passable))
+        if board is None or board.engine is not engine:
+            board = self._boards[id(engine.passable)] = solver.Board(engine)
+        state = solver.initial_state(engine, board)
+        hint = self._hints.get(state)
+        if hint is not None:
+            return hint
+        key, cell = solver.turn_key(state)
+        if state != solver.explicit_state(board, key, cell):
+            return None
+        rank = self.rank(key, cell)
+        if rank is None:
+            return None
+        turns = self.values[rank]
+        if turns == UNWINNABLE:
+            return None, None
+        # 沿著計畫記下每一步之前的狀態，回合中的查詢直接查這張表
+        hints = {}
+        current = state
+        for code in self.plans[rank * self.width:(rank + 1) * self.width]:
+            if code == PADDING:
+                break
+            action = code_action(code, board)
+            hints[current] = (action, turns)
+            current = next(child for name, child, _ in solver.successors(current, board, NO_LIMIT) if name == action)
+        self._hints = hints
+        return hints[state]
+
+
+def open_for(level, path):
+    """開啟 level 的資料庫，檔案不存在或與關卡不符時回傳 None"""
+    try:
+        return Tablebase(path, level)
+    except (OSError, ValueError):
+        return None
+
+
+def main():
+    from level import DEFAULT_LEVEL, load_level
+
+    arguments = sys.argv[1:]
+    workers = None
+    if "-j" in arguments:
+        i = arguments.index("-j")
+        workers = int(arguments[i + 1])
+        del arguments[i:i + 2]
+    rebuild = "--build" in arguments
+    arguments = [argument for argument in arguments if argument != "--build"]
+    level_path = arguments[0] if arguments else DEFAULT_LEVEL
+    level = load_level(level_path)
+    path = path_for(level_path)
+    if rebuild:
+        encoding, width, sections, stats = build(level, lambda message: print("\r" + message, end="", flush=True),
+                                                 workers)
+        write(path, level, encoding, width, sections)
+        print(f"\n{level.name}：{stats['states']:,} 個可到達的狀態（{stats['wins']:,} 個本回合可通關），"
+              f"{stats['edges']:,} 條邊，最多需要 {stats['max_turns']} 回合，耗時 {stats['elapsed']:.1f}s")
+    table = open_for(level, path)
+    if table is None:
+        print(f"{level.name}：沒有相符的解答資料庫 {path}")
+        print("以 python tablebase.py --build 建立（需安裝 numpy；四重奏單一行程約 25 分鐘、約 2 GB 記憶體）")
+        return 1
+    print(f"{path}：{table.states:,} 個狀態，{os.path.getsize(path) / 1e6:.1f} MB")
+    engine = Engine(level)
+    start = time.perf_counter()
+    hint = table.best_action(engine)
+    print(f"起點最佳動作：{hint}，查詢 {(time.perf_counter() - start) * 1000:.2f}ms")
+    table.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
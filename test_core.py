@@ -0,0 +1,272 @@
+"""回歸測試：規則引擎、撤銷/重做、錄影重播與存檔
+
+用法：
+    python -m unittest test_core    # 或 python -m pytest test_core.py
+
+BASELINE_TRACES 由重構前的 pygame 版 Game 以相同的動作序列錄下：每一步之後的狀態
+（含行動記錄）取 SHA-1 的前 6 個十六進位字元，引擎的行為必須逐步一致。
+"""
+import hashlib
+import os
+import random
+import tempfile
+import unittest
+
+import replay
+import savegame
+from engine import Engine
+from history import COUNTS, History
+
+# 動作代號：U/D/L/R 移動，E 結束回合，P 回溯玩家，B<i> 回溯第 i 個敵人，S<x><y> 以 (x,y) 為中心靜止
+MOVES = {"U": (0, 1), "D": (0, -1), "L": (-1, 0), "R": (1, 0)}
+
+# (動作序列, 每一步之後的狀態摘要)
+BASELINE_TRACES = [
+    # 求解器找到的 7 回合解
+    ("U L D E S45 E U D S77 B0 E U D R R R E R D B0 S47 E L U U L L L P E U R R",
+     "ec932285ef1b7639cb9843ca52ef408a5747097c486dbf848102701b79dfa67aa01251b0956eb882bce3df56d14cc5ef6a45f5"
+     "f09209770cfb6d7134049ade4d627f1817ef4f79b8675238e081690aea8b8a2f3e2a06740b34ef7be2488423138fae09"),
+    # 以下為隨機動作（random.Random(1..4)），遇到勝利或失敗即停止
+    ("R E D L E U E R D E R B0 L B1 D U D U D U E L R P D E R R D R E L U E U L D L E D U L S54 L S75 P L "
+     "S54 L S17 E P E E L U P U D D L D U L P E E E R U U E U D U U L D U D U P U R U L L L R E U D D U R "
+     "P R R E D R R S52 P S65 D L U L D R P U R E U R B1 P D S26 U B0 E",
+     "fbcd205e813bb5a253bb7cacbc2c6a800b783a8a3af071e9883979598ab6598ab64666d1912c4f24001024001061d507c32a4d"
+     "6426a707eb766b08a0058bc5058bc51774e327f57af70406a71bae92f74292f74292f74292f7423e0f26c912dcf086d5ecf140"
+     "4e06fb4e06fbedd220edd2208166c231afcbf3b321f3b321f3b321f3b321f3b3212ef7082ef7082ef7082ef7082ef70890f656"
+     "90f6563713c7c59dacc59dac80525280525202a3be462a0ab4d32fb4d32f5b99eb6500ed6500ed6500ed6a43dcc6f00830ab40"
+     "f8b878a4ffc22e89dd0136bd0136bd01f42b68588768588789581502cd4f51166dd5220fd5220fd5220fd5220fd5220fd5220f"
+     "d5220fd5220fd5220fd5220f910006033a04056096e469cc953bfb02fd9102fd9102fd9102fd919129c60fd4e70fd4e70fd4e7"
+     "0fd4e70fd4e70fd4e7063193bd30a58ce3798ce379de4d58f0c0a2f0c0a2f0c0a2f0c0a2a9fde068ae7568ae75c952edc952ed"
+     "0aa86a4d468c5b05ac1398d8d1a1a3"),
+    ("S81 R E D L U D E S85 D U D R L U U R U P E E B3 E R S27 D D B2 E R P L B2 U L R R R L L D L B2 R E "
+     "B0 E L U P L P U P L D L R L D E U D R U L E D D E E B3 P D L U R L L R L U U U U L S88 D L R D L U "
+     "U E U U L D U B3 E L U L U E L B2 R U U R U D U U D B0 E L D E U U P R U R E D R L R E B3 U D L B2 E",
+     "fbcd20fbcd205e813bb5a253bb7caccecf2fb80684bc2c6abc2c6abc2c6a800b78714704fda1c3cc28259a450d642213642213"
+     "642213b50a9adf78e6ac2a231885c88e93e121260790b18590b18590b1856c2014caa558caa558caa558e5b26993c32679507b"
+     "79507bb15e5ab15e5ab15e5a0273f50273f590dcfd90dcfd28055cca091385d302b00c9bcca34880a221fcf2ecfcf2ecfcf2ec"
+     "fcf2ecaba275aba275aba27564814c64814cb726e51dd1ed1dd1ed5704b543f35a410c9dfdf67d64aa30623b4bb5b573c16e5b"
+     "68b4d86043976a29d7eeee18eeee18eeee18eeee189240a650763dfdbb90fdbb90c8411e5410db8726a08726a08726a08726a0"
+     "8726a08726a08726a08726a08726a08726a08726a08726a08726a005c7ae491dd6491dd6491dd6489d5c5c45b8b8db1c1d9559"
+     "1d95591d95591d95591d955963fb0c63fb0c32588be135fae135fae135fae135fae135fa2365c728eb4828eb489c291cd8c6b9"
+     "95ee2f4f5861a0c42a888d981fa29f7d9daf7d9daf1ea6501ea6501ea650393ec85349a35349a350f17486a45dd81b1c6e8109"
+     "1090c7473566e0f582f287a52dcf5e"),
+    ("L L U R U S47 L L P L U E D R L P R R R P U R L L D L B2 B3 S62 P S85 U E D R S17 U R P L L R S58 U "
+     "U D U R R P D L L R D E D S55 D U L L L L E U R D D D L D E L E U E U L D R R D R U L R E D E R U R "
+     "D D R U B3 S48 B0 E E L D U D E R R P P U E D L R D R R U R R B3 E L P D L D E U U R P L D L D D L D "
+     "U L E R D D D D L U D P B1 P E D R R E",
+     "205f97205f979914907a731099f4e499f4e45623fd5623fd9f1544f9ab74f9ab7452e6114e3c6e8157c499b46bd922e75d456d"
+     "5d456d5d456d5d456d72fc9072fc904934f64934f64934f64934f624687f6bda0e6bda0e6bda0e6bda0e6bda0e8a1c41ee4c7c"
+     "d81087d8108744235e44235e286a8b286a8b286a8b33eb82bfc2ebff3300ff33002a91792a91792a91792a91792a91792a9179"
+     "2a91792a91792a91792a9179addcf285072c0c0315f2bf0931814161c55a61c55a61c55a61c55a891f0dd0b5d464b563c56e5d"
+     "196ff6196ff6d39a47d39a47b7054bb7054b2651c61b40b9bc9b7f04089e04089e97952c6935006935002353a62353a672a460"
+     "b72f3ab72f3ae95b56d143da226a36b0165e6ba5766ba5763edeed3edeed3edeedd6280ed85adfd9f2cafa4bde1931f369605f"
+     "df1f69e838596725a41666628a3ec34be25f4be25f4be25f4be25f9f2969314845537e938c2677e67cc5e67cc5e67cc5e67cc5"
+     "41ac2041ac2041ac208deca5cbdd962d0dc82d0dc8e81399e81399e81399bdc62cf107c4d8180cdcb365dcb365eb3cdb33f246"
+     "33f246ee724bee724bee724bee724bee724bee724b168e0daa7560aa7560aa7560aa7560aa7560a11d40490c1a7fdc7a7fdc7a"
+     "24f04224f04284ec8984ec8960ad1360ad131d53d7"),
+    ("U U D B3 E L U U B3 E E D L P P L L D R P D B2 P E D D D E U D D R D L D E L B0 U E U U U R S68 D "
+     "S74 B2 E U U R U U E D R U U L U U S15 E R U U U P E U U U P U B2 S48 R E U R P B1 R R L D B3 R S61 "
+     "P R U L L B0 R R R E P R L R E L U D P U R U E E L R U R U R D P E R D E R R U D R U L L U R R S66 D "
+     "B1 B1 P E D R L U R R L L D B0 D U R E",
+     "ec932246f9925553c421d2663b2c6217390ce3be94e3be94165cb4d4258556a93b210337210337d1a497d1a497d1a497d1a497"
+     "732c61187f2c187f2cfeabe69542439542432db25ac58ad1c58ad1c58ad1f93d1ad9acb27f855a7f855a7f855a7f855ae510f1"
+     "e510f1a8774ea8774e10fce51df423b0d07eefc508829bde829bde0a299ff5843c06c23206c232f53fd78e25f47185be7185be"
+     "7185be7185be7185bec0b8f9db528ddb528d7bbda67bbda6a36862a36862a36862a36862be4866a96494a96494a96494a96494"
+     "a96494b62863b62863b62863b62863b62863b6286307c0298c80aa8c80aacbf49ccbf49ccbf49ccbf49c3feecf3feecf3feecf"
+     "9ecc3522346e64e204c74e5fc74e5fc74e5fc74e5fdb835e6669d06669d013e03cc9b6b4c9b6b4c9b6b416a24216a24216a242"
+     "453bab6e0b0fc4eab66fb37d6fb37d9dbd4c9dbd4c69c01fcfabc5cfabc56ea402ff87192a7ad0978a37978a37978a37978a37"
+     "978a37c36415c364159eb5209eb520e8b64a0f83070f83070f830724ee6a1b3b871b3b878d61bba4fadda4fadd440135554339"
+     "554339705b02705b0287999224e6ae24e6ae4106df7ce4cf7ce4cf77b9278d1480060d25060d255e6eed5e6eedc51c10c4af00"
+     "c4af00c4af00c4af0064c308"),
+]
+
+
+def act(engine, token):
+    """以動作代號直接呼叫引擎的規則方法"""
+    if token in MOVES:
+        engine.move_player(*MOVES[token])
+    elif token == "E":
+        engine.end_turn()
+    elif token == "P":
+        engine.use_skill1_on_player()
+    elif token[0] == "B":
+        engine.use_skill1_on_enemy(int(token[1]))
+    else:
+        engine.use_skill2(int(token[1]), int(token[2]))
+
+
+def digest(engine):
+    """與重構前的 Game 相同欄位的狀態摘要"""
+    doors = tuple(sorted(name for i, name in enumerate(engine.door_names) if engine.door_mask >> i & 1))
+    state = (tuple(engine.player_pos), engine.player_moves_left, engine.turn, engine.is_first_turn,
+             engine.player_turn,
+             tuple((enemy.pos[0], enemy.pos[1], enemy.dir.name, enemy.stunned) for enemy in engine.enemies),
+             tuple(engine.turn_start_player_pos), engine.skill1_uses, engine.skill2_uses,
+             engine.skill1_used_this_turn, engine.skill2_used_this_turn, engine.yellow_plate_active, doors,
+             engine.game_won, engine.game_lost, tuple(engine.action_log))
+    return hashlib.sha1(repr(state).encode("utf-8")).hexdigest()[:6]
+
+
+def random_ops(seed, count):
+    """隨機的錄影操作：(操作代碼, 格子索引)，包含撤銷、重做與技能點擊"""
+    rng = random.Random(seed)
+    ops = []
+    for _ in range(count):
+        r = rng.random()
+        if r < 0.6:
+            ops.append((int(rng.random() * 4), None))
+        elif r < 0.7:
+            ops.append((replay.END_TURN, None))
+        elif r < 0.8:
+            ops.append((replay.UNDO, None))
+        elif r < 0.85:
+            ops.append((replay.REDO, None))
+        else:
+            ops.append((replay.SELECT_SKILL1 if r < 0.92 else replay.SELECT_SKILL2, None))
+            ops.append((replay.CLICK, int(rng.random() * 64)))
+    return ops
+
+
+def play(seed, count=300):
+    """以 Recorder 執行隨機操作，回傳 (engine, recorder)；遊戲結束時重新開始"""
+    engine = Engine()
+    recorder = replay.Recorder(engine)
+    for op, cell in random_ops(seed, count):
+        if engine.game_won or engine.game_lost:
+            recorder.apply(replay.RESTART)
+        recorder.apply(op, cell)
+    return engine, recorder
+
+
+class BaselineTraceTest(unittest.TestCase):
+    def test_matches_original_game(self):
+        for tokens, expected in BASELINE_TRACES:
+            engine = Engine()
+            for step, token in enumerate(tokens.split()):
+                act(engine, token)
+                self.assertEqual(digest(engine), expected[step * 6:step * 6 + 6],
+                                 f"第 {step} 步（{token}）與原版不同")
+            self.assertEqual(len(expected), len(tokens.split()) * 6)
+
+    def test_solution_wins(self):
+        engine = Engine()
+        for token in BASELINE_TRACES[0][0].split():
+            act(engine, token)
+        self.assertTrue(engine.game_won)
+        self.assertEqual(engine.turn, 7)
+
+
+class HistoryTest(unittest.TestCase):
+    def check_undo_redo(self, engine):
+        before = []  # 每個記入歷史的動作之前的狀態
+        rng = random.Random(7)
+        for _ in range(400):
+            if engine.game_won or engine.game_lost:
+                break
+            state = engine.get_state()
+            count = len(engine.history) + engine.history.dropped  # 超過記憶體上限時舊記錄會被丟棄
+            act(engine, "UDLRUDLRUDLRE"[int(rng.random() * 13)] if rng.random() < 0.9
+                else rng.choice(["P", "B0", "B2", "S45", "S77"]))
+            if len(engine.history) + engine.history.dropped > count:
+                before.append(state)
+        end = engine.get_state()
+        undone = 0
+        while engine.undo():
+            undone += 1
+            self.assertEqual(engine.get_state(), before[-undone])
+        self.assertEqual(engine.history.redo_count, undone)
+        for _ in range(undone):
+            self.assertTrue(engine.redo())
+        self.assertEqual(engine.get_state(), end)
+        return undone, len(before)
+
+    def test_undo_redo_round_trip(self):
+        undone, recorded = self.check_undo_redo(Engine())
+        self.assertEqual(undone, recorded)
+
+    def test_memory_budget_drops_oldest(self):
+        engine = Engine()
+        engine.history = History(keyframe_interval=8, memory_budget=4000)
+        undone, recorded = self.check_undo_redo(engine)
+        self.assertLess(undone, recorded)
+        self.assertLessEqual(engine.history.memory_used, 4000)
+
+    def test_corrupt_bytes_give_empty_history(self):
+        engine, _ = play(3)
+        data = engine.history.to_bytes()
+        history = History.from_bytes(data[:COUNTS.size + 10], lambda values: values)
+        self.assertIsNone(history.undo(engine.get_state()))
+        self.assertEqual(len(history), 0)
+        with self.assertRaises(ValueError):
+            History.from_bytes(data[:COUNTS.size - 1], lambda values: values)
+
+
+class ReplayTest(unittest.TestCase):
+    def test_verify_and_seek(self):
+        engine, recorder = play(1)
+        data = recorder.to_bytes()
+        playback = replay.Replay(data)
+        self.assertTrue(playback.verify())
+        self.assertEqual(playback.engine.get_state(), engine.get_state())
+        turn = max(playback.turn_index)
+        playback.seek_turn(turn)
+        self.assertEqual(playback.engine.turn, turn)
+        self.assertTrue(playback.verify())
+
+    def test_verify_detects_mismatch(self):
+        _, recorder = play(2)
+        data = bytearray(recorder.to_bytes())
+        data[-1] ^= 0xFF
+        self.assertFalse(replay.Replay(bytes(data)).verify())
+
+
+class SaveGameTest(unittest.TestCase):
+    def test_round_trip(self):
+        engine, recorder = play(4)
+        for _ in range(5):
+            engine.undo()
+        data = savegame.dumps(engine, recorder)
+        loaded = Engine()
+        loaded_recorder = replay.Recorder(loaded)
+        savegame.loads(data, loaded, loaded_recorder)
+        self.assertEqual(loaded.get_state(), engine.get_state())
+        self.assertEqual(len(loaded.history), len(engine.history))
+        self.assertEqual(loaded.history.redo_count, engine.history.redo_count)
+        self.assertEqual(loaded_recorder.to_bytes(), recorder.to_bytes())
+        while engine.undo():
+            self.assertTrue(loaded.undo())
+            self.assertEqual(loaded.get_state(), engine.get_state())
+        self.assertFalse(loaded.undo())
+
+    def test_continued_recording_replays(self):
+        engine, recorder = play(5)
+        data = savegame.dumps(engine, recorder)
+        loaded = Engine()
+        loaded_recorder = replay.Recorder(loaded)
+        savegame.loads(data, loaded, loaded_recorder)
+        for op in range(4):
+            loaded_recorder.apply(op)
+        self.assertTrue(replay.Replay(loaded_recorder.to_bytes()).verify())
+
+    def test_truncated_and_corrupt_saves(self):
+        engine, recorder = play(6)
+        data = savegame.dumps(engine, recorder)
+        target = Engine()
+        initial = target.get_state()
+        damaged = [data[:length] for length in (0, 6, 20, len(data) // 2, len(data) - 1)]
+        damaged.append(data[:40] + bytes([data[40] ^ 1]) + data[41:])
+        for bad in damaged:
+            with self.assertRaises(ValueError):
+                savegame.loads(bad, target)
+            self.assertEqual(target.get_state(), initial)
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, "save.sbs")
+            with open(path, "wb") as f:
+                f.write(data[:len(data) // 2])
+            self.assertFalse(savegame.resumable(path))
+            savegame.save(engine, path)
+            self.assertEqual(savegame.resumable(path), not (engine.game_won or engine.game_lost))
+
+
+if __name__ == "__main__":
+    unittest.main()